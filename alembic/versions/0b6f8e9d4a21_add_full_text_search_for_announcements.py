@@ -0,0 +1,70 @@
+"""add full text search for announcements
+
+Revision ID: 0b6f8e9d4a21
+Revises: 61d1051855e7
+Create Date: 2026-10-18 11:05:52.730914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6f8e9d4a21'
+down_revision = '61d1051855e7'
+branch_labels = None
+depends_on = None
+
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_fts USING fts5("
+    "address, description, content='announcements', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ai AFTER INSERT ON announcements BEGIN "
+    "INSERT INTO announcements_fts(rowid, address, description) VALUES (new.id, new.address, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_ad AFTER DELETE ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_fts_au AFTER UPDATE OF address, description ON announcements BEGIN "
+    "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+    "VALUES ('delete', old.id, old.address, old.description); "
+    "INSERT INTO announcements_fts(rowid, address, description) VALUES (new.id, new.address, new.description); "
+    "END",
+    # index the existing rows
+    "INSERT INTO announcements_fts(announcements_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS announcements_fts_au",
+    "DROP TRIGGER IF EXISTS announcements_fts_ad",
+    "DROP TRIGGER IF EXISTS announcements_fts_ai",
+    "DROP TABLE IF EXISTS announcements_fts",
+]
+
+# the generated column is computed for the existing rows by the ALTER itself
+POSTGRES_UPGRADE = [
+    "ALTER TABLE announcements ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+    "(to_tsvector('simple', coalesce(address, '') || ' ' || coalesce(description, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_announcements_search_vector ON announcements USING gin (search_vector)",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_announcements_search_vector",
+    "ALTER TABLE announcements DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    statements = {"sqlite": SQLITE_UPGRADE, "postgresql": POSTGRES_UPGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    statements = {"sqlite": SQLITE_DOWNGRADE, "postgresql": POSTGRES_DOWNGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
@@ -0,0 +1,36 @@
+"""add indexes for announcement filters
+
+Revision ID: 15f9e790a3f9
+Revises: 75aa03537223
+Create Date: 2026-10-18 09:12:40.518214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '15f9e790a3f9'
+down_revision = '75aa03537223'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_announcements_type_rooms_count_price', 'announcements', ['type', 'rooms_count', 'price'], unique=False)
+    op.create_index('ix_announcements_rooms_count_price', 'announcements', ['rooms_count', 'price'], unique=False)
+    op.create_index('ix_announcements_price', 'announcements', ['price'], unique=False)
+    op.create_index('ix_announcements_owner_id', 'announcements', ['owner_id'], unique=False)
+    op.create_index(op.f('ix_comments_announce_id'), 'comments', ['announce_id'], unique=False)
+    op.create_index('ix_faborites_user_id_announcement_id', 'faborites', ['user_id', 'announcement_id'], unique=False)
+    op.create_index('ix_faborites_announcement_id', 'faborites', ['announcement_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_faborites_announcement_id', table_name='faborites')
+    op.drop_index('ix_faborites_user_id_announcement_id', table_name='faborites')
+    op.drop_index(op.f('ix_comments_announce_id'), table_name='comments')
+    op.drop_index('ix_announcements_owner_id', table_name='announcements')
+    op.drop_index('ix_announcements_price', table_name='announcements')
+    op.drop_index('ix_announcements_rooms_count_price', table_name='announcements')
+    op.drop_index('ix_announcements_type_rooms_count_price', table_name='announcements')
@@ -0,0 +1,68 @@
+"""add coordinates to announcements
+
+Revision ID: 5c3a9e7b1f02
+Revises: 0b6f8e9d4a21
+Create Date: 2026-10-18 12:20:14.602731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c3a9e7b1f02'
+down_revision = '0b6f8e9d4a21'
+branch_labels = None
+depends_on = None
+
+
+RTREE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ai AFTER INSERT ON announcements BEGIN "
+    "INSERT INTO announcements_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon "
+    "WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ad AFTER DELETE ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS announcements_rtree_au AFTER UPDATE OF lat, lon ON announcements BEGIN "
+    "DELETE FROM announcements_rtree WHERE id = old.id; "
+    "INSERT INTO announcements_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon "
+    "WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL; "
+    "END",
+]
+
+RTREE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS announcements_rtree_au",
+    "DROP TRIGGER IF EXISTS announcements_rtree_ad",
+    "DROP TRIGGER IF EXISTS announcements_rtree_ai",
+    "DROP TABLE IF EXISTS announcements_rtree",
+]
+
+
+# the R*Tree is only there when the SQLite build has it, otherwise the geohash index does the job
+def has_rtree() -> bool:
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    return bool(bind.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_RTREE')").scalar())
+
+
+def upgrade() -> None:
+    op.add_column('announcements', sa.Column('lat', sa.Float(), nullable=True))
+    op.add_column('announcements', sa.Column('lon', sa.Float(), nullable=True))
+    op.add_column('announcements', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_announcements_geohash', 'announcements', ['geohash'], unique=False)
+    if has_rtree():
+        for statement in RTREE_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        for statement in RTREE_DOWNGRADE:
+            op.execute(statement)
+    op.drop_index('ix_announcements_geohash', table_name='announcements')
+    op.drop_column('announcements', 'geohash')
+    op.drop_column('announcements', 'lon')
+    op.drop_column('announcements', 'lat')
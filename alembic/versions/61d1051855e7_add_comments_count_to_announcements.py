@@ -0,0 +1,30 @@
+"""add comments_count to announcements
+
+Revision ID: 61d1051855e7
+Revises: 15f9e790a3f9
+Create Date: 2026-10-18 09:47:05.164338
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '61d1051855e7'
+down_revision = '15f9e790a3f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('announcements', sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+    # backfill the counter from the existing comments
+    op.execute(
+        "UPDATE announcements SET comments_count = "
+        "(SELECT count(*) FROM comments WHERE comments.announce_id = announcements.id)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('announcements') as batch_op:
+        batch_op.drop_column('comments_count')
@@ -0,0 +1,61 @@
+"""store comment created_at as a timestamp
+
+Revision ID: 7d0e5b2c8f14
+Revises: e4d21c7a9b36
+Create Date: 2026-10-18 14:11:36.480219
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d0e5b2c8f14'
+down_revision = 'e4d21c7a9b36'
+branch_labels = None
+depends_on = None
+
+
+# values were written as str(datetime.datetime.now()), anything else sorts first
+def parse_created_at(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.datetime(1970, 1, 1)
+
+
+def format_created_at(value):
+    return None if value is None else str(value)
+
+
+# same swap through a temporary column as the area migration
+def convert_created_at(type_, convert) -> None:
+    op.add_column('comments', sa.Column('created_at_converted', type_, nullable=True))
+    comments = sa.table('comments', sa.column('id', sa.Integer), sa.column('created_at'),
+                        sa.column('created_at_converted', type_))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(comments.c.id, comments.c.created_at)).all()
+    values = [{"row_id": id, "converted": convert(created_at)} for id, created_at in rows]
+    if values:
+        bind.execute(
+            comments.update()
+            .where(comments.c.id == sa.bindparam("row_id"))
+            .values(created_at_converted=sa.bindparam("converted")),
+            values,
+        )
+    op.drop_column('comments', 'created_at')
+    op.alter_column('comments', 'created_at_converted', new_column_name='created_at')
+
+
+def upgrade() -> None:
+    op.drop_index('ix_comments_announce_id', table_name='comments')
+    convert_created_at(sa.DateTime(), parse_created_at)
+    op.create_index('ix_comments_announce_id_created_at_id', 'comments', ['announce_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_announce_id_created_at_id', table_name='comments')
+    convert_created_at(sa.String(), format_created_at)
+    op.create_index('ix_comments_announce_id', 'comments', ['announce_id'], unique=False)
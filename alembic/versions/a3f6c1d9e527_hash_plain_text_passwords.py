@@ -0,0 +1,60 @@
+"""hash plain text passwords
+
+Revision ID: a3f6c1d9e527
+Revises: 7d0e5b2c8f14
+Create Date: 2026-10-18 16:02:19.114823
+
+"""
+import base64
+import hashlib
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f6c1d9e527'
+down_revision = '7d0e5b2c8f14'
+branch_labels = None
+depends_on = None
+
+
+# cheap enough to hash every row during the deploy, UsersRepository.authenticate
+# rehashes with PASSWORD_HASH_ITERATIONS on the next successful login
+MIGRATION_ITERATIONS = 10000
+
+# the stored format as of this revision, kept here so later changes to app.passwords
+# do not change what the migration writes
+ALGORITHM = "pbkdf2_sha256"
+
+
+# "pbkdf2_sha256$<iterations>$<salt>$<hash>", salt and hash in url-safe base64
+def hash_password(password: str) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, MIGRATION_ITERATIONS)
+    return "$".join([ALGORITHM, str(MIGRATION_ITERATIONS), base64.urlsafe_b64encode(salt).decode(),
+                     base64.urlsafe_b64encode(digest).decode()])
+
+
+def upgrade() -> None:
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('password', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(users.c.id, users.c.password)).all()
+    values = [
+        {"row_id": id, "hashed": hash_password(password)}
+        for id, password in rows
+        if password is not None and not password.startswith(ALGORITHM + "$")
+    ]
+    if values:
+        bind.execute(
+            users.update()
+            .where(users.c.id == sa.bindparam("row_id"))
+            .values(password=sa.bindparam("hashed")),
+            values,
+        )
+
+
+def downgrade() -> None:
+    # hashes can not be turned back into passwords, they keep working after a downgrade
+    pass
@@ -0,0 +1,53 @@
+"""add popular announcements ranking
+
+Revision ID: c8e2f4a6b913
+Revises: a3f6c1d9e527
+Create Date: 2026-10-18 19:12:41.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2f4a6b913'
+down_revision = 'a3f6c1d9e527'
+branch_labels = None
+depends_on = None
+
+
+# the default POPULAR_FAVORITE_WEIGHT and POPULAR_COMMENT_WEIGHT, the periodic rebuild
+# (python -m app.popular) recomputes the scores with the configured weights
+FAVORITE_WEIGHT = 3
+COMMENT_WEIGHT = 1
+
+
+def upgrade() -> None:
+    op.create_table(
+        'popular_announcements',
+        sa.Column('announcement_id', sa.Integer(), nullable=False),
+        sa.Column('city', sa.String(), nullable=True),
+        sa.Column('favorites_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('score', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['announcement_id'], ['announcements.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('announcement_id'),
+    )
+    op.create_index('ix_popular_announcements_city_score_id', 'popular_announcements', ['city', 'score', 'announcement_id'])
+    op.create_index('ix_popular_announcements_score_id', 'popular_announcements', ['score', 'announcement_id'])
+    # the first ranking, the same rows python -m app.popular builds with the default weights
+    op.execute(
+        "INSERT INTO popular_announcements (announcement_id, city, favorites_count, comments_count, score) "
+        "SELECT id, city, favorites_count, comments_count, "
+        f"favorites_count * {FAVORITE_WEIGHT} + comments_count * {COMMENT_WEIGHT} FROM ("
+        "SELECT announcements.id, users.city, announcements.comments_count, "
+        "(SELECT count(*) FROM faborites WHERE faborites.announcement_id = announcements.id) AS favorites_count "
+        "FROM announcements LEFT OUTER JOIN users ON users.id = announcements.owner_id"
+        ") AS ranking WHERE favorites_count > 0 OR comments_count > 0"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_popular_announcements_score_id', table_name='popular_announcements')
+    op.drop_index('ix_popular_announcements_city_score_id', table_name='popular_announcements')
+    op.drop_table('popular_announcements')
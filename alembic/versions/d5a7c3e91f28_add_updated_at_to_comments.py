@@ -0,0 +1,26 @@
+"""add updated_at to comments
+
+Revision ID: d5a7c3e91f28
+Revises: c8e2f4a6b913
+Create Date: 2026-10-18 21:04:52.318640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a7c3e91f28'
+down_revision = 'c8e2f4a6b913'
+branch_labels = None
+depends_on = None
+
+
+# edits used to overwrite created_at, those comments keep the edit time as their created_at
+def upgrade() -> None:
+    op.add_column('comments', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('comments') as batch_op:
+        batch_op.drop_column('updated_at')
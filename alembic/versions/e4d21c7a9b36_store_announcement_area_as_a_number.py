@@ -0,0 +1,60 @@
+"""store announcement area as a number
+
+Revision ID: e4d21c7a9b36
+Revises: 5c3a9e7b1f02
+Create Date: 2026-10-18 13:02:47.118052
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4d21c7a9b36'
+down_revision = '5c3a9e7b1f02'
+branch_labels = None
+depends_on = None
+
+
+# same rules as announcement_models.parse_area: "150m2" -> 150.0, "45,5 м²" -> 45.5, "" -> NULL
+def parse_area(value):
+    match = re.search(r"\d+(?:[.,]\d+)?", value or "")
+    if match is None:
+        return None
+    return float(match.group().replace(",", "."))
+
+
+def format_area(value):
+    return None if value is None else f"{value:g}"
+
+
+# the column is swapped through a temporary one instead of a batch copy of the table,
+# so the full text and R*Tree triggers on announcements stay in place
+def convert_area(type_, convert) -> None:
+    op.add_column('announcements', sa.Column('area_converted', type_, nullable=True))
+    announcements = sa.table('announcements', sa.column('id', sa.Integer), sa.column('area'),
+                             sa.column('area_converted', type_))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(announcements.c.id, announcements.c.area)).all()
+    values = [{"row_id": id, "converted": convert(area)} for id, area in rows]
+    if values:
+        bind.execute(
+            announcements.update()
+            .where(announcements.c.id == sa.bindparam("row_id"))
+            .values(area_converted=sa.bindparam("converted")),
+            values,
+        )
+    op.drop_column('announcements', 'area')
+    op.alter_column('announcements', 'area_converted', new_column_name='area')
+
+
+def upgrade() -> None:
+    convert_area(sa.Float(), parse_area)
+    op.create_index('ix_announcements_area', 'announcements', ['area'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_announcements_area', table_name='announcements')
+    convert_area(sa.String(), format_area)
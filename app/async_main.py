@@ -0,0 +1,374 @@
+import datetime
+from typing import Literal
+
+from fastapi import FastAPI, Response, Request, Form, HTTPException, Depends, Query
+from starlette.concurrency import run_in_threadpool
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import COMMENTS_PAGE_SIZE, COMMENTS_MAX_PAGE_SIZE, POPULAR_PAGE_SIZE, POPULAR_MAX_PAGE_SIZE
+from .database import AsyncSessionLocal, log_database_settings
+from .auth import encode, get_current_user_id, token_cache
+from .main import (
+    parse_cursor, parse_geo, change_response, is_exist_comment_announce,
+    announce_cache, invalidate_announce, post_import, get_export,
+    password_hasher_busy, search_unavailable, get_metrics, write_behind, start_write_behind, stop_write_behind,
+    start_popular_rebuilder, stop_popular_rebuilder,
+)
+from .passwords import PasswordHasherBusy
+from .search import SearchUnavailable
+from .instrumentation import InstrumentationMiddleware
+from .pagination import encode_cursor
+from .unit_of_work import UnitOfWorkRoute, on_commit
+from .responses import comment_serializer, favorites_serializer, popular_serializer, json_response, response_class
+from .repositories.users_repository import UserCreate, AsyncUsersRepository, UserUpdate
+from .repositories.announcement_repository import AsyncAnnouncementsRepository, CreateAnnounce, UpdateAnnounce
+from .repositories.comments_repository import CommentCreate, CommentUpdate, AsyncCommentsRepository
+from .repositories.favorites_repository import CreateFavorites, AsyncFavoriteRepositories
+from .repositories.popular_repository import AsyncPopularRepository
+
+# models
+from .models.users_models import CreateAuthRequest, ReadUserRequest, UpdateUserRequest
+from .models.announcement_models import CreateAnnounceRequest, AnnounceResponse
+from .models.comments_models import CreateCommentRequest
+
+
+# the same API as app.main served by async def routes on the async engine,
+# selected with DATABASE_ASYNC=1 (see scripts/launch.sh)
+app = FastAPI(default_response_class=response_class)
+app.router.route_class = UnitOfWorkRoute
+app.add_middleware(InstrumentationMiddleware)
+
+
+# All database repository
+users_repository = AsyncUsersRepository()
+announce_repository = AsyncAnnouncementsRepository()
+comments_repository = AsyncCommentsRepository()
+favorites_repository = AsyncFavoriteRepositories()
+popular_repository = AsyncPopularRepository()
+
+
+# committed by UnitOfWorkRoute like the sync get_db
+async def get_db(request: Request):
+    if AsyncSessionLocal is None:
+        raise RuntimeError("app.async_main needs DATABASE_ASYNC=1")
+    async with AsyncSessionLocal() as db:
+        request.state.db = db
+        yield db
+
+
+@app.on_event("startup")
+def on_startup():
+    log_database_settings()
+
+
+app.on_event("startup")(start_write_behind)
+app.on_event("shutdown")(stop_write_behind)
+app.on_event("startup")(start_popular_rebuilder)
+app.on_event("shutdown")(stop_popular_rebuilder)
+app.add_exception_handler(PasswordHasherBusy, password_hasher_busy)
+app.add_exception_handler(SearchUnavailable, search_unavailable)
+app.get("/metrics", include_in_schema=False)(get_metrics)
+
+
+@app.get("/")
+async def root(request: Request):
+    pass
+
+
+@app.post("/auth/users/", tags=["auth"])
+async def post_register(user: CreateAuthRequest, db: AsyncSession = Depends(get_db)):
+    db_user = await users_repository.get_by_username(username=user.username, db=db)
+    if db_user is not None:
+        raise HTTPException(status_code=401, detail={"username": user.username, "msg": "We already have such a username."})
+    user_db = UserCreate(**user.dict())
+    await users_repository.create_user(user=user_db, db=db)
+    return Response(status_code=200)
+
+
+@app.post("/auth/users/login", tags=["auth"])
+async def post_login(username: str = Form(), password: str = Form(), db: AsyncSession = Depends(get_db)):
+    db_user = await users_repository.authenticate(username=username, password=password, db=db)
+    if db_user is None:
+        raise HTTPException(status_code=401, detail="your username or password is incorrect")
+    token = encode(str(db_user.id))
+    return {
+        "access_token": token,
+    }
+
+
+@app.get("/auth/users/me", tags=["Profile"])
+async def get_profile(user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user = token_cache.get_profile(user_id)
+    if user is not None:
+        return user
+    db_user = await users_repository.get_by_id(user_id=user_id, db=db)
+    if db_user is None:
+        raise HTTPException(status_code=401, detail={"user_id": user_id, "msg": "this users not found"})
+
+    user = ReadUserRequest(id=user_id, username=db_user.username, phone=db_user.phone, name=db_user.name, city=db_user.city)
+    token_cache.set_profile(user_id, user)
+    return user
+
+
+@app.patch("/auth/users/me", tags=["Profile"])
+async def update_user(user: UpdateUserRequest, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    if user_id is None:
+        raise HTTPException(status_code=401, detail={"user_id": user_id, "msg": "this users not found"})
+    send_user = UserUpdate(**user.dict())
+    await users_repository.update_user(user_id=user_id, user=send_user, db=db)
+    on_commit(db, lambda: token_cache.invalidate_user(user_id))
+    return Response(status_code=200)
+
+
+@app.delete("/auth/users/me", tags=["Profile"])
+async def delete_user(user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    await users_repository.delete_user(user_id=user_id, db=db)
+    on_commit(db, lambda: token_cache.invalidate_user(user_id))
+
+
+@app.post("/shanyraks/", tags=["shanyraks"])
+async def post_announce(shanyrak: CreateAnnounceRequest, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    new_shanyrak = CreateAnnounce(**shanyrak.dict(), owner_id=user_id)
+
+    id = await announce_repository.create_announce(shanyrak=new_shanyrak, db=db)
+    return {"id": str(id)}
+
+
+# the importer batches its own transactions on the sync engine, it runs in the threadpool
+app.post("/shanyraks/import", tags=["shanyraks"])(post_import)
+# the export streams from a sync session of its own, starlette iterates it in the threadpool
+app.get("/shanyraks/export", tags=["Filter"])(get_export)
+
+
+@app.get("/shanyraks/facets", tags=["Filter"])
+async def get_facets(_type: str = None, rooms_count: int = None,
+                     price_from: int = None, price_until: int = None,
+                     area_from: float = None, area_until: float = None, q: str = None,
+                     lat: float = Query(None, ge=-90, le=90), lon: float = Query(None, ge=-180, le=180),
+                     radius_km: float = Query(None, gt=0, le=1000), bbox: str = None,
+                     db: AsyncSession = Depends(get_db)):
+    box = parse_geo(lat=lat, lon=lon, radius_km=radius_km, bbox=bbox)
+    facets = await announce_repository.facet_announce(_type=_type, rooms_count=rooms_count,
+                                                      price_from=price_from, price_until=price_until,
+                                                      area_from=area_from, area_until=area_until, q=q,
+                                                      lat=lat, lon=lon, radius_km=radius_km, bbox=box, db=db)
+    return json_response(facets)
+
+
+@app.get("/shanyraks/popular", tags=["Filter"])
+async def get_popular(city: str = None, limit: int = Query(POPULAR_PAGE_SIZE, ge=1, le=POPULAR_MAX_PAGE_SIZE),
+                      cursor: str = None, db: AsyncSession = Depends(get_db)):
+    after = parse_cursor(cursor, int, int) if cursor is not None else None
+    popular = await popular_repository.get_popular(city=city, limit=limit, after=after, db=db)
+    next_cursor = None
+    if len(popular) == limit:
+        next_cursor = encode_cursor(popular[-1].score, popular[-1].id)
+    return json_response({"shanyraks": popular_serializer(popular), "next_cursor": next_cursor})
+
+
+async def get_announce(id: int, db: AsyncSession):
+    shanyrak = await announce_repository.get_by_id(id=id, db=db)
+    if shanyrak is None:
+        raise HTTPException(status_code=404, detail={"id": id, "msg": "Oops, but there are no such announcement"})
+    return shanyrak
+
+
+@app.get("/shanyraks/{id}", tags=["shanyraks"], response_model=AnnounceResponse)
+async def get_shanyraks(id: int = 1, db: AsyncSession = Depends(get_db)):
+    if announce_cache is not None:
+        cached = await announce_cache.get_async(f"announce:{id}")
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+    shanyrak = await get_announce(id=id, db=db)
+    response_shanyrak = AnnounceResponse(
+        id=shanyrak.id,
+        type=shanyrak.type,
+        price=shanyrak.price,
+        address=shanyrak.address,
+        area=shanyrak.area,
+        rooms_count=shanyrak.rooms_count,
+        description=shanyrak.description,
+        owner_id=shanyrak.owner_id,
+        lat=shanyrak.lat,
+        lon=shanyrak.lon,
+        total_comments=shanyrak.comments_count
+    )
+    if announce_cache is None:
+        return response_shanyrak
+    content = response_shanyrak.model_dump_json().encode()
+    await announce_cache.set_async(f"announce:{id}", content)
+    return Response(content=content, media_type="application/json")
+
+
+@app.patch("/shanyraks/{id}", tags=["shanyraks"])
+async def update_announce(shanyrak: CreateAnnounceRequest, id: int, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user_id = int(user_id)
+    db_announce = await get_announce(id=id, db=db)
+    if db_announce.owner_id != user_id:
+        raise HTTPException(status_code=403,  detail={"user_id": user_id, "msg": "You can not change this announcement"})
+    announce = UpdateAnnounce(
+        type=shanyrak.type,
+        price=shanyrak.price,
+        address=shanyrak.address,
+        area=shanyrak.area,
+        rooms_count=shanyrak.rooms_count,
+        description=shanyrak.description,
+        lat=shanyrak.lat,
+        lon=shanyrak.lon,
+    )
+    await announce_repository.update_announce(id=id, shanyrak=announce, db=db)
+    invalidate_announce(id=id, db=db)
+    return Response(status_code=200)
+
+
+@app.delete("/shanyraks/{id}", tags=["shanyraks"])
+async def delete_announce(id: int, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user_id = int(user_id)
+    db_announce = await get_announce(id=id, db=db)
+    if db_announce.owner_id != user_id:
+        raise HTTPException(status_code=403,  detail={"user_id": user_id, "msg": "You can not delete this announcement"})
+    await announce_repository.delete_announce(id=id, db=db)
+    invalidate_announce(id=id, db=db)
+    return Response(status_code=200)
+
+
+@app.post("/shanyraks/{id}/comments", tags=["Comments"])
+async def post_comment(id: int, comment: CreateCommentRequest, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    db_announce = await announce_repository.get_by_id(id=id, db=db)
+    if db_announce is None:
+        raise HTTPException(status_code=404, detail="Not found this Announcement")
+    request_comment = CommentCreate(
+        content=comment.content,
+        author_id=user_id,
+        announce_id=id
+    )
+    # the journal append fsyncs, it stays off the event loop
+    if write_behind is not None:
+        await run_in_threadpool(write_behind.add_comment, request_comment)
+        return Response(status_code=202)
+    await comments_repository.create_comment(comment=request_comment, db=db)
+    invalidate_announce(id=id, db=db)
+    return Response(status_code=200)
+
+
+@app.get("/shanyraks/{id}/comments", tags=["Comments"])
+async def get_comments(id: int, limit: int = Query(COMMENTS_PAGE_SIZE, ge=1, le=COMMENTS_MAX_PAGE_SIZE),
+                       cursor: str = None, order: Literal["oldest", "newest"] = "oldest",
+                       db: AsyncSession = Depends(get_db)):
+    after = parse_cursor(cursor, datetime.datetime.fromisoformat, int) if cursor is not None else None
+    db_announce = await announce_repository.get_by_id(id=id, db=db)
+    if db_announce is None:
+        raise HTTPException(status_code=404, detail="Not found this Announcement")
+    comments = await comments_repository.get_response_comments(announce_id=id, limit=limit, order=order, after=after, db=db)
+    next_cursor = None
+    if len(comments) == limit:
+        next_cursor = encode_cursor(comments[-1].created_at.isoformat(), comments[-1].id)
+    return json_response({"comments": comment_serializer(comments), "next_cursor": next_cursor})
+
+
+@app.patch("/shanyraks/{id}/comments/{comment_id}", tags=["Comments"])
+async def update_comment(id: int, comment_id: int, comment: CreateCommentRequest, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    user_id = int(user_id)
+    db_announce = await announce_repository.get_by_id(id=id, db=db)
+    db_comment = await comments_repository.get_comment_by_announce(comment_id=comment_id, announce_id=id, db=db)
+    is_exist_comment_announce(db_announce=db_announce, db_comment=db_comment)
+
+    if db_comment.author_id != user_id:
+        raise HTTPException(status_code=405, detail={"user_id": user_id, "msg": "Ooops, sory but you can't update this comment"})
+
+    new_comment = CommentUpdate(content=comment.content)
+    await comments_repository.update_comment(comment_id=comment_id, new_comment=new_comment, db=db)
+    return Response(status_code=200)
+
+
+@app.delete("/shanyraks/{id}/comments/{comment_id}", tags=["Comments"])
+async def delete_comment(
+        id: int,
+        comment_id: int,
+        user_id: str = Depends(get_current_user_id),
+        db: AsyncSession = Depends(get_db)
+):
+    user_id = int(user_id)
+    db_announce = await announce_repository.get_by_id(id=id, db=db)
+    db_comment = await comments_repository.get_comment_by_announce(comment_id=comment_id, announce_id=id, db=db)
+    is_exist_comment_announce(db_announce=db_announce, db_comment=db_comment)
+
+    if db_announce.owner_id == user_id or db_comment.author_id == user_id:
+        await comments_repository.delete_comment(id=comment_id, db=db)
+        invalidate_announce(id=id, db=db)
+    else:
+        raise HTTPException(status_code=403, detail={"user_id": user_id, "msg": "Bearer <token not author>"})
+    return Response(status_code=200)
+
+
+@app.post("/auth/users/favorites/shanyraks/{id}", tags=["Favorites"])
+async def post_favorites(id: int, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    db_announce = await announce_repository.get_by_id(id=id, db=db)
+    if db_announce is None:
+        raise HTTPException(status_code=404, detail="Ooops, we haven't this shanyraq")
+    add = CreateFavorites(user_id=user_id, announcement_id=id, address=db_announce.address)
+    if write_behind is not None:
+        await run_in_threadpool(write_behind.add_favorite, add)
+        return Response(status_code=202)
+    await favorites_repository.create_favorites(favorites=add, db=db)
+    return Response(status_code=200)
+
+
+@app.get("/auth/users/favorites/shanyraks", tags=["Favorites"])
+async def get_favorites(limit: int = None, cursor: str = None, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    before_id = parse_cursor(cursor, int)[0] if cursor is not None else None
+    favorites = await favorites_repository.get_response_favorites(user_id=user_id, limit=limit, before_id=before_id, db=db)
+    next_cursor = None
+    if limit is not None and favorites and len(favorites) == limit:
+        next_cursor = encode_cursor(favorites[-1].id)
+    return json_response({"shanyraks": favorites_serializer(favorites), "next_cursor": next_cursor})
+
+
+@app.delete("/auth/users/favorites/shanyraks/{id}", tags=["Favorites"])
+async def delete_favorites(id: int, user_id: str = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
+    # the favorite may still be queued, the flush ignores deletes of missing favorites
+    if write_behind is not None:
+        await run_in_threadpool(write_behind.delete_favorite, user_id, id)
+        return Response(status_code=202)
+    db_favorites = await favorites_repository.get_user_favorite(user_id=user_id, announcement_id=id, db=db)
+    if db_favorites is None:
+        raise HTTPException(status_code=404, detail="Ooops, sorry but you don't have such favorites")
+    await favorites_repository.delete_favorites(shanyrak_id=id, user_id=user_id, db=db)
+    return Response(status_code=200)
+
+
+@app.get("/shanyraks", tags=["Filter"])
+async def get_announcements(limit: int = 10, offset: int = 0, cursor: str = None,
+                            _type: str = None, rooms_count: int = None,
+                            price_from: int = None, price_until: int = None,
+                            total: Literal["exact", "estimate", "none"] = "exact",
+                            q: str = None,
+                            lat: float = Query(None, ge=-90, le=90), lon: float = Query(None, ge=-180, le=180),
+                            radius_km: float = Query(None, gt=0, le=1000), bbox: str = None,
+                            area_from: float = None, area_until: float = None,
+                            sort: Literal["price", "area", "price_per_m2"] = None,
+                            db: AsyncSession = Depends(get_db)):
+    if q and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Search results are ordered by relevance, use offset"})
+    if sort is not None and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Sorted results are paged with offset"})
+    box = parse_geo(lat=lat, lon=lon, radius_km=radius_km, bbox=bbox)
+    if lat is not None and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Results around a point are ordered by distance, use offset"})
+    before_id = parse_cursor(cursor, int)[0] if cursor is not None else None
+    announcements = await announce_repository.search_announce(limit=limit, offset=offset,
+                                                              _type=_type, rooms_count=rooms_count,
+                                                              price_from=price_from, price_until=price_until,
+                                                              before_id=before_id, total=total, q=q,
+                                                              lat=lat, lon=lon, radius_km=radius_km, bbox=box,
+                                                              area_from=area_from, area_until=area_until, sort=sort, db=db)
+    res = change_response(data=announcements["query"], lat=lat, lon=lon)
+    next_cursor = None
+    if not q and lat is None and sort is None and res and len(res) == limit:
+        next_cursor = encode_cursor(res[-1]["id"])
+    return json_response({
+        "total": announcements['total'],
+        "announcement": res,
+        "next_cursor": next_cursor
+    })
@@ -0,0 +1,63 @@
+from jose import JWTError, jwt
+
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+
+from .cache import TTLCache
+from .config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+
+oauth2_schema = OAuth2PasswordBearer(tokenUrl="/auth/users/login")
+
+
+def encode(user_id: str) -> str:
+    json_user = {"user_id": user_id}
+    token = jwt.encode(json_user, "bereke", "HS256")
+    return token
+
+
+def decode(token: str) -> int:
+    data = jwt.decode(token, "bereke", "HS256")
+    return data["user_id"]
+
+
+# verified token -> user_id, so a token pays for the HS256 check once per ttl,
+# and user_id -> profile for GET /auth/users/me.
+# update_user and delete_user must call invalidate_user
+class TokenCache:
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.tokens = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.profiles = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_user_id(self, token: str):
+        user_id = self.tokens.get(token)
+        if user_id is None:
+            user_id = decode(token)
+            self.tokens.set(token, user_id)
+        return user_id
+
+    def get_profile(self, user_id):
+        return self.profiles.get(str(user_id))
+
+    def set_profile(self, user_id, profile):
+        self.profiles.set(str(user_id), profile)
+
+    def invalidate_user(self, user_id):
+        self.profiles.delete(str(user_id))
+        self.tokens.delete_matching(lambda token, cached_id: str(cached_id) == str(user_id))
+
+    def clear(self):
+        self.tokens.clear()
+        self.profiles.clear()
+
+
+token_cache = TokenCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def get_current_user_id(token: str = Depends(oauth2_schema)):
+    try:
+        return token_cache.get_user_id(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
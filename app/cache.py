@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+lookups = registry.counter(
+    "response_cache_lookups_total", "Lookups of the response cache by result, hit or miss", ("backend", "result"),
+)
+
+
+# in-process LRU cache where every entry also expires after ttl seconds,
+# routes run in the threadpool so every access goes under the lock
+class TTLCache:
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        with self._lock:
+            for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class MemoryBackend:
+    # a dict lookup, cheap enough for the event loop
+    blocking = False
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.cache.set(key, value)
+
+    def delete(self, key: str):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+# any client speaking the redis protocol with get/set/delete (redis-py, a fake in tests).
+# an unreachable server is treated as a miss, so the endpoint falls back to the database
+class RedisBackend:
+    # a network round trip, async routes go through the threadpool
+    blocking = True
+
+    def __init__(self, client, ttl: float = 60, prefix: str = "shanyraq:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str):
+        try:
+            return self.client.get(self.prefix + key)
+        except Exception:
+            logger.warning("response cache: redis get %s failed", key, exc_info=True)
+            return None
+
+    def set(self, key: str, value: bytes):
+        try:
+            self.client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+        except Exception:
+            logger.warning("response cache: redis set %s failed", key, exc_info=True)
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception:
+            logger.warning("response cache: redis delete %s failed", key, exc_info=True)
+
+    # only the keys of this cache, the server may be shared
+    def clear(self):
+        try:
+            for key in self.client.scan_iter(match=self.prefix + "*"):
+                self.client.delete(key)
+        except Exception:
+            logger.warning("response cache: redis clear failed", exc_info=True)
+
+
+# serialized responses keyed by a string, e.g. "announce:42"
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.backend_name = type(backend).__name__.removesuffix("Backend").lower()
+
+    def get(self, key: str):
+        value = self.backend.get(key)
+        lookups.inc(backend=self.backend_name, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.backend.set(key, value)
+
+    def invalidate(self, key: str):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    async def get_async(self, key: str):
+        if self.backend.blocking:
+            return await run_in_threadpool(self.get, key)
+        return self.get(key)
+
+    async def set_async(self, key: str, value: bytes):
+        if self.backend.blocking:
+            await run_in_threadpool(self.set, key, value)
+        else:
+            self.set(key, value)
+
+
+def create_response_cache(backend: str, maxsize: int = 1024, ttl: float = 60, redis_url: str = None) -> ResponseCache:
+    if backend == "memory":
+        return ResponseCache(MemoryBackend(maxsize=maxsize, ttl=ttl))
+    if backend == "redis":
+        import redis
+
+        return ResponseCache(RedisBackend(redis.Redis.from_url(redis_url), ttl=ttl))
+    if backend == "none":
+        return None
+    raise ValueError(f"unknown response cache backend: {backend!r}")
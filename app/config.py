@@ -0,0 +1,123 @@
+import os
+
+
+def env_str(name: str, default: str = None) -> str:
+    return os.getenv(name, default)
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+LOG_LEVEL = env_str("LOG_LEVEL", "INFO")
+
+DATABASE_URL = env_str("DATABASE_URL", "sqlite:///./sql_app.db")
+DATABASE_POOL_SIZE = env_int("DATABASE_POOL_SIZE", 5)
+DATABASE_MAX_OVERFLOW = env_int("DATABASE_MAX_OVERFLOW", 10)
+DATABASE_POOL_TIMEOUT = env_float("DATABASE_POOL_TIMEOUT", 30)
+# seconds, -1 keeps connections forever
+DATABASE_POOL_RECYCLE = env_int("DATABASE_POOL_RECYCLE", -1)
+DATABASE_POOL_PRE_PING = env_bool("DATABASE_POOL_PRE_PING", False)
+
+# applied to every new SQLite connection, WAL lets readers run next to a writer
+SQLITE_JOURNAL_MODE = env_str("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = env_str("SQLITE_SYNCHRONOUS", "NORMAL")
+# milliseconds a writer waits for the lock before "database is locked"
+SQLITE_BUSY_TIMEOUT = env_int("SQLITE_BUSY_TIMEOUT", 5000)
+# negative values are KiB: -65536 is 64 MiB of page cache per connection
+SQLITE_CACHE_SIZE = env_int("SQLITE_CACHE_SIZE", -65536)
+
+# totals of GET /shanyraks are cached per filter set
+COUNT_CACHE_SIZE = env_int("COUNT_CACHE_SIZE", 1024)
+COUNT_CACHE_TTL = env_float("COUNT_CACHE_TTL", 30)
+# total=estimate stops counting after this many rows
+COUNT_ESTIMATE_LIMIT = env_int("COUNT_ESTIMATE_LIMIT", 1000)
+
+# serve the async routes of app.async_main through aiosqlite / asyncpg
+DATABASE_ASYNC = env_bool("DATABASE_ASYNC", False)
+
+# GET /shanyraks/{id} responses: memory (per process LRU), redis or none
+RESPONSE_CACHE_BACKEND = env_str("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_SIZE = env_int("RESPONSE_CACHE_SIZE", 4096)
+RESPONSE_CACHE_TTL = env_float("RESPONSE_CACHE_TTL", 60)
+REDIS_URL = env_str("REDIS_URL", "redis://localhost:6379/0")
+
+# verified tokens and loaded profiles of the auth dependency
+AUTH_CACHE_SIZE = env_int("AUTH_CACHE_SIZE", 10000)
+AUTH_CACHE_TTL = env_float("AUTH_CACHE_TTL", 300)
+
+# bulk import of announcements (POST /shanyraks/import, python -m app.import)
+IMPORT_BATCH_SIZE = env_int("IMPORT_BATCH_SIZE", 1000)
+IMPORT_MAX_ERRORS = env_int("IMPORT_MAX_ERRORS", 1000)
+
+# spatial index of the lat/lon filters: rtree (SQLite R*Tree), geohash or auto,
+# auto picks rtree when the SQLite build has it and falls back to geohash prefixes
+GEO_INDEX = env_str("GEO_INDEX", "auto")
+
+# lower edges of the price buckets of GET /shanyraks/facets, the last bucket is open ended
+FACET_PRICE_BUCKETS = tuple(int(edge) for edge in env_str(
+    "FACET_PRICE_BUCKETS", "0,100000,200000,300000,500000,1000000,10000000,30000000,50000000,100000000"
+).split(","))
+
+# encoder of the JSON responses: orjson, or stock for the plain json.dumps of starlette
+JSON_RESPONSE = env_str("JSON_RESPONSE", "orjson")
+
+# page size of GET /shanyraks/{id}/comments, limit can not go above the max
+COMMENTS_PAGE_SIZE = env_int("COMMENTS_PAGE_SIZE", 50)
+COMMENTS_MAX_PAGE_SIZE = env_int("COMMENTS_MAX_PAGE_SIZE", 200)
+
+# rows fetched per round trip by GET /shanyraks/export
+EXPORT_BATCH_SIZE = env_int("EXPORT_BATCH_SIZE", 1000)
+
+# pbkdf2-sha256 password hashes, computed on a dedicated pool of PASSWORD_HASH_WORKERS threads.
+# at most PASSWORD_HASH_QUEUE_SIZE hashes wait for a worker, logins beyond that get 503
+PASSWORD_HASH_ITERATIONS = env_int("PASSWORD_HASH_ITERATIONS", 600000)
+PASSWORD_HASH_WORKERS = env_int("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_SIZE = env_int("PASSWORD_HASH_QUEUE_SIZE", 64)
+# accept passwords still stored as plain text (and hash them on login), only for databases
+# the a3f6c1d9e527 migration has not run on yet
+PASSWORD_ALLOW_PLAIN_TEXT = env_bool("PASSWORD_ALLOW_PLAIN_TEXT", False)
+
+# per request profiles with cProfile: sent with an "X-Profile: 1" header when PROFILE_HEADER is on,
+# or for a PROFILE_SAMPLE_RATE share of requests. profiles of requests slower than
+# PROFILE_SLOW_SECONDS (or asked for by the header) are dumped to PROFILE_DIR
+PROFILE_HEADER = env_bool("PROFILE_HEADER", False)
+PROFILE_SAMPLE_RATE = env_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_SLOW_SECONDS = env_float("PROFILE_SLOW_SECONDS", 0.5)
+PROFILE_DIR = env_str("PROFILE_DIR", "profiles")
+# requests running more queries than this are logged, 0 turns the warning off
+QUERY_COUNT_WARNING = env_int("QUERY_COUNT_WARNING", 50)
+
+# write-behind of comment and favorite writes: the handlers answer 202 once a write is in the
+# journal, a background task commits them in batches every WRITE_BEHIND_INTERVAL_MS or
+# WRITE_BEHIND_BATCH_SIZE writes. off by default
+WRITE_BEHIND = env_bool("WRITE_BEHIND", False)
+WRITE_BEHIND_INTERVAL_MS = env_int("WRITE_BEHIND_INTERVAL_MS", 100)
+WRITE_BEHIND_BATCH_SIZE = env_int("WRITE_BEHIND_BATCH_SIZE", 500)
+# shared by the workers, each one journals to a subdirectory of its own
+WRITE_BEHIND_JOURNAL_DIR = env_str("WRITE_BEHIND_JOURNAL_DIR", "journal")
+# a flush the database refuses for a passing reason (locked, connection lost) keeps its writes
+# queued and journaled, the retries back off up to this many seconds apart
+WRITE_BEHIND_MAX_BACKOFF = env_float("WRITE_BEHIND_MAX_BACKOFF", 30)
+# fsync every journaled write, without it a power loss can lose acknowledged writes
+WRITE_BEHIND_FSYNC = env_bool("WRITE_BEHIND_FSYNC", True)
+
+# the popular listings of GET /shanyraks/popular: score = favorites * POPULAR_FAVORITE_WEIGHT +
+# comments * POPULAR_COMMENT_WEIGHT. every comment and favorite write updates the ranking of its
+# announcement, the whole table is rebuilt every POPULAR_REBUILD_INTERVAL seconds (0 turns it off)
+POPULAR_FAVORITE_WEIGHT = env_int("POPULAR_FAVORITE_WEIGHT", 3)
+POPULAR_COMMENT_WEIGHT = env_int("POPULAR_COMMENT_WEIGHT", 1)
+POPULAR_REBUILD_INTERVAL = env_float("POPULAR_REBUILD_INTERVAL", 3600)
+POPULAR_PAGE_SIZE = env_int("POPULAR_PAGE_SIZE", 20)
+POPULAR_MAX_PAGE_SIZE = env_int("POPULAR_MAX_PAGE_SIZE", 100)
@@ -1,15 +1,108 @@
-from sqlalchemy import create_engine
+import logging
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .config import (
+    DATABASE_ASYNC, DATABASE_URL,
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, DATABASE_POOL_RECYCLE, DATABASE_POOL_PRE_PING,
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE,
+)
+from .instrumentation import after_cursor_execute, before_cursor_execute
+
+logger = logging.getLogger(__name__)
+
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+
+def is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def get_engine_options(url) -> dict:
+    url = make_url(url)
+    options = {
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    }
+    # in-memory SQLite keeps a single connection per thread, there is no pool to size
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+    )
+    return options
 
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+# query count and time per request, see app.instrumentation
+def listen_query_events(engine):
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
 
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT:d}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE:d}")
+    cursor.close()
+
+
+connect_args = {"check_same_thread": False} if is_sqlite(SQLALCHEMY_DATABASE_URL) else {}
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **get_engine_options(SQLALCHEMY_DATABASE_URL)
 )
+if is_sqlite(SQLALCHEMY_DATABASE_URL):
+    event.listen(engine, "connect", set_sqlite_pragmas)
+listen_query_events(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+# same database through its async driver: sqlite -> aiosqlite, postgresql -> asyncpg
+def get_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+# the async stack is opt-in (DATABASE_ASYNC=1) and is used by app.async_main
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_ASYNC:
+    async_options = get_engine_options(SQLALCHEMY_DATABASE_URL)
+    # aiosqlite defaults to NullPool, file databases get the same pool as the sync engine
+    if is_sqlite(SQLALCHEMY_DATABASE_URL) and "pool_size" in async_options:
+        async_options["poolclass"] = AsyncAdaptedQueuePool
+    async_engine = create_async_engine(get_async_url(SQLALCHEMY_DATABASE_URL), **async_options)
+    if is_sqlite(SQLALCHEMY_DATABASE_URL):
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+    listen_query_events(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+# called once on startup, the pragmas are read back from a real connection
+def log_database_settings():
+    url = make_url(SQLALCHEMY_DATABASE_URL).render_as_string(hide_password=True)
+    settings = {key: value for key, value in get_engine_options(SQLALCHEMY_DATABASE_URL).items()}
+    settings["pool"] = type(engine.pool).__name__
+    settings["async"] = DATABASE_ASYNC
+    if is_sqlite(SQLALCHEMY_DATABASE_URL):
+        with engine.connect() as connection:
+            for pragma in ("journal_mode", "synchronous", "busy_timeout", "cache_size"):
+                settings[pragma] = connection.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+    logger.info("database %s %s", url, " ".join(f"{key}={value}" for key, value in settings.items()))
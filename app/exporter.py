@@ -0,0 +1,33 @@
+import zlib
+from typing import Iterator
+
+from .database import SessionLocal
+from .repositories.announcement_repository import AnnounceFilter, AnnouncementsRepository
+from .responses import ndjson_line
+
+
+class AnnouncementExporter:
+
+    def __init__(self, repository: AnnouncementsRepository, batch_size: int = 1000):
+        self.repository = repository
+        self.batch_size = batch_size
+
+    # NDJSON chunks, one per fetched batch. the export outlives the request handler,
+    # so it reads through a session of its own that is closed when the stream ends
+    def iter_ndjson(self, announce_filter: AnnounceFilter) -> Iterator[bytes]:
+        db = SessionLocal()
+        try:
+            for rows in self.repository.export_announce(db=db, announce_filter=announce_filter,
+                                                        batch_size=self.batch_size):
+                yield b"".join(ndjson_line(row._mapping) for row in rows)
+        finally:
+            db.close()
+
+    # the same chunks through one streaming gzip member
+    def iter_gzip(self, announce_filter: AnnounceFilter) -> Iterator[bytes]:
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+        for chunk in self.iter_ndjson(announce_filter):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
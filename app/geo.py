@@ -0,0 +1,182 @@
+import math
+import sqlite3
+
+from attr import define
+from sqlalchemy import column, or_, select, table
+
+from .config import GEO_INDEX
+from .database import SQLALCHEMY_DATABASE_URL, is_sqlite
+
+
+# mean length of one degree of latitude
+KM_PER_DEGREE = 111.195
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+# ~5 m cells, plenty for a listing
+GEOHASH_PRECISION = 9
+
+
+@define(frozen=True)
+class Box:
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+    def intersect(self, other: "Box") -> "Box":
+        return Box(
+            min_lat=max(self.min_lat, other.min_lat),
+            min_lon=max(self.min_lon, other.min_lon),
+            max_lat=min(self.max_lat, other.max_lat),
+            max_lon=min(self.max_lon, other.max_lon),
+        )
+
+
+# "min_lon,min_lat,max_lon,max_lat" like a GeoJSON bbox, any malformed box ends up as ValueError
+def parse_bbox(value: str) -> Box:
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(","))
+    except ValueError as e:
+        raise ValueError(f"invalid bbox: {value!r}") from e
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise ValueError(f"invalid bbox: {value!r}")
+    return Box(min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+
+
+# the box around a circle, meridians get closer to each other towards the poles
+def box_around(lat: float, lon: float, radius_km: float) -> Box:
+    delta_lat = radius_km / KM_PER_DEGREE
+    delta_lon = delta_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return Box(
+        min_lat=max(lat - delta_lat, -90.0),
+        min_lon=max(lon - delta_lon, -180.0),
+        max_lat=min(lat + delta_lat, 90.0),
+        max_lon=min(lon + delta_lon, 180.0),
+    )
+
+
+# equirectangular approximation, exact enough within a city and cheap enough to run in SQL:
+# the cosine is computed once here, the database only multiplies and adds
+def distance_squared(lat_column, lon_column, lat: float, lon: float):
+    scale = math.cos(math.radians(lat))
+    return (lat_column - lat) * (lat_column - lat) \
+        + (lon_column - lon) * scale * (lon_column - lon) * scale
+
+
+def radius_squared(radius_km: float) -> float:
+    return (radius_km / KM_PER_DEGREE) ** 2
+
+
+def distance_km(lat: float, lon: float, other_lat: float, other_lon: float) -> float:
+    scale = math.cos(math.radians(lat))
+    return KM_PER_DEGREE * math.hypot(other_lat - lat, (other_lon - lon) * scale)
+
+
+def encode_geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        current, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (current[0] + current[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            current[0] = middle
+        else:
+            current[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def geohash_cell(precision: int) -> tuple:
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+# the longest prefixes whose cells are at least as large as the box, so the box
+# touches at most 2x2 of them and its corners name all of them.
+# an empty list means the box is too large for a prefix to narrow anything down
+def geohash_prefixes(box: Box) -> list:
+    precision = 0
+    while precision < GEOHASH_PRECISION:
+        cell_lat, cell_lon = geohash_cell(precision + 1)
+        if cell_lat < box.max_lat - box.min_lat or cell_lon < box.max_lon - box.min_lon:
+            break
+        precision += 1
+    if precision == 0:
+        return []
+    corners = [(box.min_lat, box.min_lon), (box.min_lat, box.max_lon),
+               (box.max_lat, box.min_lon), (box.max_lat, box.max_lon)]
+    return sorted({encode_geohash(lat, lon, precision) for lat, lon in corners})
+
+
+# one point per announcement in an R*Tree, kept in step with lat/lon by triggers.
+# R*Tree stores 32 bit floats, so it only narrows the candidates down
+# and the exact lat/lon bounds are checked on announcements afterwards
+class RtreeGeoBackend:
+    ddl = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+        "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ai AFTER INSERT ON announcements BEGIN "
+        "INSERT INTO announcements_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon "
+        "WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL; "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS announcements_rtree_ad AFTER DELETE ON announcements BEGIN "
+        "DELETE FROM announcements_rtree WHERE id = old.id; "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS announcements_rtree_au AFTER UPDATE OF lat, lon ON announcements BEGIN "
+        "DELETE FROM announcements_rtree WHERE id = old.id; "
+        "INSERT INTO announcements_rtree SELECT new.id, new.lat, new.lat, new.lon, new.lon "
+        "WHERE new.lat IS NOT NULL AND new.lon IS NOT NULL; "
+        "END",
+    ]
+
+    rtree = table("announcements_rtree", column("id"), column("min_lat"), column("max_lat"),
+                  column("min_lon"), column("max_lon"))
+
+    def get_filters(self, announcement, box: Box) -> list:
+        candidates = select(self.rtree.c.id).where(
+            self.rtree.c.max_lat >= box.min_lat,
+            self.rtree.c.min_lat <= box.max_lat,
+            self.rtree.c.max_lon >= box.min_lon,
+            self.rtree.c.min_lon <= box.max_lon,
+        )
+        return [announcement.id.in_(candidates)]
+
+
+# range scans of the geohash index, one per prefix that covers the box
+class GeohashGeoBackend:
+    ddl = []
+
+    def get_filters(self, announcement, box: Box) -> list:
+        prefixes = geohash_prefixes(box)
+        if not prefixes:
+            return []
+        # "~" sorts after every geohash character
+        return [or_(*[(announcement.geohash >= prefix) & (announcement.geohash < prefix + "~") for prefix in prefixes])]
+
+
+def has_rtree() -> bool:
+    connection = sqlite3.connect(":memory:")
+    try:
+        return bool(connection.execute("SELECT sqlite_compileoption_used('ENABLE_RTREE')").fetchone()[0])
+    finally:
+        connection.close()
+
+
+GEO_BACKENDS = {
+    "rtree": RtreeGeoBackend,
+    "geohash": GeohashGeoBackend,
+}
+
+
+def get_geo_backend(url: str = SQLALCHEMY_DATABASE_URL, index: str = GEO_INDEX):
+    if index == "auto":
+        index = "rtree" if is_sqlite(url) and has_rtree() else "geohash"
+    if index == "rtree" and not is_sqlite(url):
+        raise ValueError("GEO_INDEX=rtree needs a SQLite database")
+    return GEO_BACKENDS[index]()
@@ -0,0 +1,48 @@
+"""Bulk import of announcements from an NDJSON or CSV feed.
+
+    python -m app.import listings.ndjson --owner-id 3
+    python -m app.import listings.csv --owner-id 3 --batch-size 5000
+    cat listings.ndjson | python -m app.import - --owner-id 3
+
+Every row is validated with CreateAnnounceRequest, valid rows are inserted in
+batched transactions and the report with per-row errors is printed as json.
+"""
+import argparse
+import json
+import sys
+
+from .config import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS
+from .database import SessionLocal
+from .importer import AnnouncementImporter, FORMATS, guess_format
+from .repositories.users_repository import User
+from .repositories.announcement_repository import AnnouncementsRepository
+from .repositories.comments_repository import Comment
+from .repositories.favorites_repository import Favorites
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.import", description="Bulk import of announcements")
+    parser.add_argument("path", help="NDJSON or CSV file, - for stdin")
+    parser.add_argument("--owner-id", type=int, required=True, help="user the announcements belong to")
+    parser.add_argument("--format", choices=FORMATS, help="guessed from the file name by default")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    format = args.format or guess_format(filename=args.path)
+    importer = AnnouncementImporter(AnnouncementsRepository(), batch_size=args.batch_size, max_errors=IMPORT_MAX_ERRORS)
+    db = SessionLocal()
+    try:
+        if args.path == "-":
+            report = importer.run(sys.stdin, format=format, owner_id=args.owner_id, db=db)
+        else:
+            with open(args.path, encoding="utf-8-sig", newline="") as lines:
+                report = importer.run(lines, format=format, owner_id=args.owner_id, db=db)
+    finally:
+        db.close()
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write("\n")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
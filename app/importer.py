@@ -0,0 +1,97 @@
+import csv
+import json
+from typing import Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .models.announcement_models import CreateAnnounceRequest
+from .repositories.announcement_repository import AnnouncementsRepository, CreateAnnounce
+
+
+FORMATS = ("ndjson", "csv")
+
+
+def guess_format(filename: str = None, content_type: str = None) -> str:
+    filename = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if filename.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+
+# yields (line number, record) where record is a dict or an error message
+def iter_records(lines: Iterable[str], format: str) -> Iterator[tuple]:
+    if format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"invalid json: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, "expected a json object"
+            continue
+        yield line_no, record
+
+
+class AnnouncementImporter:
+
+    def __init__(self, repository: AnnouncementsRepository, batch_size: int = 1000, max_errors: int = 1000):
+        self.repository = repository
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    # every row is validated with CreateAnnounceRequest, valid rows go to the database
+    # in one executemany transaction per batch. bad rows only end up in the report
+    def run(self, lines: Iterable[str], format: str, owner_id: int, db: Session) -> dict:
+        report = {"inserted": 0, "failed": 0, "errors": []}
+        batch = []
+        for line_no, record in iter_records(lines, format):
+            if isinstance(record, str):
+                self.add_error(report, line_no, record)
+                continue
+            try:
+                shanyrak = CreateAnnounceRequest.model_validate(record)
+            except ValidationError as e:
+                self.add_error(report, line_no, e.errors(include_url=False, include_context=False))
+                continue
+            batch.append((line_no, CreateAnnounce(**shanyrak.dict(), owner_id=owner_id)))
+            if len(batch) >= self.batch_size:
+                self.flush(batch, report, db)
+                batch = []
+        if batch:
+            self.flush(batch, report, db)
+        return report
+
+    # every batch is a transaction of its own, a batch rejected by the database
+    # is retried row by row to find the rows to blame
+    def flush(self, batch: list, report: dict, db: Session):
+        if len(batch) > 1:
+            try:
+                inserted = self.repository.bulk_create_announce(shanyraks=[row for _, row in batch], db=db)
+                db.commit()
+                report["inserted"] += inserted
+                return
+            except SQLAlchemyError:
+                db.rollback()
+        for line_no, row in batch:
+            try:
+                inserted = self.repository.bulk_create_announce(shanyraks=[row], db=db)
+                db.commit()
+                report["inserted"] += inserted
+            except SQLAlchemyError as e:
+                db.rollback()
+                self.add_error(report, line_no, str(getattr(e, "orig", None) or e))
+
+    def add_error(self, report: dict, line_no: int, errors):
+        report["failed"] += 1
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append({"line": line_no, "errors": errors})
@@ -0,0 +1,173 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import time
+import uuid
+
+from fastapi.routing import APIRoute
+
+from .config import PROFILE_DIR, PROFILE_HEADER, PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, QUERY_COUNT_WARNING
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Time from the request to the end of the response", ("method", "route", "status"),
+)
+request_queries = registry.histogram(
+    "http_request_db_queries", "Database queries run by one request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "Time one request spent in database queries", ("method", "route"),
+)
+query_seconds = registry.histogram("db_query_seconds", "Time of single database queries")
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "profile", "profiler", "profile_path")
+
+    def __init__(self, profile: str = None):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # None, "header" or "sample"
+        self.profile = profile
+        self.profiler = None
+        self.profile_path = None
+
+
+# the stats of the current request. the threadpool of the sync routes and the greenlets
+# of the async engine run with a copy of the request context, so they update the same object
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+# engine events, registered in database.py. queries outside of a request only count for db_query_seconds
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+# no start time when the listeners were added while a statement was running
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    query_seconds.observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def get_profile_mode(scope) -> str:
+    if PROFILE_HEADER and (b"x-profile", b"1") in scope["headers"]:
+        return "header"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def start_profile(stats: RequestStats):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profile is running in this thread
+        return None
+    stats.profiler = profiler
+    return profiler
+
+
+# runs the endpoint under cProfile when the request is profiled. sync endpoints are wrapped
+# themselves, so the profile is taken in the threadpool thread that runs them.
+# a profile of an async endpoint also sees the other tasks of the event loop while it awaits
+def profile_endpoint(endpoint):
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            stats = request_stats.get()
+            profiler = start_profile(stats) if stats is not None and stats.profile else None
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        return wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        stats = request_stats.get()
+        profiler = start_profile(stats) if stats is not None and stats.profile else None
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, profile_endpoint(endpoint), **kwargs)
+
+
+# per route latency, query count and query time of every request, with a Server-Timing header.
+# profiles asked for with the header are always written, sampled ones only for slow requests
+class InstrumentationMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(profile=get_profile_mode(scope))
+        if stats.profile is not None:
+            stats.profile_path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof")
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"'.encode()))
+                if stats.profile == "header":
+                    headers.append((b"x-profile", stats.profile_path.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = request_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            self.record(scope, stats, status, elapsed)
+
+    def record(self, scope, stats: RequestStats, status: int, elapsed: float):
+        method = scope["method"]
+        # the path template, a raw path of unmatched requests would make a label per url
+        route = getattr(scope.get("route"), "path", "unmatched")
+        request_seconds.observe(elapsed, method=method, route=route, status=str(status))
+        request_queries.observe(stats.queries, method=method, route=route)
+        request_db_seconds.observe(stats.db_seconds, method=method, route=route)
+
+        if QUERY_COUNT_WARNING and stats.queries > QUERY_COUNT_WARNING:
+            logger.warning("%s %s ran %d queries in %.1f ms", method, route, stats.queries, stats.db_seconds * 1000)
+        if stats.profiler is not None and (stats.profile == "header" or elapsed >= PROFILE_SLOW_SECONDS):
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stats.profiler.dump_stats(stats.profile_path)
+            logger.info("%s %s took %.1f ms, %d queries, profile %s",
+                        method, route, elapsed * 1000, stats.queries, stats.profile_path)
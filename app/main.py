@@ -1,26 +1,58 @@
-from jose import jwt
+import codecs
+import datetime
+import logging
+from typing import Literal
 
-from fastapi import FastAPI, Response, Request, Form, HTTPException, Depends
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import FastAPI, Response, Request, Form, HTTPException, Depends, Query, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from sqlalchemy.orm import Session
 
 from pydantic import BaseModel
 
-from .database import SessionLocal
+from .auth import encode, get_current_user_id, token_cache
+from .cache import create_response_cache
+from .config import (
+    LOG_LEVEL, RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, REDIS_URL,
+    IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS, COMMENTS_PAGE_SIZE, COMMENTS_MAX_PAGE_SIZE, EXPORT_BATCH_SIZE,
+    WRITE_BEHIND, WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_JOURNAL_DIR, WRITE_BEHIND_FSYNC,
+    WRITE_BEHIND_MAX_BACKOFF,
+    POPULAR_REBUILD_INTERVAL, POPULAR_PAGE_SIZE, POPULAR_MAX_PAGE_SIZE,
+)
+from .database import SessionLocal, log_database_settings
+from .geo import Box, distance_km, parse_bbox
+from .exporter import AnnouncementExporter
+from .importer import AnnouncementImporter, guess_format
+from .instrumentation import InstrumentationMiddleware
+from .metrics import registry
+from .pagination import encode_cursor, decode_cursor
+from .passwords import PasswordHasherBusy
+from .search import SearchUnavailable
+from .popular import PopularRebuilder
+from .unit_of_work import UnitOfWorkRoute, on_commit
+from .write_behind import Journal, WriteBehindQueue
+from .responses import (
+    announce_serializer, comment_serializer, favorites_serializer, popular_serializer, json_response, response_class,
+)
 from .repositories.users_repository import User, UserCreate, UsersRepository, UserUpdate
-from .repositories.announcement_repository import Announcement, AnnouncementsRepository, CreateAnnounce, UpdateAnnounce
+from .repositories.announcement_repository import (
+    Announcement, AnnouncementsRepository, CreateAnnounce, UpdateAnnounce, get_announce_filter,
+)
 from .repositories.comments_repository import Comment, CommentCreate, CommentUpdate, CommentsRepository
 from .repositories.favorites_repository import Favorites, CreateFavorites, FavoriteRepositories
+from .repositories.popular_repository import PopularRepository
 
 # models
 from .models.users_models import CreateAuthRequest, ReadUserRequest, UpdateUserRequest
-from .models.announcement_models import CreateAnnounceRequest, AnnounceResponse, AnnounceResponseFilter
-from .models.comments_models import CommentResponse, CreateCommentRequest
+from .models.announcement_models import CreateAnnounceRequest, AnnounceResponse
+from .models.comments_models import CreateCommentRequest
 
 
-app = FastAPI()
-oauth2_schema = OAuth2PasswordBearer(tokenUrl="/auth/users/login")
+logging.basicConfig(level=LOG_LEVEL)
+
+app = FastAPI(default_response_class=response_class)
+app.router.route_class = UnitOfWorkRoute
+app.add_middleware(InstrumentationMiddleware)
 
 
 # All database repository
@@ -28,26 +60,113 @@ users_repository = UsersRepository()
 announce_repository = AnnouncementsRepository()
 comments_repository = CommentsRepository()
 favorites_repository = FavoriteRepositories()
+popular_repository = PopularRepository()
+
+# serialized GET /shanyraks/{id} responses, None when RESPONSE_CACHE_BACKEND=none
+announce_cache = create_response_cache(RESPONSE_CACHE_BACKEND, maxsize=RESPONSE_CACHE_SIZE,
+                                       ttl=RESPONSE_CACHE_TTL, redis_url=REDIS_URL)
+
+# the cached response is dropped once the write of the request is committed
+def invalidate_announce(id: int, db):
+    if announce_cache is not None:
+        on_commit(db, lambda: announce_cache.invalidate(f"announce:{id}"))
+
 
-def encode(user_id: str) -> str:
-    json_user = {"user_id": user_id}
-    token = jwt.encode(json_user, "bereke", "HS256")
-    return token
+# the comment counts of the flushed comments change
+def invalidate_queued(ops: list[dict], db):
+    for id in {op["announce_id"] for op in ops if op["op"] == "comment"}:
+        invalidate_announce(id=id, db=db)
 
 
-def decode(token: str) -> int:
-    data = jwt.decode(token, "bereke", "HS256")
-    return data["user_id"]
+# None unless WRITE_BEHIND is on, then comments and favorites are answered with 202 once journaled
+write_behind = None
+if WRITE_BEHIND:
+    write_behind = WriteBehindQueue(SessionLocal, Journal(WRITE_BEHIND_JOURNAL_DIR, fsync=WRITE_BEHIND_FSYNC),
+                                    interval=WRITE_BEHIND_INTERVAL_MS / 1000, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                                    max_backoff=WRITE_BEHIND_MAX_BACKOFF, on_flushed=invalidate_queued)
+
+# periodic full rebuild of the popular listings ranking, None when POPULAR_REBUILD_INTERVAL=0
+popular_rebuilder = PopularRebuilder(SessionLocal, POPULAR_REBUILD_INTERVAL) if POPULAR_REBUILD_INTERVAL > 0 else None
+
+
+def parse_cursor(cursor: str, *converters) -> list:
+    try:
+        return decode_cursor(cursor, *converters)
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Invalid cursor"})
+
+
+# lat and lon go together, radius_km needs them. returns the parsed bbox
+def parse_geo(lat: float = None, lon: float = None, radius_km: float = None, bbox: str = None) -> Box:
+    if (lat is None) != (lon is None):
+        raise HTTPException(status_code=400, detail={"lat": lat, "lon": lon, "msg": "lat and lon go together"})
+    if radius_km is not None and lat is None:
+        raise HTTPException(status_code=400, detail={"radius_km": radius_km, "msg": "radius_km needs lat and lon"})
+    if bbox is None:
+        return None
+    try:
+        return parse_bbox(bbox)
+    except ValueError:
+        raise HTTPException(status_code=400, detail={"bbox": bbox, "msg": "Expected bbox=min_lon,min_lat,max_lon,max_lat"})
 
 
-def get_db():
+# the request is one unit of work, UnitOfWorkRoute commits request.state.db before the response
+def get_db(request: Request):
     db = SessionLocal()
+    request.state.db = db
     try:
         yield db
     finally:
         db.close()
 
 
+@app.on_event("startup")
+def on_startup():
+    log_database_settings()
+
+
+# the journal of a previous process is replayed before the first request
+@app.on_event("startup")
+async def start_write_behind():
+    if write_behind is not None:
+        await write_behind.start()
+
+
+@app.on_event("shutdown")
+async def stop_write_behind():
+    if write_behind is not None:
+        await write_behind.stop()
+
+
+@app.on_event("startup")
+async def start_popular_rebuilder():
+    if popular_rebuilder is not None:
+        await popular_rebuilder.start()
+
+
+@app.on_event("shutdown")
+async def stop_popular_rebuilder():
+    if popular_rebuilder is not None:
+        await popular_rebuilder.stop()
+
+
+# every password hash worker is busy and the queue is full, the client should retry shortly
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many logins, try again later"},
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(SearchUnavailable)
+def search_unavailable(request: Request, exc: SearchUnavailable):
+    return JSONResponse(status_code=400, content={"detail": {"q": str(exc), "msg": "Text search is not available on this database"}})
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 def root(request: Request):
     pass
@@ -65,52 +184,116 @@ def post_register(user: CreateAuthRequest, db: Session = Depends(get_db)):
 
 @app.post("/auth/users/login", tags=["auth"])
 def post_login(username: str = Form(), password: str = Form(), db: Session = Depends(get_db)):
-    db_user = users_repository.get_by_username(username=username, db=db)
-    if db_user is None or db_user.password != password:
+    db_user = users_repository.authenticate(username=username, password=password, db=db)
+    if db_user is None:
         raise HTTPException(status_code=401, detail="your username or password is incorrect")
-    elif db_user.password == password:
-        token = encode(str(db_user.id))
-        return {
-            "access_token": token,
-        }
+    token = encode(str(db_user.id))
+    return {
+        "access_token": token,
+    }
 
 
 @app.get("/auth/users/me", tags=["Profile"])
-def get_profile(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
+def get_profile(user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    user = token_cache.get_profile(user_id)
+    if user is not None:
+        return user
     db_user = users_repository.get_by_id(user_id=user_id, db=db)
     if db_user is None:
         raise HTTPException(status_code=401, detail={"user_id": user_id, "msg": "this users not found"})
 
     user = ReadUserRequest(id=user_id, username=db_user.username, phone=db_user.phone, name=db_user.name, city=db_user.city)
+    token_cache.set_profile(user_id, user)
     return user
 
 
 @app.patch("/auth/users/me", tags=["Profile"])
-def update_user(user: UpdateUserRequest, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
+def update_user(user: UpdateUserRequest, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
     if user_id is None:
         raise HTTPException(status_code=401, detail={"user_id": user_id, "msg": "this users not found"})
     send_user = UserUpdate(**user.dict())
     users_repository.update_user(user_id=user_id, user=send_user, db=db)
+    on_commit(db, lambda: token_cache.invalidate_user(user_id))
     return Response(status_code=200)
 
 
 @app.delete("/auth/users/me", tags=["Profile"])
-def delete_user(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
+def delete_user(user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
     users_repository.delete_user(user_id=user_id, db=db)
+    on_commit(db, lambda: token_cache.invalidate_user(user_id))
 
 
 @app.post("/shanyraks/", tags=["shanyraks"])
-def post_announce(shanyrak: CreateAnnounceRequest, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
+def post_announce(shanyrak: CreateAnnounceRequest, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
     new_shanyrak = CreateAnnounce(**shanyrak.dict(), owner_id=user_id)
 
     id = announce_repository.create_announce(shanyrak=new_shanyrak, db=db)
     return {"id": str(id)}
 
 
+# bulk ingest of agency feeds: NDJSON (one CreateAnnounceRequest object per line) or CSV with a header,
+# the upload is read line by line and inserted in batches, bad rows are reported and skipped
+@app.post("/shanyraks/import", tags=["shanyraks"])
+def post_import(file: UploadFile, format: Literal["ndjson", "csv"] = None,
+                batch_size: int = Query(IMPORT_BATCH_SIZE, ge=1, le=100000),
+                user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    format = format or guess_format(filename=file.filename, content_type=file.content_type)
+    importer = AnnouncementImporter(announce_repository, batch_size=batch_size, max_errors=IMPORT_MAX_ERRORS)
+    lines = codecs.iterdecode(file.file, "utf-8-sig")
+    return importer.run(lines, format=format, owner_id=int(user_id), db=db)
+
+
+# the whole catalog matching the filters of GET /shanyraks as NDJSON in id order, one object per line,
+# gzip=true compresses the stream. it is read in EXPORT_BATCH_SIZE batches while it is sent
+@app.get("/shanyraks/export", tags=["Filter"])
+def get_export(_type: str = None, rooms_count: int = None,
+               price_from: int = None, price_until: int = None,
+               area_from: float = None, area_until: float = None, q: str = None,
+               lat: float = Query(None, ge=-90, le=90), lon: float = Query(None, ge=-180, le=180),
+               radius_km: float = Query(None, gt=0, le=1000), bbox: str = None,
+               gzip: bool = False):
+    box = parse_geo(lat=lat, lon=lon, radius_km=radius_km, bbox=bbox)
+    announce_filter = get_announce_filter(_type=_type, rooms_count=rooms_count,
+                                          price_from=price_from, price_until=price_until,
+                                          area_from=area_from, area_until=area_until, q=q,
+                                          lat=lat, lon=lon, radius_km=radius_km, bbox=box)
+    exporter = AnnouncementExporter(announce_repository, batch_size=EXPORT_BATCH_SIZE)
+    if gzip:
+        return StreamingResponse(exporter.iter_gzip(announce_filter), media_type="application/x-ndjson",
+                                 headers={"Content-Encoding": "gzip"})
+    return StreamingResponse(exporter.iter_ndjson(announce_filter), media_type="application/x-ndjson")
+
+
+# counts per type, rooms_count and price bucket for the filters of GET /shanyraks,
+# registered before /shanyraks/{id} so "facets" is not taken for an id
+@app.get("/shanyraks/facets", tags=["Filter"])
+def get_facets(_type: str = None, rooms_count: int = None,
+               price_from: int = None, price_until: int = None,
+               area_from: float = None, area_until: float = None, q: str = None,
+               lat: float = Query(None, ge=-90, le=90), lon: float = Query(None, ge=-180, le=180),
+               radius_km: float = Query(None, gt=0, le=1000), bbox: str = None,
+               db: Session = Depends(get_db)):
+    box = parse_geo(lat=lat, lon=lon, radius_km=radius_km, bbox=bbox)
+    facets = announce_repository.facet_announce(_type=_type, rooms_count=rooms_count,
+                                                price_from=price_from, price_until=price_until,
+                                                area_from=area_from, area_until=area_until, q=q,
+                                                lat=lat, lon=lon, radius_km=radius_km, bbox=box, db=db)
+    return json_response(facets)
+
+
+# the listings with the most favorites and comments, of the owners of one city or of all of them.
+# served from the popular_announcements ranking, next_cursor continues the page
+@app.get("/shanyraks/popular", tags=["Filter"])
+def get_popular(city: str = None, limit: int = Query(POPULAR_PAGE_SIZE, ge=1, le=POPULAR_MAX_PAGE_SIZE),
+                cursor: str = None, db: Session = Depends(get_db)):
+    after = parse_cursor(cursor, int, int) if cursor is not None else None
+    popular = popular_repository.get_popular(city=city, limit=limit, after=after, db=db)
+    next_cursor = None
+    if len(popular) == limit:
+        next_cursor = encode_cursor(popular[-1].score, popular[-1].id)
+    return json_response({"shanyraks": popular_serializer(popular), "next_cursor": next_cursor})
+
+
 # this method return the announcement in database if is not exist then return exception
 def get_announce(id: int, db: Session = Depends(get_db)):
     shanyrak = announce_repository.get_by_id(id=id, db=db)
@@ -119,10 +302,14 @@ def get_announce(id: int, db: Session = Depends(get_db)):
     return shanyrak
 
 
-@app.get("/shanyraks/{id}", tags=["shanyraks"])
+@app.get("/shanyraks/{id}", tags=["shanyraks"], response_model=AnnounceResponse)
 def get_shanyraks(id: int = 1, db: Session = Depends(get_db)):
+    if announce_cache is not None:
+        cached = announce_cache.get(f"announce:{id}")
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
     shanyrak = get_announce(id=id, db=db)
-    total = len(comments_repository.get_by_announce_id(announce_id=id, db=db))
+    total = shanyrak.comments_count
     response_shanyrak = AnnounceResponse(
         id=shanyrak.id,
         type=shanyrak.type,
@@ -132,14 +319,20 @@ def get_shanyraks(id: int = 1, db: Session = Depends(get_db)):
         rooms_count=shanyrak.rooms_count,
         description=shanyrak.description,
         owner_id=shanyrak.owner_id,
+        lat=shanyrak.lat,
+        lon=shanyrak.lon,
         total_comments=total
     )
-    return response_shanyrak
+    if announce_cache is None:
+        return response_shanyrak
+    content = response_shanyrak.model_dump_json().encode()
+    announce_cache.set(f"announce:{id}", content)
+    return Response(content=content, media_type="application/json")
 
 
 @app.patch("/shanyraks/{id}", tags=["shanyraks"])
-def update_announce(shanyrak: CreateAnnounceRequest, id: int, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = int(decode(token))
+def update_announce(shanyrak: CreateAnnounceRequest, id: int, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    user_id = int(user_id)
     db_announce = get_announce(id=id, db=db)
     if db_announce.owner_id != user_id:
         raise HTTPException(status_code=403,  detail={"user_id": user_id, "msg": "You can not change this announcement"})
@@ -150,24 +343,27 @@ def update_announce(shanyrak: CreateAnnounceRequest, id: int, token: str = Depen
         area=shanyrak.area,
         rooms_count=shanyrak.rooms_count,
         description=shanyrak.description,
+        lat=shanyrak.lat,
+        lon=shanyrak.lon,
     )
     announce_repository.update_announce(id=id, shanyrak=announce, db=db)
+    invalidate_announce(id=id, db=db)
     return Response(status_code=200)
 
 
 @app.delete("/shanyraks/{id}", tags=["shanyraks"])
-def delete_announce(id: int, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = int(decode(token))
+def delete_announce(id: int, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    user_id = int(user_id)
     db_announce = get_announce(id=id, db=db)
     if db_announce.owner_id != user_id:
         raise HTTPException(status_code=403,  detail={"user_id": user_id, "msg": "You can not delete this announcement"})
     announce_repository.delete_announce(id=id, db=db)
+    invalidate_announce(id=id, db=db)
     return Response(status_code=200)
 
 
 @app.post("/shanyraks/{id}/comments", tags=["Comments"])
-def post_comment(id: int, comment: CreateCommentRequest, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-        user_id = decode(token)
+def post_comment(id: int, comment: CreateCommentRequest, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
         db_announce = announce_repository.get_by_id(id=id, db=db)
         if db_announce is None:
             raise HTTPException(status_code=404, detail="Not found this Announcement")
@@ -176,21 +372,28 @@ def post_comment(id: int, comment: CreateCommentRequest, token: str = Depends(oa
             author_id=user_id,
             announce_id=id
         )
+        if write_behind is not None:
+            write_behind.add_comment(request_comment)
+            return Response(status_code=202)
         comments_repository.create_comment(comment=request_comment, db=db)
+        invalidate_announce(id=id, db=db)
         return Response(status_code=200)
 
 
+# pages of limit comments in (created_at, id) order, oldest or newest first, next_cursor continues the page
 @app.get("/shanyraks/{id}/comments", tags=["Comments"])
-def get_comments(id: int, db: Session = Depends(get_db)):
+def get_comments(id: int, limit: int = Query(COMMENTS_PAGE_SIZE, ge=1, le=COMMENTS_MAX_PAGE_SIZE),
+                 cursor: str = None, order: Literal["oldest", "newest"] = "oldest",
+                 db: Session = Depends(get_db)):
+    after = parse_cursor(cursor, datetime.datetime.fromisoformat, int) if cursor is not None else None
     db_announce = announce_repository.get_by_id(id=id, db=db)
     if db_announce is None:
         raise HTTPException(status_code=404, detail="Not found this Announcement")
-    comments = comments_repository.get_by_announce_id(announce_id=id, db=db)
-    response_comments = []
-    for comment in comments:
-        temp = CommentResponse(id=comment.id, content=comment.content, author_id=comment.author_id, created_at=comment.created_at)
-        response_comments.append(temp)
-    return {"comments": response_comments}
+    comments = comments_repository.get_response_comments(announce_id=id, limit=limit, order=order, after=after, db=db)
+    next_cursor = None
+    if len(comments) == limit:
+        next_cursor = encode_cursor(comments[-1].created_at.isoformat(), comments[-1].id)
+    return json_response({"comments": comment_serializer(comments), "next_cursor": next_cursor})
 
 
 def is_exist_comment_announce(db_announce: Announcement, db_comment: Comment):
@@ -202,8 +405,8 @@ def is_exist_comment_announce(db_announce: Announcement, db_comment: Comment):
 
 
 @app.patch("/shanyraks/{id}/comments/{comment_id}", tags=["Comments"])
-def update_comment(id: int, comment_id: int, comment: CreateCommentRequest, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = int(decode(token))
+def update_comment(id: int, comment_id: int, comment: CreateCommentRequest, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    user_id = int(user_id)
     db_announce = announce_repository.get_by_id(id=id, db=db)
     db_comment = comments_repository.get_comment_by_announce(comment_id=comment_id, announce_id=id, db=db)
     is_exist_comment_announce(db_announce=db_announce, db_comment=db_comment)
@@ -220,79 +423,109 @@ def update_comment(id: int, comment_id: int, comment: CreateCommentRequest, toke
 def update_comment(
         id: int,
         comment_id: int,
-        token: str = Depends(oauth2_schema),
+        user_id: str = Depends(get_current_user_id),
         db: Session = Depends(get_db)
 ):
-    user_id = int(decode(token))
+    user_id = int(user_id)
     db_announce = announce_repository.get_by_id(id=id, db=db)
     db_comment = comments_repository.get_comment_by_announce(comment_id=comment_id, announce_id=id, db=db)
     is_exist_comment_announce(db_announce=db_announce, db_comment=db_comment)
 
     if db_announce.owner_id == user_id or db_comment.author_id == user_id:
         comments_repository.delete_comment(id=comment_id, db=db)
+        invalidate_announce(id=id, db=db)
     else:
         raise HTTPException(status_code=403, detail={"user_id": user_id, "msg": "Bearer <token not author>"})
     return Response(status_code=200)
 
 
 @app.post("/auth/users/favorites/shanyraks/{id}", tags=["Favorites"])
-def post_favorites(id: int, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
+def post_favorites(id: int, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
     db_announce = announce_repository.get_by_id(id=id, db=db)
     if db_announce is None:
         raise HTTPException(status_code=404, detail="Ooops, we haven't this shanyraq")
     add = CreateFavorites(user_id=user_id, announcement_id=id, address=db_announce.address)
+    if write_behind is not None:
+        write_behind.add_favorite(add)
+        return Response(status_code=202)
     favorites_repository.create_favorites(favorites=add, db=db)
     return Response(status_code=200)
 
 
 @app.get("/auth/users/favorites/shanyraks", tags=["Favorites"])
-def get_favorites(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
-    favorites = favorites_repository.get_response_favorites(user_id=user_id, db=db)
-    for i in favorites:
-        i.address = announce_repository.get_by_id(id=i.id, db=db).address
-    return {"shanyraks": favorites}
+def get_favorites(limit: int = None, cursor: str = None, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    before_id = parse_cursor(cursor, int)[0] if cursor is not None else None
+    favorites = favorites_repository.get_response_favorites(user_id=user_id, limit=limit, before_id=before_id, db=db)
+    next_cursor = None
+    if limit is not None and favorites and len(favorites) == limit:
+        next_cursor = encode_cursor(favorites[-1].id)
+    return json_response({"shanyraks": favorites_serializer(favorites), "next_cursor": next_cursor})
 
 
 @app.delete("/auth/users/favorites/shanyraks/{id}", tags=["Favorites"])
-def delete_favorites(id: int, token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
-    user_id = decode(token)
-    db_favorites = favorites_repository.get_by_announce_id(id=id, db=db)
+def delete_favorites(id: int, user_id: str = Depends(get_current_user_id), db: Session = Depends(get_db)):
+    # the favorite may still be queued, the flush ignores deletes of missing favorites
+    if write_behind is not None:
+        write_behind.delete_favorite(user_id=user_id, announcement_id=id)
+        return Response(status_code=202)
+    db_favorites = favorites_repository.get_user_favorite(user_id=user_id, announcement_id=id, db=db)
     if db_favorites is None:
         raise HTTPException(status_code=404, detail="Ooops, sorry but you don't have such favorites")
     favorites_repository.delete_favorites(shanyrak_id=id, user_id=user_id, db=db)
     return Response(status_code=200)
 
 
-def change_response(data: list[Announcement]) -> list[AnnounceResponseFilter]:
-    res = []
+# the listing rows of search_announce go to the response as plain dicts
+# with the fields of AnnounceResponseFilter, no model is built per row
+def change_response(data: list, lat: float = None, lon: float = None) -> list[dict]:
     if data is None:
-        print("wiqwrieqwe")
-        return res
-    for announcement in data:
-        new_model = AnnounceResponseFilter(
-            id=announcement.id,
-            type=announcement.type,
-            price=announcement.price,
-            address=announcement.address,
-            area=announcement.area,
-            rooms_count=announcement.rooms_count
-        )
-        res.append(new_model)
+        return []
+    res = announce_serializer(data)
+    if lat is not None:
+        for announcement in res:
+            if announcement["lat"] is not None:
+                announcement["distance_km"] = round(distance_km(lat, lon, announcement["lat"], announcement["lon"]), 3)
     return res
 
 
+# limit/offset is kept for old clients, feeds should follow next_cursor instead:
+# with a cursor the offset is ignored and every page costs the same.
+# feeds can also ask for total=estimate or total=none to skip the exact count.
+# q is a full text search over address and description, the best matches come first.
+# lat/lon sorts the listings by distance, radius_km and bbox (min_lon,min_lat,max_lon,max_lat)
+# keep only the listings inside, both combine with the other filters
+# sort=price|area|price_per_m2 orders the page in SQL, cheapest / smallest first
 @app.get("/shanyraks", tags=["Filter"])
-def get_announcements(limit: int = 10, offset: int = 0,
+def get_announcements(limit: int = 10, offset: int = 0, cursor: str = None,
                       _type: str = None, rooms_count: int = None,
                       price_from: int = None, price_until: int = None,
+                      total: Literal["exact", "estimate", "none"] = "exact",
+                      q: str = None,
+                      lat: float = Query(None, ge=-90, le=90), lon: float = Query(None, ge=-180, le=180),
+                      radius_km: float = Query(None, gt=0, le=1000), bbox: str = None,
+                      area_from: float = None, area_until: float = None,
+                      sort: Literal["price", "area", "price_per_m2"] = None,
                       db: Session = Depends(get_db)):
+    if q and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Search results are ordered by relevance, use offset"})
+    if sort is not None and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Sorted results are paged with offset"})
+    box = parse_geo(lat=lat, lon=lon, radius_km=radius_km, bbox=bbox)
+    if lat is not None and cursor is not None:
+        raise HTTPException(status_code=400, detail={"cursor": cursor, "msg": "Results around a point are ordered by distance, use offset"})
+    before_id = parse_cursor(cursor, int)[0] if cursor is not None else None
     announcements = announce_repository.search_announce(limit=limit, offset=offset,
                                          _type=_type, rooms_count=rooms_count,
-                                         price_from=price_from, price_until=price_until, db=db)
-    res = change_response(data=announcements["query"])
-    return {
+                                         price_from=price_from, price_until=price_until,
+                                         before_id=before_id, total=total, q=q,
+                                         lat=lat, lon=lon, radius_km=radius_km, bbox=box,
+                                         area_from=area_from, area_until=area_until, sort=sort, db=db)
+    res = change_response(data=announcements["query"], lat=lat, lon=lon)
+    next_cursor = None
+    if not q and lat is None and sort is None and res and len(res) == limit:
+        next_cursor = encode_cursor(res[-1]["id"])
+    return json_response({
         "total": announcements['total'],
-        "announcement": res
-    }
\ No newline at end of file
+        "announcement": res,
+        "next_cursor": next_cursor
+    })
\ No newline at end of file
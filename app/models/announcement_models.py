@@ -1,13 +1,49 @@
-from pydantic import BaseModel
+import re
+from typing import Optional
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+
+# "45", "45.5", "45,5 м²", "150m2" -> square meters, None when there is no number
+def parse_area(value) -> Optional[float]:
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = re.search(r"\d+(?:[.,]\d+)?", str(value))
+    if match is None:
+        return None
+    return float(match.group().replace(",", "."))
 
 
 class CreateAnnounceRequest(BaseModel):
     type: str
     price: int
     address: str
-    area: str
+    area: float = Field(gt=0)
     rooms_count: int
     description: str
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+
+    # free text like "60m2" is still accepted, see parse_area
+    @field_validator("area", mode="before")
+    @classmethod
+    def clean_area(cls, value):
+        area = parse_area(value)
+        if area is None:
+            raise ValueError("area should be a number of square meters")
+        return area
+
+    # empty CSV cells of the importer mean "no coordinates"
+    @field_validator("lat", "lon", mode="before")
+    @classmethod
+    def empty_to_none(cls, value):
+        return None if value == "" else value
+
+    @model_validator(mode="after")
+    def check_coordinates(self):
+        if (self.lat is None) != (self.lon is None):
+            raise ValueError("lat and lon go together")
+        return self
 
 
 class AnnounceResponse(BaseModel):
@@ -15,11 +51,14 @@ class AnnounceResponse(BaseModel):
     type: str
     price: int
     address: str
-    area: str
+    # None for the old listings whose area could not be parsed
+    area: Optional[float] = None
     rooms_count: int
     description: str
     owner_id: int
     total_comments: int
+    lat: Optional[float] = None
+    lon: Optional[float] = None
 
 
 class AnnounceResponseFilter(BaseModel):
@@ -27,5 +66,26 @@ class AnnounceResponseFilter(BaseModel):
     type: str
     price: int
     address: str
-    area: str
+    # None for the old listings whose area could not be parsed
+    area: Optional[float] = None
+    rooms_count: int
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    # only set when the listing is searched around a point
+    distance_km: Optional[float] = None
+
+
+class PopularAnnounceResponse(BaseModel):
+    id: int
+    type: str
+    price: int
+    address: str
+    area: Optional[float] = None
     rooms_count: int
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    # the city of the owner
+    city: Optional[str] = None
+    favorites_count: int
+    comments_count: int
+    score: int
@@ -1,3 +1,6 @@
+import datetime
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -9,4 +12,6 @@ class CommentResponse(BaseModel):
     id: int
     content: str
     author_id: int
-    created_at: str
\ No newline at end of file
+    created_at: datetime.datetime
+    # None until the comment is edited
+    updated_at: Optional[datetime.datetime] = None
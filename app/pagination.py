@@ -0,0 +1,21 @@
+import base64
+import json
+
+
+# cursors are opaque for clients: the keyset values of the last row of a page,
+# dumped to json and wrapped in url-safe base64 without padding
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# every value of the cursor is passed through the matching converter (int, datetime.fromisoformat, ...)
+# any malformed cursor ends up as ValueError
+def decode_cursor(cursor: str, *converters) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(converters):
+            raise ValueError(cursor)
+        return [convert(value) for convert, value in zip(converters, values)]
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
@@ -0,0 +1,139 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import PASSWORD_ALLOW_PLAIN_TEXT, PASSWORD_HASH_ITERATIONS, PASSWORD_HASH_QUEUE_SIZE, PASSWORD_HASH_WORKERS
+from .metrics import registry
+
+
+ALGORITHM = "pbkdf2_sha256"
+
+
+# "pbkdf2_sha256$<iterations>$<salt>$<hash>", salt and hash in url-safe base64
+def hash_password(password: str, iterations: int = PASSWORD_HASH_ITERATIONS) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join([ALGORITHM, str(iterations), base64.urlsafe_b64encode(salt).decode(),
+                     base64.urlsafe_b64encode(digest).decode()])
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(ALGORITHM + "$")
+
+
+# (iterations, salt, digest) of a stored hash, ValueError when it is malformed
+# (binascii.Error of a broken base64 value is a ValueError too)
+def parse_hash(stored: str) -> tuple:
+    _, iterations, salt, digest = stored.split("$")
+    iterations = int(iterations)
+    if iterations < 1:
+        raise ValueError(f"invalid iteration count: {iterations}")
+    # validate, the lenient decoder drops characters outside the alphabet
+    return (iterations, base64.b64decode(salt, altchars=b"-_", validate=True),
+            base64.b64decode(digest, altchars=b"-_", validate=True))
+
+
+# anything without the pbkdf2 prefix is a plain text password from before hashing, it is only
+# accepted with allow_plain_text. a malformed hash never matches
+def verify_password(password: str, stored: str, allow_plain_text: bool = PASSWORD_ALLOW_PLAIN_TEXT) -> bool:
+    if stored is None:
+        return False
+    if not is_hashed(stored):
+        return allow_plain_text and hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        iterations, salt, digest = parse_hash(stored)
+    except ValueError:
+        return False
+    computed = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return hmac.compare_digest(computed, digest)
+
+
+# accepted plain text and hashes with fewer iterations than configured are upgraded on the next login
+def needs_rehash(stored: str, iterations: int = PASSWORD_HASH_ITERATIONS,
+                 allow_plain_text: bool = PASSWORD_ALLOW_PLAIN_TEXT) -> bool:
+    if stored is None:
+        return False
+    if not is_hashed(stored):
+        return allow_plain_text
+    try:
+        return parse_hash(stored)[0] < iterations
+    except ValueError:
+        return False
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+hash_seconds = registry.histogram(
+    "password_hash_seconds", "Time spent hashing or verifying a password in a worker", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+hash_wait_seconds = registry.histogram(
+    "password_hash_wait_seconds", "Time a password hash waited for a free worker", ("operation",),
+)
+hash_rejected = registry.counter(
+    "password_hash_rejected_total", "Password hashes rejected because the queue was full", ("operation",),
+)
+hash_queue_depth = registry.gauge("password_hash_queue_depth", "Password hashes waiting for a worker")
+hash_in_flight = registry.gauge("password_hash_in_flight", "Password hashes running in a worker")
+hash_queue_depth.set(0)
+hash_in_flight.set(0)
+
+
+# pbkdf2 releases the GIL, so hashes run in parallel on a fixed number of worker threads
+# instead of piling up on the request threadpool / event loop.
+# at most queue_size hashes wait for a worker, the rest fail fast with PasswordHasherBusy
+class PasswordHasher:
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE,
+                 iterations: int = PASSWORD_HASH_ITERATIONS):
+        self.workers = workers
+        self.iterations = iterations
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, operation: str, function, *args) -> Future:
+        if not self.slots.acquire(blocking=False):
+            hash_rejected.inc(operation=operation)
+            raise PasswordHasherBusy(operation)
+        hash_queue_depth.inc()
+        queued = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            hash_queue_depth.dec()
+            hash_in_flight.inc()
+            hash_wait_seconds.observe(started - queued, operation=operation)
+            try:
+                return function(*args)
+            finally:
+                hash_seconds.observe(time.perf_counter() - started, operation=operation)
+                hash_in_flight.dec()
+                self.slots.release()
+
+        return self.executor.submit(run)
+
+    # blocking calls for the sync routes, they already run on the request threadpool
+    def hash(self, password: str) -> str:
+        return self.submit("hash", hash_password, password, self.iterations).result()
+
+    def verify(self, password: str, stored: str) -> bool:
+        return self.submit("verify", verify_password, password, stored).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self.submit("hash", hash_password, password, self.iterations))
+
+    async def verify_async(self, password: str, stored: str) -> bool:
+        return await asyncio.wrap_future(self.submit("verify", verify_password, password, stored))
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.iterations)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,76 @@
+"""Full rebuild of the popular listings ranking.
+
+    python -m app.popular
+
+The API keeps the ranking up to date on every comment and favorite write,
+a rebuild recounts it from the source tables: rows of deleted announcements
+go away and changed owner cities are picked up. The app runs one every
+POPULAR_REBUILD_INTERVAL seconds.
+"""
+import asyncio
+import logging
+import sys
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from .database import SessionLocal
+from .metrics import registry
+from .repositories.comments_repository import Comment
+from .repositories.favorites_repository import Favorites
+from .repositories.popular_repository import PopularRepository
+
+logger = logging.getLogger(__name__)
+
+
+rebuild_seconds = registry.histogram("popular_rebuild_seconds", "Time to rebuild the popular listings ranking")
+
+
+# one transaction: the delete and the insert are committed together, readers see the old ranking until then
+def rebuild_popular(session_factory, repository: PopularRepository = None) -> int:
+    repository = repository or PopularRepository()
+    started = time.perf_counter()
+    db = session_factory()
+    try:
+        rows = repository.rebuild(db=db)
+        db.commit()
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    rebuild_seconds.observe(elapsed)
+    logger.info("rebuilt the popular listings ranking: %d rows in %.2fs", rows, elapsed)
+    return rows
+
+
+class PopularRebuilder:
+
+    def __init__(self, session_factory, interval: float):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await run_in_threadpool(rebuild_popular, self.session_factory)
+            except Exception:
+                logger.exception("popular listings rebuild failed, the incremental ranking stays")
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    rebuild_popular(SessionLocal)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,16 @@
-from typing import List, Type
+from typing import Iterator, List, Type
 
-from attr import define
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, desc
-from sqlalchemy.orm import relationship, Session
+from attr import asdict, define
+from sqlalchemy import DDL, Boolean, Column, Float, ForeignKey, Index, Integer, String, case, desc, event, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, selectinload, Session
 
+from ..cache import TTLCache
+from ..config import COUNT_CACHE_SIZE, COUNT_CACHE_TTL, COUNT_ESTIMATE_LIMIT, FACET_PRICE_BUCKETS
 from ..database import Base
+from ..geo import Box, RtreeGeoBackend, box_around, distance_squared, encode_geohash, get_geo_backend, radius_squared
+from ..search import PostgresFtsBackend, SearchUnavailable, SqliteFtsBackend, get_search_backend, get_terms
+from ..unit_of_work import on_commit
 
 
 class Announcement(Base):
@@ -14,24 +20,65 @@ class Announcement(Base):
     type = Column(String)
     price = Column(Integer)
     address = Column(String)
-    area = Column(String)
+    # square meters
+    area = Column(Float, nullable=True)
     rooms_count = Column(Integer)
     description = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    # optional coordinates, geohash is derived from them by the repository
+    lat = Column(Float, nullable=True)
+    lon = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True)
+    # maintained by CommentsRepository so the detail view never loads the comments
+    comments_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     owner = relationship("User", back_populates="announcements")
     comments = relationship("Comment", back_populates="announce")
     favorites = relationship('Favorites', back_populates="announcements", cascade="all, delete")
 
+    # equality filters go first and the price range last, see search_announce
+    __table_args__ = (
+        Index("ix_announcements_type_rooms_count_price", "type", "rooms_count", "price"),
+        Index("ix_announcements_rooms_count_price", "rooms_count", "price"),
+        Index("ix_announcements_price", "price"),
+        Index("ix_announcements_area", "area"),
+        Index("ix_announcements_owner_id", "owner_id"),
+        Index("ix_announcements_geohash", "geohash"),
+    )
+
+# full text index for the q filter, created next to the table by Base.metadata.create_all
+# (alembic revision 0b6f8e9d4a21 for existing databases)
+for statement in SqliteFtsBackend.ddl:
+    event.listen(Announcement.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+for statement in PostgresFtsBackend.ddl:
+    event.listen(Announcement.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+search_backend = get_search_backend()
+
+# spatial index for the lat/lon filters (alembic revision 5c3a9e7b1f02 for existing databases)
+geo_backend = get_geo_backend()
+for statement in RtreeGeoBackend.ddl:
+    event.listen(Announcement.__table__, "after_create", DDL(statement).execute_if(
+        dialect="sqlite", callable_=lambda *args, **kwargs: isinstance(geo_backend, RtreeGeoBackend)))
+
+
+def get_geohash(lat: float, lon: float):
+    if lat is None or lon is None:
+        return None
+    return encode_geohash(lat, lon)
+
+
 @define
 class CreateAnnounce:
     type: str
     price: int
     address: str
-    area: str
+    area: float
     rooms_count: int
     description: str
     owner_id: int
+    lat: float = None
+    lon: float = None
 
 
 @define
@@ -39,13 +86,73 @@ class UpdateAnnounce:
     type: str
     price: int
     address: str
-    area: str
+    area: float
     rooms_count: int
     description: str
+    lat: float = None
+    lon: float = None
+
+
+# normalized filters of search_announce, frozen so it can be used as a cache key
+@define(frozen=True)
+class AnnounceFilter:
+    type: str = None
+    rooms_count: int = None
+    price_from: int = None
+    price_until: int = None
+    area_from: float = None
+    area_until: float = None
+    # normalized terms of the q parameter, see search.get_terms
+    q: tuple = None
+    # (lat, lon) to sort by distance from, radius_km and bbox narrow the results down to a circle / Box
+    point: tuple = None
+    radius_km: float = None
+    bbox: Box = None
+
+    # the box the spatial index is asked for, None when there is no area to search in
+    def get_box(self):
+        box = self.bbox
+        if self.point is not None and self.radius_km is not None:
+            circle = box_around(*self.point, self.radius_km)
+            box = circle if box is None else box.intersect(circle)
+        return box
+
+
+def get_announce_filter(_type: str = None, rooms_count: int = None,
+                        price_from: int = None, price_until: int = None,
+                        area_from: float = None, area_until: float = None, q: str = None,
+                        lat: float = None, lon: float = None, radius_km: float = None, bbox: Box = None) -> AnnounceFilter:
+    terms = get_terms(q) or None
+    if terms and search_backend is None:
+        raise SearchUnavailable(q)
+    return AnnounceFilter(
+        type=_type,
+        rooms_count=int(rooms_count) if rooms_count is not None else None,
+        price_from=price_from,
+        price_until=price_until,
+        area_from=area_from,
+        area_until=area_until,
+        q=terms,
+        point=(lat, lon) if lat is not None and lon is not None else None,
+        radius_km=radius_km,
+        bbox=bbox
+    )
 
 
 class AnnouncementsRepository:
 
+    # the columns of AnnounceResponseFilter, selected as plain rows for the listing
+    listing_columns = (
+        Announcement.id, Announcement.type, Announcement.price, Announcement.address,
+        Announcement.area, Announcement.rooms_count, Announcement.lat, Announcement.lon,
+    )
+
+    # every column a partner needs to mirror the catalog, see export_announce
+    export_columns = listing_columns + (Announcement.description, Announcement.owner_id)
+
+    def __init__(self):
+        self.count_cache = TTLCache(maxsize=COUNT_CACHE_SIZE, ttl=COUNT_CACHE_TTL)
+
     def create_announce(self, shanyrak: CreateAnnounce, db: Session) -> int:
         db_announce = Announcement(
             type=shanyrak.type,
@@ -54,32 +161,206 @@ class AnnouncementsRepository:
             area=shanyrak.area,
             rooms_count=shanyrak.rooms_count,
             description=shanyrak.description,
-            owner_id=shanyrak.owner_id
+            owner_id=shanyrak.owner_id,
+            lat=shanyrak.lat,
+            lon=shanyrak.lon,
+            geohash=get_geohash(shanyrak.lat, shanyrak.lon)
         )
         db.add(db_announce)
-        db.commit()
-        db.refresh(db_announce)
+        db.flush()
+        on_commit(db, self.count_cache.clear)
         return db_announce.id
 
+    # one executemany insert for the whole batch, the importer commits batch by batch
+    def bulk_create_announce(self, shanyraks: list[CreateAnnounce], db: Session) -> int:
+        db.execute(insert(Announcement), [
+            dict(asdict(shanyrak), geohash=get_geohash(shanyrak.lat, shanyrak.lon)) for shanyrak in shanyraks
+        ])
+        on_commit(db, self.count_cache.clear)
+        return len(shanyraks)
+
+    # search=False leaves the q filter out for statements that join the ranked matches themselves
+    def get_filters(self, announce_filter: AnnounceFilter, search: bool = True) -> list:
+        filters = []
+        if announce_filter.type is not None:
+            filters.append(Announcement.type == announce_filter.type)
+        if announce_filter.rooms_count is not None:
+            filters.append(Announcement.rooms_count == announce_filter.rooms_count)
+        if announce_filter.price_from is not None:
+            filters.append(Announcement.price >= announce_filter.price_from)
+        if announce_filter.price_until is not None:
+            filters.append(Announcement.price <= announce_filter.price_until)
+        if announce_filter.area_from is not None:
+            filters.append(Announcement.area >= announce_filter.area_from)
+        if announce_filter.area_until is not None:
+            filters.append(Announcement.area <= announce_filter.area_until)
+        if announce_filter.q and search:
+            ranked = search_backend.ranked(announce_filter.q)
+            filters.append(Announcement.id.in_(select(ranked.c.id)))
+        if announce_filter.point is not None:
+            filters.append(Announcement.lat.is_not(None))
+            filters.append(Announcement.lon.is_not(None))
+        box = announce_filter.get_box()
+        if box is not None:
+            # the index narrows the candidates down, the exact bounds are checked on the row
+            filters.extend(geo_backend.get_filters(Announcement, box))
+            filters.append(Announcement.lat.between(box.min_lat, box.max_lat))
+            filters.append(Announcement.lon.between(box.min_lon, box.max_lon))
+        if announce_filter.point is not None and announce_filter.radius_km is not None:
+            filters.append(self.distance(announce_filter) <= radius_squared(announce_filter.radius_km))
+        return filters
+
+    def distance(self, announce_filter: AnnounceFilter):
+        return distance_squared(Announcement.lat, Announcement.lon, *announce_filter.point)
+
+    # cheapest / smallest first, listings without an area go last
+    def sort_order(self, sort: str) -> list:
+        if sort == "price":
+            return [Announcement.price]
+        if sort == "area":
+            return [Announcement.area.asc().nulls_last()]
+        if sort == "price_per_m2":
+            return [(Announcement.price / func.nullif(Announcement.area, 0)).asc().nulls_last()]
+        raise ValueError(f"unknown sort: {sort!r}")
+
+    # total="exact" counts the whole filtered set, "estimate" reuses a cached exact count
+    # or stops counting at COUNT_ESTIMATE_LIMIT rows
+    def count_statement(self, announce_filter: AnnounceFilter, total: str = "exact"):
+        statement = select(Announcement.id).where(*self.get_filters(announce_filter))
+        if total == "estimate":
+            statement = statement.limit(COUNT_ESTIMATE_LIMIT)
+        return select(func.count()).select_from(statement.subquery())
+
+    def get_cached_count(self, announce_filter: AnnounceFilter, total: str = "exact"):
+        count = self.count_cache.get((announce_filter, "exact"))
+        if count is None and total == "estimate":
+            count = self.count_cache.get((announce_filter, "estimate"))
+        return count
+
+    # total="none" skips counting
+    def count_announce(self, db: Session, announce_filter: AnnounceFilter, total: str = "exact"):
+        if total == "none":
+            return None
+        count = self.get_cached_count(announce_filter=announce_filter, total=total)
+        if count is None:
+            count = db.execute(self.count_statement(announce_filter=announce_filter, total=total)).scalar_one()
+            self.count_cache.set((announce_filter, total), count)
+        return count
+
+    # index of the FACET_PRICE_BUCKETS range the price falls in
+    def price_bucket(self):
+        return case(
+            *[(Announcement.price < until, index) for index, until in enumerate(FACET_PRICE_BUCKETS[1:])],
+            else_=len(FACET_PRICE_BUCKETS) - 1
+        )
+
+    # one GROUP BY over every combination of the facets, the combinations are few
+    # (types x room counts x price buckets) so they are rolled up per facet in python
+    def facets_statement(self, announce_filter: AnnounceFilter):
+        bucket = self.price_bucket().label("price_bucket")
+        return select(Announcement.type, Announcement.rooms_count, bucket, func.count())\
+            .where(*self.get_filters(announce_filter))\
+            .group_by(Announcement.type, Announcement.rooms_count, bucket)
+
+    # ordered by value, listings without one last
+    def facet_values(self, counts: dict) -> list:
+        return [
+            {"value": value, "count": count}
+            for value, count in sorted(counts.items(), key=lambda item: (item[0] is None, item[0]))
+        ]
+
+    def roll_up_facets(self, rows) -> dict:
+        types, rooms, buckets, total = {}, {}, {}, 0
+        for type, rooms_count, bucket, count in rows:
+            types[type] = types.get(type, 0) + count
+            rooms[rooms_count] = rooms.get(rooms_count, 0) + count
+            buckets[bucket] = buckets.get(bucket, 0) + count
+            total += count
+        edges = list(FACET_PRICE_BUCKETS[1:]) + [None]
+        return {
+            "total": total,
+            "type": self.facet_values(types),
+            "rooms_count": self.facet_values(rooms),
+            "price": [
+                {"from": FACET_PRICE_BUCKETS[index], "until": edges[index], "count": buckets.get(index, 0)}
+                for index in range(len(FACET_PRICE_BUCKETS))
+            ],
+        }
+
+    # facets share the count cache, so every write that clears the counts clears them too
+    def facet_announce(self, db: Session, _type: str = None, rooms_count: int = None,
+                       price_from: int = None, price_until: int = None,
+                       area_from: float = None, area_until: float = None, q: str = None,
+                       lat: float = None, lon: float = None, radius_km: float = None, bbox: Box = None) -> dict:
+        announce_filter = get_announce_filter(
+            _type=_type, rooms_count=rooms_count, price_from=price_from, price_until=price_until,
+            area_from=area_from, area_until=area_until, q=q, lat=lat, lon=lon, radius_km=radius_km, bbox=bbox
+        )
+        facets = self.count_cache.get((announce_filter, "facets"))
+        if facets is None:
+            facets = self.roll_up_facets(db.execute(self.facets_statement(announce_filter)).all())
+            self.count_cache.set((announce_filter, "facets"), facets)
+        return facets
+
+    # columns=None selects Announcement instances, listing_columns selects read-only rows
+    # that skip the identity map and attribute instrumentation
+    def search_statement(self, announce_filter: AnnounceFilter, limit: int = 10, offset: int = 0,
+                         before_id: int = None, sort: str = None, columns: tuple = None):
+        entities = columns or (Announcement,)
+        # an explicit sort wins over distance and relevance
+        if sort is not None:
+            return select(*entities)\
+                .where(*self.get_filters(announce_filter))\
+                .order_by(*self.sort_order(sort), desc(Announcement.id))\
+                .limit(limit).offset(offset)
+        # listings around a point are ordered by distance, the nearest first
+        if announce_filter.point is not None:
+            return select(*entities)\
+                .where(*self.get_filters(announce_filter))\
+                .order_by(self.distance(announce_filter), desc(Announcement.id))\
+                .limit(limit).offset(offset)
+        # text search is ordered by relevance, the best matches first
+        if announce_filter.q:
+            ranked = search_backend.ranked(announce_filter.q)
+            return select(*entities)\
+                .join(ranked, ranked.c.id == Announcement.id)\
+                .where(*self.get_filters(announce_filter, search=False))\
+                .order_by(ranked.c.rank, desc(Announcement.id))\
+                .limit(limit).offset(offset)
+        statement = select(*entities).where(*self.get_filters(announce_filter))
+        statement = statement.order_by(desc(Announcement.id)).limit(limit)
+        # keyset mode: seek past the last seen id instead of skipping offset rows
+        if before_id is not None:
+            return statement.where(Announcement.id < before_id)
+        return statement.offset(offset)
+
     def search_announce(self, db: Session, limit: int = 10, offset: int = 0,
                         _type: str = None, rooms_count: int = None,
-                        price_from: int = None, price_until: int = None):
-        filters = []
-        if _type is not None:
-            filters.append(Announcement.type == _type)
-        if rooms_count is not None:
-            filters.append(Announcement.rooms_count == int(rooms_count))
-        if price_from is not None:
-            filters.append(Announcement.price >= price_from)
-        if price_until is not None:
-            filters.append(Announcement.price <= price_until)
-        query = db.query(Announcement)
-        if filters:
-            query = query.filter(*filters)
-        total = query.count()
-        query = query.order_by(desc(Announcement.id)).limit(limit).offset(offset).all()
-        return {"total": total, "query": query}
+                        price_from: int = None, price_until: int = None,
+                        before_id: int = None, total: str = "exact", q: str = None,
+                        lat: float = None, lon: float = None, radius_km: float = None, bbox: Box = None,
+                        area_from: float = None, area_until: float = None, sort: str = None):
+        announce_filter = get_announce_filter(
+            _type=_type, rooms_count=rooms_count, price_from=price_from, price_until=price_until,
+            area_from=area_from, area_until=area_until, q=q, lat=lat, lon=lon, radius_km=radius_km, bbox=bbox
+        )
+        count = self.count_announce(db=db, announce_filter=announce_filter, total=total)
+        statement = self.search_statement(announce_filter=announce_filter, limit=limit, offset=offset,
+                                          before_id=before_id, sort=sort, columns=self.listing_columns)
+        query = db.execute(statement).all()
+        return {"total": count, "query": query}
     
+    def export_statement(self, announce_filter: AnnounceFilter):
+        return select(*self.export_columns)\
+            .where(*self.get_filters(announce_filter))\
+            .order_by(Announcement.id)
+
+    # the whole filtered catalog in id order, batch_size rows at a time from a server side cursor,
+    # so memory stays flat however many rows match
+    def export_announce(self, db: Session, announce_filter: AnnounceFilter, batch_size: int = 1000) -> Iterator[list]:
+        statement = self.export_statement(announce_filter).execution_options(yield_per=batch_size)
+        yield from db.execute(statement).partitions()
+
     def get_by_id(self, id: int, db: Session) -> Announcement:
         return db.query(Announcement).filter(Announcement.id==id).first()
 
@@ -91,14 +372,109 @@ class AnnouncementsRepository:
         db_announce.area = shanyrak.area
         db_announce.rooms_count = shanyrak.rooms_count
         db_announce.description = shanyrak.description
+        db_announce.lat = shanyrak.lat
+        db_announce.lon = shanyrak.lon
+        db_announce.geohash = get_geohash(shanyrak.lat, shanyrak.lon)
 
-        db.commit()
-        db.refresh(db_announce)
+        db.flush()
+        on_commit(db, self.count_cache.clear)
         return db_announce
 
     def delete_announce(self, id: int, db: Session):
             db_announce = self.get_by_id(id=id, db=db)
             db.delete(db_announce)
-            db.commit()
+            db.flush()
+            on_commit(db, self.count_cache.clear)
 
-    
+
+# same filters, statements and count cache as AnnouncementsRepository,
+# every method that talks to the database is a coroutine
+class AsyncAnnouncementsRepository(AnnouncementsRepository):
+
+    async def create_announce(self, shanyrak: CreateAnnounce, db: AsyncSession) -> int:
+        db_announce = Announcement(
+            type=shanyrak.type,
+            price=shanyrak.price,
+            address=shanyrak.address,
+            area=shanyrak.area,
+            rooms_count=shanyrak.rooms_count,
+            description=shanyrak.description,
+            owner_id=shanyrak.owner_id,
+            lat=shanyrak.lat,
+            lon=shanyrak.lon,
+            geohash=get_geohash(shanyrak.lat, shanyrak.lon)
+        )
+        db.add(db_announce)
+        await db.flush()
+        on_commit(db, self.count_cache.clear)
+        return db_announce.id
+
+    async def count_announce(self, db: AsyncSession, announce_filter: AnnounceFilter, total: str = "exact"):
+        if total == "none":
+            return None
+        count = self.get_cached_count(announce_filter=announce_filter, total=total)
+        if count is None:
+            count = (await db.execute(self.count_statement(announce_filter=announce_filter, total=total))).scalar_one()
+            self.count_cache.set((announce_filter, total), count)
+        return count
+
+    async def search_announce(self, db: AsyncSession, limit: int = 10, offset: int = 0,
+                              _type: str = None, rooms_count: int = None,
+                              price_from: int = None, price_until: int = None,
+                              before_id: int = None, total: str = "exact", q: str = None,
+                              lat: float = None, lon: float = None, radius_km: float = None, bbox: Box = None,
+                              area_from: float = None, area_until: float = None, sort: str = None):
+        announce_filter = get_announce_filter(
+            _type=_type, rooms_count=rooms_count, price_from=price_from, price_until=price_until,
+            area_from=area_from, area_until=area_until, q=q, lat=lat, lon=lon, radius_km=radius_km, bbox=bbox
+        )
+        count = await self.count_announce(db=db, announce_filter=announce_filter, total=total)
+        statement = self.search_statement(announce_filter=announce_filter, limit=limit, offset=offset,
+                                          before_id=before_id, sort=sort, columns=self.listing_columns)
+        query = (await db.execute(statement)).all()
+        return {"total": count, "query": query}
+
+    async def facet_announce(self, db: AsyncSession, _type: str = None, rooms_count: int = None,
+                             price_from: int = None, price_until: int = None,
+                             area_from: float = None, area_until: float = None, q: str = None,
+                             lat: float = None, lon: float = None, radius_km: float = None, bbox: Box = None) -> dict:
+        announce_filter = get_announce_filter(
+            _type=_type, rooms_count=rooms_count, price_from=price_from, price_until=price_until,
+            area_from=area_from, area_until=area_until, q=q, lat=lat, lon=lon, radius_km=radius_km, bbox=bbox
+        )
+        facets = self.count_cache.get((announce_filter, "facets"))
+        if facets is None:
+            facets = self.roll_up_facets((await db.execute(self.facets_statement(announce_filter))).all())
+            self.count_cache.set((announce_filter, "facets"), facets)
+        return facets
+
+    async def get_by_id(self, id: int, db: AsyncSession) -> Announcement:
+        return await db.scalar(select(Announcement).where(Announcement.id == id))
+
+    async def update_announce(self, id: int, shanyrak: UpdateAnnounce, db: AsyncSession):
+        db_announce = await self.get_by_id(id=id, db=db)
+        db_announce.type = shanyrak.type
+        db_announce.price = shanyrak.price
+        db_announce.address = shanyrak.address
+        db_announce.area = shanyrak.area
+        db_announce.rooms_count = shanyrak.rooms_count
+        db_announce.description = shanyrak.description
+        db_announce.lat = shanyrak.lat
+        db_announce.lon = shanyrak.lon
+        db_announce.geohash = get_geohash(shanyrak.lat, shanyrak.lon)
+
+        await db.flush()
+        on_commit(db, self.count_cache.clear)
+        return db_announce
+
+    # relationships can not be lazy loaded on an AsyncSession,
+    # so the collections touched by the delete cascade are loaded up front
+    async def delete_announce(self, id: int, db: AsyncSession):
+        db_announce = await db.scalar(
+            select(Announcement)
+            .where(Announcement.id == id)
+            .options(selectinload(Announcement.comments), selectinload(Announcement.favorites))
+        )
+        await db.delete(db_announce)
+        await db.flush()
+        on_commit(db, self.count_cache.clear)
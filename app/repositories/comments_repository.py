@@ -1,10 +1,13 @@
 import datetime
 
-from attr import define
-from sqlalchemy import  Column, ForeignKey, Integer, String
+from attr import asdict, define, field
+from sqlalchemy import  Column, DateTime, ForeignKey, Index, Integer, String, bindparam, desc, insert, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import relationship, Session
 
 from ..database import Base
+from .announcement_repository import Announcement
+from .popular_repository import AsyncPopularRepository, PopularRepository
 
 
 class Comment(Base):
@@ -12,29 +15,47 @@ class Comment(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String)
-    created_at = Column(String)
+    created_at = Column(DateTime)
+    # set when the content is edited, created_at stays the sort key of the thread
+    updated_at = Column(DateTime, nullable=True)
     author_id = Column(Integer, ForeignKey("users.id"))
     announce_id = Column(Integer, ForeignKey("announcements.id"))
 
     parent = relationship("User", back_populates="comments")
     announce = relationship("Announcement", back_populates="comments")
 
+    # the comments page of an announcement is a range scan in (created_at, id) order,
+    # plain lookups by announce_id use its prefix
+    __table_args__ = (
+        Index("ix_comments_announce_id_created_at_id", "announce_id", "created_at", "id"),
+    )
+
 
 @define
 class CommentCreate:
     content: str
     author_id: int
     announce_id: int
-    created_at: str = datetime.datetime.now()
+    created_at: datetime.datetime = field(factory=datetime.datetime.now)
 
 
 @define
 class CommentUpdate:
     content: str
-    created_at: str = datetime.datetime.now()
+    updated_at: datetime.datetime = field(factory=datetime.datetime.now)
 
 
 class CommentsRepository:
+    popular_repository = PopularRepository()
+
+    # runs in the transaction of the comment write, so Announcement.comments_count stays in step
+    def comments_count_statement(self, announce_id: int, delta: int):
+        return update(Announcement)\
+            .where(Announcement.id == announce_id)\
+            .values(comments_count=Announcement.comments_count + delta)
+
+    def change_comments_count(self, announce_id: int, delta: int, db: Session):
+        db.execute(self.comments_count_statement(announce_id=announce_id, delta=delta))
 
     def create_comment(self, comment: CommentCreate, db: Session) -> Comment:
         db_comment = Comment(
@@ -44,10 +65,28 @@ class CommentsRepository:
             announce_id=comment.announce_id
         )
         db.add(db_comment)
-        db.commit()
-        db.refresh(db_comment)
+        self.change_comments_count(announce_id=comment.announce_id, delta=1, db=db)
+        db.flush()
+        self.popular_repository.refresh([comment.announce_id], db=db)
         return db_comment
 
+    # one executemany insert and one comments_count update per announcement, used by the write-behind queue
+    def bulk_create_comments(self, comments: list[CommentCreate], db: Session) -> int:
+        db.execute(insert(Comment), [asdict(comment) for comment in comments])
+        counts = {}
+        for comment in comments:
+            counts[comment.announce_id] = counts.get(comment.announce_id, 0) + 1
+        # a core update of the table, an ORM update with a list of parameters means update by primary key
+        announcements = Announcement.__table__
+        db.execute(
+            announcements.update()
+            .where(announcements.c.id == bindparam("announce_id"))
+            .values(comments_count=announcements.c.comments_count + bindparam("delta")),
+            [{"announce_id": announce_id, "delta": delta} for announce_id, delta in counts.items()],
+        )
+        self.popular_repository.refresh(counts, db=db)
+        return len(comments)
+
     def get_by_id(self, id: int, db: Session) -> Comment:
         return db.query(Comment).filter(Comment.id==id).first()
 
@@ -57,19 +96,90 @@ class CommentsRepository:
     def get_by_announce_id(self, announce_id: int, db: Session):
         return db.query(Comment).filter(Comment.announce_id==announce_id).all()
 
+    # read-only rows with the fields of CommentResponse, nothing goes through the identity map.
+    # order="oldest" or "newest", after is the (created_at, id) of the last comment of the previous page
+    def response_comments_statement(self, announce_id: int, limit: int = None, order: str = "oldest",
+                                    after: tuple = None):
+        statement = select(Comment.id, Comment.content, Comment.author_id, Comment.created_at, Comment.updated_at)\
+            .where(Comment.announce_id == announce_id)
+        key = tuple_(Comment.created_at, Comment.id)
+        if order == "newest":
+            if after is not None:
+                statement = statement.where(key < tuple_(*after))
+            statement = statement.order_by(desc(Comment.created_at), desc(Comment.id))
+        else:
+            if after is not None:
+                statement = statement.where(key > tuple_(*after))
+            statement = statement.order_by(Comment.created_at, Comment.id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def get_response_comments(self, announce_id: int, db: Session, limit: int = None, order: str = "oldest",
+                              after: tuple = None) -> list:
+        statement = self.response_comments_statement(announce_id=announce_id, limit=limit, order=order, after=after)
+        return db.execute(statement).all()
+
     def delete_comment(self, id: int, db: Session):
         db_comment = self.get_by_id(id=id, db=db)
         db.delete(db_comment)
-        db.commit()
+        self.change_comments_count(announce_id=db_comment.announce_id, delta=-1, db=db)
+        db.flush()
+        self.popular_repository.refresh([db_comment.announce_id], db=db)
 
     def update_comment(self, comment_id: int, new_comment: CommentUpdate, db: Session) -> Comment:
         db_comment = self.get_by_id(id=comment_id, db=db)
         db_comment.content = new_comment.content
-        db_comment.created_at = new_comment.created_at
+        db_comment.updated_at = new_comment.updated_at
 
-        db.commit()
-        db.refresh(db_comment)
+        db.flush()
+        return db_comment
+
+
+class AsyncCommentsRepository(CommentsRepository):
+    popular_repository = AsyncPopularRepository()
+
+    async def change_comments_count(self, announce_id: int, delta: int, db: AsyncSession):
+        await db.execute(self.comments_count_statement(announce_id=announce_id, delta=delta))
+
+    async def create_comment(self, comment: CommentCreate, db: AsyncSession) -> Comment:
+        db_comment = Comment(
+            content=comment.content,
+            created_at=comment.created_at,
+            author_id=comment.author_id,
+            announce_id=comment.announce_id
+        )
+        db.add(db_comment)
+        await self.change_comments_count(announce_id=comment.announce_id, delta=1, db=db)
+        await db.flush()
+        await self.popular_repository.refresh([comment.announce_id], db=db)
         return db_comment
 
+    async def get_by_id(self, id: int, db: AsyncSession) -> Comment:
+        return await db.scalar(select(Comment).where(Comment.id == id))
 
+    async def get_comment_by_announce(self, comment_id: int, announce_id: int, db: AsyncSession):
+        return await db.scalar(select(Comment).where(Comment.id == comment_id, Comment.announce_id == announce_id))
 
+    async def get_by_announce_id(self, announce_id: int, db: AsyncSession):
+        return (await db.scalars(select(Comment).where(Comment.announce_id == announce_id))).all()
+
+    async def get_response_comments(self, announce_id: int, db: AsyncSession, limit: int = None,
+                                    order: str = "oldest", after: tuple = None) -> list:
+        statement = self.response_comments_statement(announce_id=announce_id, limit=limit, order=order, after=after)
+        return (await db.execute(statement)).all()
+
+    async def delete_comment(self, id: int, db: AsyncSession):
+        db_comment = await self.get_by_id(id=id, db=db)
+        await db.delete(db_comment)
+        await self.change_comments_count(announce_id=db_comment.announce_id, delta=-1, db=db)
+        await db.flush()
+        await self.popular_repository.refresh([db_comment.announce_id], db=db)
+
+    async def update_comment(self, comment_id: int, new_comment: CommentUpdate, db: AsyncSession) -> Comment:
+        db_comment = await self.get_by_id(id=comment_id, db=db)
+        db_comment.content = new_comment.content
+        db_comment.updated_at = new_comment.updated_at
+
+        await db.flush()
+        return db_comment
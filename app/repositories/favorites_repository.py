@@ -1,8 +1,11 @@
-from attr import define
-from sqlalchemy import Column, ForeignKey, Integer, String
+from attr import asdict, define
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, bindparam, desc, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import relationship, Session
 
 from ..database import Base
+from .announcement_repository import Announcement
+from .popular_repository import AsyncPopularRepository, PopularRepository
 
 from ..models.favorites_models import FavoritesResponse
 
@@ -18,6 +21,11 @@ class Favorites(Base):
     owner = relationship("User", back_populates="favorites")
     announcements = relationship("Announcement", back_populates="favorites")
 
+    __table_args__ = (
+        Index("ix_faborites_user_id_announcement_id", "user_id", "announcement_id"),
+        Index("ix_faborites_announcement_id", "announcement_id"),
+    )
+
 
 @define
 class CreateFavorites:
@@ -27,13 +35,30 @@ class CreateFavorites:
 
 
 class FavoriteRepositories:
+    popular_repository = PopularRepository()
+
     def create_favorites(self, favorites: CreateFavorites, db: Session) -> Favorites:
         db_favorites = Favorites(user_id=favorites.user_id, announcement_id=favorites.announcement_id, address=favorites.address)
         db.add(db_favorites)
-        db.commit()
-        db.refresh(db_favorites)
+        db.flush()
+        self.popular_repository.refresh([favorites.announcement_id], db=db)
         return db_favorites
 
+    # batched writes of the write-behind queue: one executemany insert, one delete per (user, announcement)
+    def bulk_create_favorites(self, favorites: list[CreateFavorites], db: Session) -> int:
+        db.execute(insert(Favorites), [asdict(favorite) for favorite in favorites])
+        self.popular_repository.refresh([favorite.announcement_id for favorite in favorites], db=db)
+        return len(favorites)
+
+    def bulk_delete_favorites(self, keys: list[tuple], db: Session):
+        favorites = Favorites.__table__
+        db.execute(
+            favorites.delete()
+            .where(favorites.c.user_id == bindparam("key_user_id"), favorites.c.announcement_id == bindparam("key_announcement_id")),
+            [{"key_user_id": user_id, "key_announcement_id": announcement_id} for user_id, announcement_id in keys],
+        )
+        self.popular_repository.refresh([announcement_id for _, announcement_id in keys], db=db)
+
     def get_favorites(self, user_id: int, db: Session) -> list[Favorites]:
         return db.query(Favorites).filter(Favorites.user_id == user_id).all()
 
@@ -43,16 +68,61 @@ class FavoriteRepositories:
     def get_by_announce_id(self, id: int, db: Session) -> Favorites:
         return db.query(Favorites).filter(Favorites.announcement_id==id).first()
 
-    def get_response_favorites(self, user_id: int, db: Session) -> list[FavoritesResponse]:
-        db_list_favorites = self.get_favorites(user_id=user_id, db=db)
-        if db_list_favorites is None:
-            return []
-        res = []
-        for favorites in db_list_favorites:
-            res.append(FavoritesResponse(id=favorites.announcement_id, address=favorites.address))
-        return res
+    # the favorite of one user, get_by_announce_id matches the favorite of any user
+    def get_user_favorite(self, user_id: int, announcement_id: int, db: Session) -> Favorites:
+        return db.query(Favorites).filter(Favorites.announcement_id==announcement_id, Favorites.user_id==user_id).first()
+
+    # one joined query instead of a lookup per favorite, the address is always the current one.
+    # pages are ordered by announcement id and seek with announcement_id < before_id,
+    # which walks the (user_id, announcement_id) index
+    def response_favorites_statement(self, user_id: int, limit: int = None, before_id: int = None):
+        statement = select(Favorites.announcement_id, Announcement.address)\
+            .join(Announcement, Announcement.id == Favorites.announcement_id)\
+            .where(Favorites.user_id == user_id)
+        if before_id is not None:
+            statement = statement.where(Favorites.announcement_id < before_id)
+        statement = statement.distinct().order_by(desc(Favorites.announcement_id))
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def get_response_favorites(self, user_id: int, db: Session, limit: int = None,
+                               before_id: int = None) -> list[FavoritesResponse]:
+        statement = self.response_favorites_statement(user_id=user_id, limit=limit, before_id=before_id)
+        return [FavoritesResponse(id=row.announcement_id, address=row.address) for row in db.execute(statement)]
 
     def delete_favorites(self, shanyrak_id: int, user_id: int, db: Session):
-        db_favorites = db.query(Favorites).filter(Favorites.announcement_id==shanyrak_id, Favorites.user_id==user_id).first()
+        db_favorites = self.get_user_favorite(user_id=user_id, announcement_id=shanyrak_id, db=db)
         db.delete(db_favorites)
-        db.commit()
\ No newline at end of file
+        db.flush()
+        self.popular_repository.refresh([shanyrak_id], db=db)
+
+
+class AsyncFavoriteRepositories(FavoriteRepositories):
+    popular_repository = AsyncPopularRepository()
+
+    async def create_favorites(self, favorites: CreateFavorites, db: AsyncSession) -> Favorites:
+        db_favorites = Favorites(user_id=favorites.user_id, announcement_id=favorites.announcement_id, address=favorites.address)
+        db.add(db_favorites)
+        await db.flush()
+        await self.popular_repository.refresh([favorites.announcement_id], db=db)
+        return db_favorites
+
+    async def get_by_announce_id(self, id: int, db: AsyncSession) -> Favorites:
+        return await db.scalar(select(Favorites).where(Favorites.announcement_id == id).limit(1))
+
+    async def get_user_favorite(self, user_id: int, announcement_id: int, db: AsyncSession) -> Favorites:
+        return await db.scalar(
+            select(Favorites).where(Favorites.announcement_id == announcement_id, Favorites.user_id == user_id).limit(1)
+        )
+
+    async def get_response_favorites(self, user_id: int, db: AsyncSession, limit: int = None,
+                                     before_id: int = None) -> list[FavoritesResponse]:
+        statement = self.response_favorites_statement(user_id=user_id, limit=limit, before_id=before_id)
+        return [FavoritesResponse(id=row.announcement_id, address=row.address) for row in await db.execute(statement)]
+
+    async def delete_favorites(self, shanyrak_id: int, user_id: int, db: AsyncSession):
+        db_favorites = await self.get_user_favorite(user_id=user_id, announcement_id=shanyrak_id, db=db)
+        await db.delete(db_favorites)
+        await db.flush()
+        await self.popular_repository.refresh([shanyrak_id], db=db)
@@ -0,0 +1,114 @@
+from sqlalchemy import (
+    Column, ForeignKey, Index, Integer, String, column, delete, desc, func, insert, or_, select, table, tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..config import POPULAR_COMMENT_WEIGHT, POPULAR_FAVORITE_WEIGHT
+from ..database import Base, SQLALCHEMY_DATABASE_URL, is_sqlite
+from .announcement_repository import Announcement
+from .users_repository import User
+
+
+# the ranking of the home page feed, one row per announcement with favorites or comments.
+# city is the city of the owner, copied here so a city page is one range scan of
+# (city, score, announcement_id). the rows of an announcement are rewritten by every
+# comment and favorite write, rebuild starts over from the source tables
+class PopularAnnouncement(Base):
+    __tablename__ = "popular_announcements"
+
+    announcement_id = Column(Integer, ForeignKey("announcements.id", ondelete="CASCADE"), primary_key=True)
+    city = Column(String, nullable=True)
+    favorites_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comments_count = Column(Integer, nullable=False, default=0, server_default="0")
+    score = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_popular_announcements_city_score_id", "city", "score", "announcement_id"),
+        Index("ix_popular_announcements_score_id", "score", "announcement_id"),
+    )
+
+
+# upserts are dialect specific, on conflict works the same on SQLite and PostgreSQL
+upsert = sqlite.insert if is_sqlite(SQLALCHEMY_DATABASE_URL) else postgresql.insert
+
+RANKING_COLUMNS = ("announcement_id", "city", "favorites_count", "comments_count", "score")
+
+# the faborites table without its model, favorites_repository imports this module
+favorites = table("faborites", column("id", Integer), column("announcement_id", Integer))
+
+
+class PopularRepository:
+
+    # the ranking rows computed from the source tables, favorites are counted
+    # on ix_faborites_announcement_id and comments come from Announcement.comments_count
+    def ranking_statement(self, only_ranked: bool = False):
+        favorites_count = select(func.count(favorites.c.id))\
+            .where(favorites.c.announcement_id == Announcement.id)\
+            .scalar_subquery()
+        score = favorites_count * POPULAR_FAVORITE_WEIGHT + Announcement.comments_count * POPULAR_COMMENT_WEIGHT
+        statement = select(Announcement.id, User.city, favorites_count, Announcement.comments_count, score)\
+            .outerjoin(User, User.id == Announcement.owner_id)
+        if only_ranked:
+            statement = statement.where(or_(favorites_count > 0, Announcement.comments_count > 0))
+        return statement
+
+    def rebuild_statement(self):
+        return insert(PopularAnnouncement).from_select(RANKING_COLUMNS, self.ranking_statement(only_ranked=True))
+
+    # exact counts for the given announcements, run in the transaction of the write after its flush.
+    # a concurrent write can leave a row one step behind until the next write or rebuild
+    def refresh_statement(self, announce_ids):
+        statement = upsert(PopularAnnouncement).from_select(
+            RANKING_COLUMNS, self.ranking_statement().where(Announcement.id.in_(announce_ids))
+        )
+        return statement.on_conflict_do_update(
+            index_elements=[PopularAnnouncement.announcement_id],
+            set_={name: statement.excluded[name] for name in RANKING_COLUMNS[1:]},
+        )
+
+    def refresh(self, announce_ids, db: Session):
+        announce_ids = sorted(set(announce_ids))
+        if announce_ids:
+            db.execute(self.refresh_statement(announce_ids))
+
+    # drops the rows of deleted announcements and picks up changed owner cities
+    def rebuild(self, db: Session) -> int:
+        db.execute(delete(PopularAnnouncement))
+        return db.execute(self.rebuild_statement()).rowcount
+
+    # highest score first, after is the (score, announcement_id) of the last row of the previous page
+    def popular_statement(self, city: str = None, limit: int = None, after: tuple = None):
+        statement = select(
+            Announcement.id, Announcement.type, Announcement.price, Announcement.address, Announcement.area,
+            Announcement.rooms_count, Announcement.lat, Announcement.lon, PopularAnnouncement.city,
+            PopularAnnouncement.favorites_count, PopularAnnouncement.comments_count, PopularAnnouncement.score,
+        ).join(Announcement, Announcement.id == PopularAnnouncement.announcement_id)\
+            .where(PopularAnnouncement.score > 0)
+        if city is not None:
+            statement = statement.where(PopularAnnouncement.city == city)
+        if after is not None:
+            statement = statement.where(tuple_(PopularAnnouncement.score, PopularAnnouncement.announcement_id) < tuple_(*after))
+        statement = statement.order_by(desc(PopularAnnouncement.score), desc(PopularAnnouncement.announcement_id))
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    def get_popular(self, db: Session, city: str = None, limit: int = None, after: tuple = None) -> list:
+        return db.execute(self.popular_statement(city=city, limit=limit, after=after)).all()
+
+
+class AsyncPopularRepository(PopularRepository):
+
+    async def refresh(self, announce_ids, db: AsyncSession):
+        announce_ids = sorted(set(announce_ids))
+        if announce_ids:
+            await db.execute(self.refresh_statement(announce_ids))
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        await db.execute(delete(PopularAnnouncement))
+        return (await db.execute(self.rebuild_statement())).rowcount
+
+    async def get_popular(self, db: AsyncSession, city: str = None, limit: int = None, after: tuple = None) -> list:
+        return (await db.execute(self.popular_statement(city=city, limit=limit, after=after))).all()
@@ -1,8 +1,10 @@
 from attr import define
-from sqlalchemy import Column, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, ForeignKey, Integer, String, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import relationship, selectinload, Session
 
 from ..database import Base
+from ..passwords import password_hasher
 from .announcement_repository import Announcement
 
 
@@ -40,10 +42,27 @@ class UserUpdate:
 class UsersRepository:
 
     def create_user(self, user: UserCreate, db: Session) -> User:
-        db_user = User(username=user.username, phone=user.phone, password=user.password, name=user.name, city=user.city)
+        password = password_hasher.hash(user.password)
+        db_user = User(username=user.username, phone=user.phone, password=password, name=user.name, city=user.city)
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        db.flush()
+        return db_user
+
+    # the user for a correct password, else None. plain text and outdated hashes
+    # are replaced with a fresh hash once the password is known to be right
+    def authenticate(self, username: str, password: str, db: Session):
+        db_user = self.get_by_username(username=username, db=db)
+        if db_user is None or not password_hasher.verify(password, db_user.password):
+            return None
+        if password_hasher.needs_rehash(db_user.password):
+            db_user.password = password_hasher.hash(password)
+            db.flush()
+        return db_user
+
+    def update_password(self, user_id: int, password: str, db: Session):
+        db_user = self.get_by_id(user_id=user_id, db=db)
+        db_user.password = password_hasher.hash(password)
+        db.flush()
         return db_user
 
     def get_by_username(self, username: str, db: Session):
@@ -58,7 +77,7 @@ class UsersRepository:
     def delete_user(self, user_id: int, db: Session):
         db_user = self.get_by_id(user_id=user_id,db=db)
         db.delete(db_user)
-        db.commit()
+        db.flush()
 
     def update_user(self, user_id: int, user: UserUpdate, db: Session):
         db_user = self.get_by_id(user_id=user_id, db=db)
@@ -66,7 +85,58 @@ class UsersRepository:
         db_user.name = user.name
         db_user.city = user.city
 
-        db.commit()
-        db.refresh(db_user)
+        db.flush()
+        return db_user
+
+
+class AsyncUsersRepository(UsersRepository):
+
+    async def create_user(self, user: UserCreate, db: AsyncSession) -> User:
+        password = await password_hasher.hash_async(user.password)
+        db_user = User(username=user.username, phone=user.phone, password=password, name=user.name, city=user.city)
+        db.add(db_user)
+        await db.flush()
+        return db_user
+
+    async def authenticate(self, username: str, password: str, db: AsyncSession):
+        db_user = await self.get_by_username(username=username, db=db)
+        if db_user is None or not await password_hasher.verify_async(password, db_user.password):
+            return None
+        if password_hasher.needs_rehash(db_user.password):
+            db_user.password = await password_hasher.hash_async(password)
+            await db.flush()
         return db_user
 
+    async def update_password(self, user_id: int, password: str, db: AsyncSession):
+        db_user = await self.get_by_id(user_id=user_id, db=db)
+        db_user.password = await password_hasher.hash_async(password)
+        await db.flush()
+        return db_user
+
+    async def get_by_username(self, username: str, db: AsyncSession):
+        return await db.scalar(select(User).where(User.username == username))
+
+    async def get_by_id(self, user_id: int, db: AsyncSession) -> User:
+        return await db.scalar(select(User).where(User.id == user_id))
+
+    async def get_users(self, db: AsyncSession, skip: int = 0, limit: int = 100) -> list[User]:
+        return (await db.scalars(select(User).offset(skip).limit(limit))).all()
+
+    # the delete detaches announcements and comments of the user, they have to be loaded first
+    async def delete_user(self, user_id: int, db: AsyncSession):
+        db_user = await db.scalar(
+            select(User)
+            .where(User.id == user_id)
+            .options(selectinload(User.announcements), selectinload(User.comments))
+        )
+        await db.delete(db_user)
+        await db.flush()
+
+    async def update_user(self, user_id: int, user: UserUpdate, db: AsyncSession):
+        db_user = await self.get_by_id(user_id=user_id, db=db)
+        db_user.phone = user.phone
+        db_user.name = user.name
+        db_user.city = user.city
+
+        await db.flush()
+        return db_user
@@ -0,0 +1,73 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic_core import PydanticUndefined
+
+from .config import JSON_RESPONSE
+from .models.announcement_models import AnnounceResponseFilter, PopularAnnounceResponse
+from .models.comments_models import CommentResponse
+from .models.favorites_models import FavoritesResponse
+
+logger = logging.getLogger(__name__)
+
+
+# orjson (default) or stock, the json.dumps based JSONResponse of starlette.
+# without the orjson package the default falls back to stock
+def get_response_class(encoder: str = JSON_RESPONSE):
+    if encoder == "orjson":
+        if orjson is None:
+            logger.warning("JSON_RESPONSE=orjson but orjson is not installed, using the stock JSONResponse")
+            return JSONResponse
+        return ORJSONResponse
+    if encoder == "stock":
+        return JSONResponse
+    raise ValueError(f"unknown json response encoder: {encoder!r}")
+
+
+response_class = get_response_class()
+
+
+# builds the plain dicts of a response model from rows, ORM objects or models
+# by attribute, the field names and defaults are looked up once per model
+class Serializer:
+
+    def __init__(self, model):
+        self.fields = tuple(
+            (name, None if field.default is PydanticUndefined else field.default)
+            for name, field in model.model_fields.items()
+        )
+
+    def one(self, item) -> dict:
+        return {name: getattr(item, name, default) for name, default in self.fields}
+
+    def __call__(self, items) -> list[dict]:
+        fields = self.fields
+        return [{name: getattr(item, name, default) for name, default in fields} for item in items]
+
+
+announce_serializer = Serializer(AnnounceResponseFilter)
+comment_serializer = Serializer(CommentResponse)
+favorites_serializer = Serializer(FavoritesResponse)
+popular_serializer = Serializer(PopularAnnounceResponse)
+
+
+# with orjson the dicts of the serializers go straight to orjson.dumps,
+# returning a response skips the jsonable_encoder pass of FastAPI.
+# the stock encoder gets the content back and FastAPI encodes it as usual
+def json_response(content):
+    if response_class is JSONResponse:
+        return content
+    return response_class(content=content)
+
+
+# one NDJSON line of a mapping, encoded like the json responses
+def ndjson_line(content) -> bytes:
+    if response_class is ORJSONResponse:
+        return orjson.dumps(dict(content)) + b"\n"
+    return json.dumps(dict(content), ensure_ascii=False, default=str).encode() + b"\n"
@@ -0,0 +1,85 @@
+import re
+
+from sqlalchemy import column, func, literal_column, select, table
+from sqlalchemy.engine import make_url
+
+from .database import SQLALCHEMY_DATABASE_URL
+
+
+# "Алматы, Абая 2 комнаты" -> ("алматы", "абая", "2", "комнаты")
+def get_terms(q: str) -> tuple:
+    return tuple(term.lower() for term in re.findall(r"\w+", q or ""))
+
+
+# external content FTS5 index over announcements.address and description,
+# the triggers keep it in step with every write path including the bulk import
+class SqliteFtsBackend:
+    ddl = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS announcements_fts USING fts5("
+        "address, description, content='announcements', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS announcements_fts_ai AFTER INSERT ON announcements BEGIN "
+        "INSERT INTO announcements_fts(rowid, address, description) VALUES (new.id, new.address, new.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS announcements_fts_ad AFTER DELETE ON announcements BEGIN "
+        "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+        "VALUES ('delete', old.id, old.address, old.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS announcements_fts_au AFTER UPDATE OF address, description ON announcements BEGIN "
+        "INSERT INTO announcements_fts(announcements_fts, rowid, address, description) "
+        "VALUES ('delete', old.id, old.address, old.description); "
+        "INSERT INTO announcements_fts(rowid, address, description) VALUES (new.id, new.address, new.description); "
+        "END",
+    ]
+    rebuild = "INSERT INTO announcements_fts(announcements_fts) VALUES ('rebuild')"
+
+    fts = table("announcements_fts", column("rowid"), column("rank"))
+
+    # every term has to match, as a prefix so "комн" finds "комнаты"
+    def get_query(self, terms: tuple) -> str:
+        return " ".join(f'"{term}"*' for term in terms)
+
+    # (id, rank) of the matching announcements, lower rank is more relevant (bm25)
+    def ranked(self, terms: tuple):
+        return select(self.fts.c.rowid.label("id"), self.fts.c.rank.label("rank"))\
+            .where(literal_column("announcements_fts").match(self.get_query(terms)))\
+            .subquery("search")
+
+
+# generated tsvector column with a GIN index, maintained by postgres itself
+class PostgresFtsBackend:
+    ddl = [
+        "ALTER TABLE announcements ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS "
+        "(to_tsvector('simple', coalesce(address, '') || ' ' || coalesce(description, ''))) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_announcements_search_vector ON announcements USING gin (search_vector)",
+    ]
+    rebuild = None
+
+    announcements = table("announcements", column("id"), column("search_vector"))
+
+    def get_query(self, terms: tuple) -> str:
+        return " & ".join(f"{term}:*" for term in terms)
+
+    # ts_rank grows with relevance, negated so that lower is more relevant like in SQLite
+    def ranked(self, terms: tuple):
+        query = func.to_tsquery("simple", self.get_query(terms))
+        return select(self.announcements.c.id, (-func.ts_rank(self.announcements.c.search_vector, query)).label("rank"))\
+            .where(self.announcements.c.search_vector.op("@@")(query))\
+            .subquery("search")
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteFtsBackend,
+    "postgresql": PostgresFtsBackend,
+}
+
+
+# q was given but the database has no full text search support here
+class SearchUnavailable(Exception):
+    pass
+
+
+# None when the database has no full text search support here
+def get_search_backend(url: str = SQLALCHEMY_DATABASE_URL):
+    backend = SEARCH_BACKENDS.get(make_url(url).get_backend_name())
+    return backend() if backend is not None else None
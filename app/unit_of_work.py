@@ -0,0 +1,54 @@
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .instrumentation import ProfiledRoute
+
+
+def get_session(db) -> Session:
+    return getattr(db, "sync_session", db)
+
+
+# callbacks that have to wait for the commit, like cache invalidation:
+# dropping a cache entry before the commit lets a concurrent read cache the old row again.
+# they are dropped when the transaction rolls back
+def on_commit(db, callback):
+    get_session(db).info.setdefault("on_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def run_on_commit(session: Session):
+    for callback in session.info.pop("on_commit", ()):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_on_commit(session: Session):
+    session.info.pop("on_commit", None)
+
+
+async def commit(db):
+    if isinstance(db, AsyncSession):
+        await db.commit()
+    else:
+        await run_in_threadpool(db.commit)
+
+
+# one transaction per request: repositories only flush, the session get_db put in
+# request.state.db is committed once the endpoint returned, before the response is sent.
+# an exception in the endpoint skips the commit and the session rolls back when get_db closes it
+class UnitOfWorkRoute(ProfiledRoute):
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def commit_handler(request: Request):
+            response = await handler(request)
+            db = getattr(request.state, "db", None)
+            if db is not None:
+                await commit(db)
+            return response
+
+        return commit_handler
@@ -0,0 +1,346 @@
+import asyncio
+import datetime
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable
+
+from sqlalchemy.exc import DataError, IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from .metrics import registry
+from .repositories.comments_repository import CommentCreate, CommentsRepository
+from .repositories.favorites_repository import CreateFavorites, FavoriteRepositories
+
+logger = logging.getLogger(__name__)
+
+
+flush_seconds = registry.histogram("write_behind_flush_seconds", "Time to write one batch of queued writes")
+flush_size = registry.histogram(
+    "write_behind_flush_size", "Queued writes per flushed batch", buckets=(1, 5, 10, 50, 100, 500, 1000, 5000),
+)
+dropped = registry.counter("write_behind_dropped_total", "Queued writes the database rejected", ("op",))
+retried = registry.counter("write_behind_retried_total", "Queued writes put back after a failed flush")
+# summed over the queues of the process, every queue adds and removes its own writes
+queue_depth = registry.gauge("write_behind_queue_depth", "Writes waiting for the flusher")
+queue_depth.set(0)
+
+# errors a write gets again however often it is retried: constraint and value errors of the
+# database, and journal lines that are not a valid write. anything else, a lock timeout or a
+# lost connection, is retried
+BAD_WRITE_ERRORS = (IntegrityError, DataError, KeyError, TypeError, ValueError)
+
+
+LOCK_NAME = "lock"
+REPLAY_LOCK_NAME = "replay.lock"
+
+
+def list_segments(directory: str) -> list[str]:
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".ndjson"))
+    return [os.path.join(directory, name) for name in names]
+
+
+# a journal segment holds one NDJSON line per accepted write. writes go to the current
+# segment until the flusher takes the queue, then a new segment starts. closed segments
+# are deleted once every write in them is committed or dropped as bad, after a failed
+# flush they wait for the next one. segments left over from a crash are replayed on
+# startup, a crash between a commit and the delete replays the committed writes twice.
+#
+# the workers of one deployment share the directory, each process writes its segments to
+# a worker-<host>-<pid> directory of its own and holds a lock on it while it lives.
+# a starting worker takes over the segments of directories whose lock is free
+class Journal:
+
+    def __init__(self, directory: str, fsync: bool = True):
+        self.root = directory
+        self.fsync = fsync
+        self.directory = None
+        self.lock = None
+        self.segments = []
+        self.number = 1
+        self.file = None
+
+    # claims the directory of this process and takes over the segments of dead workers.
+    # called on startup and not on import, a preloading server forks the workers after the import
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        # one worker at a time, so a directory that is being claimed is never taken for a dead one
+        with open(os.path.join(self.root, REPLAY_LOCK_NAME), "a") as replay_lock:
+            fcntl.flock(replay_lock, fcntl.LOCK_EX)
+            self.directory = os.path.join(self.root, f"worker-{socket.gethostname()}-{os.getpid()}")
+            os.makedirs(self.directory, exist_ok=True)
+            self.lock = open(os.path.join(self.directory, LOCK_NAME), "a")
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # a restarted container can get the pid of its previous life, those segments are ours
+            self.segments = list_segments(self.directory)
+            self.number = int(os.path.basename(self.segments[-1]).split(".")[0]) + 1 if self.segments else 1
+            # segments of older versions sit in the root
+            self.adopt(list_segments(self.root))
+            for name in sorted(os.listdir(self.root)):
+                directory = os.path.join(self.root, name)
+                if directory != self.directory and os.path.isdir(directory):
+                    self.adopt_directory(directory)
+
+    def adopt_directory(self, directory: str):
+        with open(os.path.join(directory, LOCK_NAME), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # a live worker
+                return
+            self.adopt(list_segments(directory))
+            os.remove(lock.name)
+        try:
+            os.rmdir(directory)
+        except OSError:
+            logger.warning("left %s behind, it holds more than journal segments", directory)
+
+    # moved under the next numbers of this worker, the order within a segment list is kept
+    def adopt(self, paths: list[str]):
+        for path in paths:
+            os.replace(path, self.path)
+            logger.info("took over the journal segment %s", path)
+            self.segments.append(self.path)
+            self.number += 1
+
+    # the directory goes away with its last segment, writes left behind wait for the next start
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.directory is None:
+            return
+        with open(os.path.join(self.root, REPLAY_LOCK_NAME), "a") as replay_lock:
+            fcntl.flock(replay_lock, fcntl.LOCK_EX)
+            if not list_segments(self.directory):
+                os.remove(self.lock.name)
+                os.rmdir(self.directory)
+            self.lock.close()
+        self.directory = self.lock = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.number:012d}.ndjson")
+
+    def append(self, op: dict):
+        if self.directory is None:
+            self.open()
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(op, ensure_ascii=False) + "\n")
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    # closes the current segment, the next append starts a new one
+    def rotate(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.segments.append(self.path)
+        self.number += 1
+
+    def remove_segments(self):
+        for path in self.segments:
+            os.remove(path)
+        self.segments = []
+
+    @staticmethod
+    def read(path: str) -> list[dict]:
+        ops = []
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                # the last line of a crashed process can be cut off, it was never acknowledged
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning("skipped a broken line in %s", path)
+        return ops
+
+
+# comment and favorite writes of the API, acknowledged once they are journaled.
+# a background task writes them in batched transactions every interval seconds,
+# or as soon as batch_size writes are waiting
+class WriteBehindQueue:
+
+    def __init__(self, session_factory, journal: Journal, interval: float = 0.1, batch_size: int = 500,
+                 max_backoff: float = 30, on_flushed: Callable = None):
+        self.session_factory = session_factory
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        # seconds between retries double after every failed flush up to max_backoff
+        self.max_backoff = max_backoff
+        # called with the flushed ops and the session before the commit, e.g. to invalidate caches
+        self.on_flushed = on_flushed
+        self.comments_repository = CommentsRepository()
+        self.favorites_repository = FavoriteRepositories()
+        self.pending = []
+        # handlers of the sync app submit from the threadpool
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+
+    def submit(self, op: dict):
+        with self.lock:
+            self.journal.append(op)
+            self.pending.append(op)
+            full = len(self.pending) >= self.batch_size
+        queue_depth.inc()
+        if full and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def add_comment(self, comment: CommentCreate):
+        self.submit({"op": "comment", "content": comment.content, "author_id": int(comment.author_id),
+                     "announce_id": comment.announce_id, "created_at": comment.created_at.isoformat()})
+
+    def add_favorite(self, favorite: CreateFavorites):
+        self.submit({"op": "favorite", "user_id": int(favorite.user_id), "announcement_id": favorite.announcement_id,
+                     "address": favorite.address})
+
+    def delete_favorite(self, user_id: int, announcement_id: int):
+        self.submit({"op": "unfavorite", "user_id": int(user_id), "announcement_id": announcement_id})
+
+    # queues the segments of a previous process, the first flush writes them before the app takes requests
+    def replay(self):
+        self.journal.open()
+        for path in self.journal.segments:
+            ops = self.journal.read(path)
+            logger.info("replaying %d queued writes from %s", len(ops), path)
+            self.pending.extend(ops)
+            queue_depth.inc(len(ops))
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.replay()
+        if not await self.try_flush():
+            logger.warning("could not write the replayed journal yet, retrying in the background")
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if not await self.try_flush():
+            logger.warning("%d queued writes stay in the journal for the next start", len(self.pending))
+        self.journal.close()
+
+    async def try_flush(self) -> bool:
+        try:
+            return await run_in_threadpool(self.flush)
+        except Exception:
+            logger.exception("write-behind flush failed, the journal keeps the writes")
+            return False
+
+    async def run(self):
+        delay = 0
+        while True:
+            # no early wakeups while the database is failing, the queue only grows meanwhile
+            if delay:
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            if await self.try_flush():
+                delay = 0
+            else:
+                delay = min(max(delay * 2, self.interval), self.max_backoff)
+
+    # False when writes had to go back to the queue, their segments stay until a flush gets them all in
+    def flush(self) -> bool:
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return True
+                ops, self.pending = self.pending, []
+                self.journal.rotate()
+            queue_depth.dec(len(ops))
+            left = self.write(ops)
+            if left:
+                retried.inc(len(left))
+                with self.lock:
+                    self.pending = left + self.pending
+                queue_depth.inc(len(left))
+                return False
+            self.journal.remove_segments()
+            return True
+
+    # returns the writes that are not in yet, in order, after the first batch that failed for a retryable error
+    def write(self, ops: list[dict]) -> list[dict]:
+        for start in range(0, len(ops), self.batch_size):
+            batch = ops[start:start + self.batch_size]
+            started = time.perf_counter()
+            db = self.session_factory()
+            try:
+                left = self.write_batch(batch, db)
+            finally:
+                db.close()
+            flush_size.observe(len(batch))
+            flush_seconds.observe(time.perf_counter() - started)
+            if left:
+                return left + ops[start + self.batch_size:]
+        return []
+
+    def write_batch(self, batch: list[dict], db) -> list[dict]:
+        try:
+            self.apply(batch, db)
+            db.commit()
+            return []
+        except Exception as e:
+            db.rollback()
+            if not isinstance(e, BAD_WRITE_ERRORS):
+                logger.warning("write-behind batch failed, retrying: %s", e)
+                return batch
+        # find the writes to blame, the rest still go in
+        for i, op in enumerate(batch):
+            try:
+                self.apply([op], db)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if not isinstance(e, BAD_WRITE_ERRORS):
+                    logger.warning("write-behind write failed, retrying: %s", e)
+                    return batch[i:]
+                dropped.inc(op=op.get("op"))
+                logger.error("dropped queued write %s: %s", op, e)
+        return []
+
+    # favorites are coalesced per (user, announcement): a delete drops the earlier rows,
+    # the last add of the batch inserts one row
+    def apply(self, ops: list[dict], db):
+        comments = []
+        favorites = {}
+        for op in ops:
+            if op["op"] == "comment":
+                comments.append(CommentCreate(content=op["content"], author_id=op["author_id"],
+                                              announce_id=op["announce_id"],
+                                              created_at=datetime.datetime.fromisoformat(op["created_at"])))
+                continue
+            key = (op["user_id"], op["announcement_id"])
+            delete, _ = favorites.get(key, (False, None))
+            if op["op"] == "unfavorite":
+                favorites[key] = (True, None)
+            else:
+                favorites[key] = (delete, CreateFavorites(user_id=op["user_id"], announcement_id=op["announcement_id"],
+                                                          address=op["address"]))
+        if comments:
+            self.comments_repository.bulk_create_comments(comments, db=db)
+        deletes = [key for key, (delete, _) in favorites.items() if delete]
+        if deletes:
+            self.favorites_repository.bulk_delete_favorites(deletes, db=db)
+        inserts = [favorite for _, favorite in favorites.values() if favorite is not None]
+        if inserts:
+            self.favorites_repository.bulk_create_favorites(inserts, db=db)
+        if self.on_flushed is not None:
+            self.on_flushed(ops, db)
@@ -0,0 +1,53 @@
+"""Diff of two benchmarks.run results.
+
+Prints p50/p95/p99 and throughput per scenario side by side and exits
+with 1 when a p95 got slower by more than --threshold percent.
+
+    python -m benchmarks.compare before.json after.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed p95 slowdown in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    rows = [("total", before["total"], after["total"])]
+    rows += [(name, before["scenarios"][name], after["scenarios"][name])
+             for name in before["scenarios"] if name in after["scenarios"]]
+
+    regressions = []
+    print(f"{'scenario':12}" + "".join(f"{metric:>30}" for metric in METRICS))
+    for name, old, new in rows:
+        if not old.get("count") or not new.get("count"):
+            continue
+        cells = []
+        for metric in METRICS:
+            cells.append(f"{old[metric]:>10} -> {new[metric]:<10} {change(old[metric], new[metric]):+6.1f}%")
+        print(f"{name:12}" + "".join(f"{cell:>30}" for cell in cells))
+        if change(old["p95_ms"], new["p95_ms"]) > args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"p95 slower by more than {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Query budgets and wall time of the repository methods and read handlers.
+
+Seeds a throwaway SQLite database with benchmarks.seed and runs every case
+--repeat times on a fresh session. Every repeat clears the caches of the
+app (response, count and facet, token) and runs the case twice: a cold run
+that goes to the database and a warm one served by the caches. Statements
+are counted through the engine events of app.instrumentation, handlers
+through the Server-Timing header the middleware adds. Prints the query
+count, the budget, the best / median cold time and the median warm time
+per case, and exits with 1 when a case runs more queries than its budget.
+An N+1 shows up as a count that grows with the rows returned, so budgets
+do not depend on the page size.
+
+Times depend on the machine, so they are pinned against a run saved with
+--output on the same one: with --baseline the run also fails when the
+median cold time of a case grew by more than --threshold percent (and more
+than --slack-ms, sub-millisecond cases are noisy).
+
+    python -m benchmarks.query_budget [--scale 5000] [--repeat 20] [--output main.json]
+    python -m benchmarks.query_budget --baseline main.json [--threshold 25]
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from typing import Callable
+
+from attr import define
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.auth import encode
+from app.database import listen_query_events
+from app.instrumentation import RequestStats, request_stats
+from app.auth import token_cache
+from app.main import announce_cache, announce_repository, app, get_db
+from app.repositories.users_repository import UsersRepository
+from app.repositories.announcement_repository import AnnouncementsRepository
+from app.repositories.comments_repository import Comment, CommentsRepository
+from app.repositories.favorites_repository import Favorites, FavoriteRepositories
+from app.repositories.popular_repository import PopularRepository
+
+from .seed import seed_database
+
+
+@define
+class Case:
+    name: str
+    budget: int
+    run: Callable
+
+
+@define
+class Result:
+    name: str
+    budget: int
+    queries: int
+    best_ms: float
+    median_ms: float
+    warm_median_ms: float
+
+
+def repository_cases(announcements: AnnouncementsRepository, announce_id: int, user_id: int) -> list[Case]:
+    comments = CommentsRepository()
+    favorites = FavoriteRepositories()
+    users = UsersRepository()
+    popular = PopularRepository()
+    return [
+        Case("AnnouncementsRepository.search_announce", 2,
+             lambda db: announcements.search_announce(db=db, limit=20)),
+        Case("AnnouncementsRepository.search_announce q", 2,
+             lambda db: announcements.search_announce(db=db, limit=20, q="Абая")),
+        Case("AnnouncementsRepository.search_announce geo", 2,
+             lambda db: announcements.search_announce(db=db, limit=20, lat=43.25, lon=76.9, radius_km=2)),
+        Case("AnnouncementsRepository.facet_announce", 1,
+             lambda db: announcements.facet_announce(db=db, _type="rent")),
+        Case("AnnouncementsRepository.get_by_id", 1,
+             lambda db: announcements.get_by_id(id=announce_id, db=db)),
+        Case("CommentsRepository.get_by_announce_id", 1,
+             lambda db: comments.get_by_announce_id(announce_id=announce_id, db=db)),
+        Case("CommentsRepository.get_response_comments", 1,
+             lambda db: comments.get_response_comments(announce_id=announce_id, db=db, limit=50)),
+        Case("FavoriteRepositories.get_response_favorites", 1,
+             lambda db: favorites.get_response_favorites(user_id=user_id, db=db)),
+        Case("UsersRepository.get_by_id", 1,
+             lambda db: users.get_by_id(user_id=user_id, db=db)),
+        Case("PopularRepository.get_popular", 1,
+             lambda db: popular.get_popular(db=db, limit=20)),
+        Case("PopularRepository.get_popular city", 1,
+             lambda db: popular.get_popular(db=db, city="Алматы", limit=20)),
+    ]
+
+
+def handler_cases(announce_id: int, user_id: int) -> list[Case]:
+    headers = {"Authorization": f"Bearer {encode(str(user_id))}"}
+    return [
+        Case("GET /shanyraks", 2, lambda client: client.get("/shanyraks", params={"limit": 20})),
+        Case("GET /shanyraks q", 2, lambda client: client.get("/shanyraks", params={"limit": 20, "q": "Абая"})),
+        Case("GET /shanyraks/facets", 1, lambda client: client.get("/shanyraks/facets")),
+        Case("GET /shanyraks/{id}", 1, lambda client: client.get(f"/shanyraks/{announce_id}")),
+        Case("GET /shanyraks/{id}/comments", 2,
+             lambda client: client.get(f"/shanyraks/{announce_id}/comments", params={"limit": 50})),
+        Case("GET /auth/users/favorites/shanyraks", 1,
+             lambda client: client.get("/auth/users/favorites/shanyraks", headers=headers)),
+        Case("GET /auth/users/me", 1, lambda client: client.get("/auth/users/me", headers=headers)),
+        Case("GET /shanyraks/popular", 1, lambda client: client.get("/shanyraks/popular", params={"city": "Алматы"})),
+    ]
+
+
+def run_repository_case(session_factory, case: Case) -> tuple[int, float]:
+    stats = RequestStats()
+    token = request_stats.set(stats)
+    try:
+        with session_factory() as db:
+            started = time.perf_counter()
+            case.run(db)
+            elapsed = time.perf_counter() - started
+    finally:
+        request_stats.reset(token)
+    return stats.queries, elapsed
+
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def run_handler_case(client: TestClient, case: Case) -> tuple[int, float]:
+    started = time.perf_counter()
+    response = case.run(client)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise SystemExit(f"{case.name}: {response.status_code} {response.text}")
+    return int(SERVER_TIMING_QUERIES.search(response.headers["server-timing"]).group(1)), elapsed
+
+
+def is_slower(baseline_ms: float, median_ms: float, threshold: float, slack_ms: float) -> bool:
+    return median_ms > baseline_ms * (1 + threshold / 100) and median_ms - baseline_ms > slack_ms
+
+
+# the count and facet caches of the repositories, the response cache and the token cache
+def clear_caches(repositories: list[AnnouncementsRepository]):
+    for repository in repositories:
+        repository.count_cache.clear()
+    if announce_cache is not None:
+        announce_cache.clear()
+    token_cache.clear()
+
+
+# queries of the cold runs, they miss every cache. best and median are cold times
+def measure(case: Case, run, repeat: int, clear: Callable) -> Result:
+    queries, times, warm_times = 0, [], []
+    for _ in range(repeat):
+        clear()
+        count, elapsed = run(case)
+        queries = max(queries, count)
+        times.append(elapsed)
+        warm_times.append(run(case)[1])
+    return Result(name=case.name, budget=case.budget, queries=queries,
+                  best_ms=min(times) * 1000, median_ms=statistics.median(times) * 1000,
+                  warm_median_ms=statistics.median(warm_times) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="save the median cold time per case, a baseline for later runs")
+    parser.add_argument("--baseline", help="median cold times saved with --output")
+    parser.add_argument("--threshold", type=float, default=25, help="allowed median cold slowdown in percent")
+    parser.add_argument("--slack-ms", type=float, default=0.5, help="slowdowns below this many ms always pass")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    listen_query_events(engine)
+    seed_database(engine, scale=args.scale)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    # the busiest announcement and the user with the most favorites, the worst case for an N+1
+    with session_factory() as db:
+        announce_id = db.scalar(select(Comment.announce_id).group_by(Comment.announce_id).order_by(func.count().desc()).limit(1))
+        user_id = db.scalar(select(Favorites.user_id).group_by(Favorites.user_id).order_by(func.count().desc()).limit(1))
+
+    def get_seeded_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = get_seeded_db
+    client = TestClient(app)
+
+    announcements = AnnouncementsRepository()
+    clear = lambda: clear_caches([announcements, announce_repository])
+    results = [measure(case, lambda case: run_repository_case(session_factory, case), args.repeat, clear)
+               for case in repository_cases(announcements, announce_id, user_id)]
+    results += [measure(case, lambda case: run_handler_case(client, case), args.repeat, clear)
+                for case in handler_cases(announce_id, user_id)]
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    over_budget = [result for result in results if result.queries > result.budget]
+    slower = [result for result in results
+              if result.name in baseline and is_slower(baseline[result.name], result.median_ms, args.threshold, args.slack_ms)]
+    for result in results:
+        marks = []
+        if result in over_budget:
+            marks.append("OVER BUDGET")
+        if result in slower:
+            marks.append(f"SLOWER than {baseline[result.name]:.2f} ms")
+        print(f"{result.name:48} {result.queries:3} / {result.budget:<3} queries "
+              f"{result.best_ms:8.2f} ms best {result.median_ms:8.2f} ms median "
+              f"{result.warm_median_ms:8.2f} ms warm  {' '.join(marks)}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({result.name: round(result.median_ms, 3) for result in results}, file, indent=2)
+    if over_budget or slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Load test of the HTTP API on the seeded data.
+
+Drives a weighted mix of scenarios (see benchmarks.scenarios) with a fixed
+number of concurrent clients, either in process through the ASGI app or
+against a running server (scripts/launch.sh) on the same database. Writes
+p50/p95/p99 latency and throughput per scenario as JSON, two runs are
+diffed with benchmarks.compare.
+
+    python -m benchmarks.seed --scale 100000 --reset
+    python -m benchmarks.run --requests 5000 --concurrency 16 --output before.json
+    python -m benchmarks.run --url http://127.0.0.1:8000 --output after.json
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import httpx
+from sqlalchemy import func, select
+
+from app.config import DATABASE_URL
+from app.database import SessionLocal
+from app.repositories.users_repository import User
+from app.repositories.announcement_repository import Announcement
+
+from .scenarios import DEFAULT_MIX, SCENARIOS, Context
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# nearest rank, values are sorted
+def percentile(values: list, p: float) -> float:
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    latencies = sorted(latency for latency, _ in samples)
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "errors": sum(1 for _, status in samples if status >= 400),
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def load_context(rng: random.Random, users: int) -> Context:
+    with SessionLocal() as db:
+        first, last = db.execute(select(func.min(Announcement.id), func.max(Announcement.id))).one()
+        usernames = db.scalars(select(User.username).where(User.username.like("bench%")).order_by(User.id).limit(users)).all()
+    if first is None or not usernames:
+        raise SystemExit("no seeded data, run python -m benchmarks.seed first")
+    return Context(rng=rng, announce_ids=range(first, last + 1), usernames=list(usernames))
+
+
+def get_client(args) -> httpx.AsyncClient:
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    app = importlib.import_module(args.app).app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=args.timeout)
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    context = load_context(rng, args.users)
+    weights = parse_mix(args.mix)
+    names = rng.choices(list(weights), weights=list(weights.values()), k=args.warmup + args.requests)
+    samples = {name: [] for name in weights}
+
+    async with get_client(args) as client:
+        for username in context.usernames:
+            response = await client.post("/auth/users/login", data={"username": username, "password": "password"})
+            response.raise_for_status()
+            context.tokens.append(response.json()["access_token"])
+
+        for name in names[:args.warmup]:
+            await SCENARIOS[name](client, context)
+
+        queue = iter(names[args.warmup:])
+
+        async def worker():
+            for name in queue:
+                started = time.perf_counter()
+                response = await SCENARIOS[name](client, context)
+                samples[name].append((time.perf_counter() - started, response.status_code))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "target": args.url or args.app,
+            "database": DATABASE_URL,
+            "announcements": len(context.announce_ids),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "seed": args.seed,
+            "python": platform.python_version(),
+        },
+        "total": summarize([sample for values in samples.values() for sample in values], duration),
+        "scenarios": {name: summarize(values, duration) for name, values in samples.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="a running server, by default the app is called in process")
+    parser.add_argument("--app", default="app.main", help="module of the in process app, e.g. app.async_main")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,...")
+    parser.add_argument("--users", type=int, default=10, help="seeded users that log in for the favorites scenario")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--output", help="JSON file, printed to stdout when not given")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    total = result["total"]
+    print(f"{total['count']} requests, {total['errors']} errors, {total['throughput_rps']} req/s, "
+          f"p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, p99 {total['p99_ms']} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Request scenarios of the benchmark runner.
+
+A scenario is one request against the API, picked by weight from the mix.
+The ids it asks for come from the seeded data (see benchmarks.seed).
+"""
+import random
+
+from attr import define, field
+
+from .seed import CITIES, PASSWORD, STREETS, WORDS
+
+
+@define
+class Context:
+    rng: random.Random
+    announce_ids: range
+    usernames: list
+    tokens: list = field(factory=list)
+    # next_cursor of comment pages read so far, the comments scenario follows them
+    comment_cursors: list = field(factory=list)
+
+    def announce_id(self) -> int:
+        return self.rng.choice(self.announce_ids)
+
+    # the tenth of the announcements with most of the comments
+    def hot_announce_id(self) -> int:
+        return self.rng.choice(self.announce_ids[:max(1, len(self.announce_ids) // 10)])
+
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+
+# GET /shanyraks with a random mix of the filters a search page sends
+async def listing(client, context: Context):
+    rng = context.rng
+    params = {"limit": 20}
+    if rng.random() < 0.6:
+        params["_type"] = rng.choice(("rent", "sell"))
+    if rng.random() < 0.4:
+        params["rooms_count"] = rng.randint(1, 5)
+    if rng.random() < 0.4:
+        price_from = rng.randrange(50, 2000) * 1000
+        params["price_from"], params["price_until"] = price_from, price_from * rng.randint(2, 10)
+    if rng.random() < 0.2:
+        params["area_from"] = rng.randint(20, 80)
+    if rng.random() < 0.2:
+        params["q"] = rng.choice(STREETS + WORDS)
+    elif rng.random() < 0.2:
+        min_lat, max_lat, min_lon, max_lon = CITIES[rng.choice(list(CITIES))]
+        params["lat"], params["lon"] = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        params["radius_km"] = rng.choice((1, 2, 5))
+    elif rng.random() < 0.2:
+        params["sort"] = rng.choice(("price", "area", "price_per_m2"))
+    return await client.get("/shanyraks", params=params)
+
+
+async def detail(client, context: Context):
+    return await client.get(f"/shanyraks/{context.announce_id()}")
+
+
+# first pages of busy announcements, or the next page of one read before
+async def comments(client, context: Context):
+    if context.comment_cursors and context.rng.random() < 0.5:
+        id, cursor = context.comment_cursors.pop(context.rng.randrange(len(context.comment_cursors)))
+        response = await client.get(f"/shanyraks/{id}/comments", params={"limit": 20, "cursor": cursor})
+    else:
+        id = context.hot_announce_id()
+        response = await client.get(f"/shanyraks/{id}/comments", params={"limit": 20})
+    if response.status_code == 200 and response.json().get("next_cursor"):
+        context.comment_cursors.append((id, response.json()["next_cursor"]))
+    return response
+
+
+# the home page feed of a city or of the whole country
+async def popular(client, context: Context):
+    params = {"limit": 20}
+    if context.rng.random() < 0.8:
+        params["city"] = context.rng.choice(list(CITIES))
+    return await client.get("/shanyraks/popular", params=params)
+
+
+async def favorites(client, context: Context):
+    return await client.get("/auth/users/favorites/shanyraks", headers=context.headers())
+
+
+async def login(client, context: Context):
+    return await client.post("/auth/users/login", data={"username": context.rng.choice(context.usernames), "password": PASSWORD})
+
+
+SCENARIOS = {
+    "listing": listing,
+    "detail": detail,
+    "comments": comments,
+    "favorites": favorites,
+    "login": login,
+    "popular": popular,
+}
+
+DEFAULT_MIX = "listing=50,detail=25,comments=15,favorites=8,login=2"
@@ -0,0 +1,188 @@
+"""Seeded data generator for the benchmarks.
+
+Fills the database of DATABASE_URL (sql_app.db by default) with users,
+announcements, comments and favorites. --scale is the number of
+announcements (10k .. 1M), the other tables are sized from it unless
+given. The same --seed gives the same rows.
+
+Every user is "bench<i>" with the password "password".
+
+    python -m benchmarks.seed --scale 100000 [--reset]
+"""
+import argparse
+import datetime
+import random
+import time
+
+from sqlalchemy import create_engine, delete, func, insert, select, update
+
+from app.config import DATABASE_URL
+from app.database import Base, is_sqlite
+from app.passwords import hash_password
+from app.repositories.users_repository import User
+from app.repositories.announcement_repository import Announcement, get_geohash
+from app.repositories.comments_repository import Comment
+from app.repositories.favorites_repository import Favorites
+from app.repositories.popular_repository import PopularAnnouncement, PopularRepository
+
+
+PASSWORD = "password"
+BATCH_SIZE = 10000
+
+CITIES = {
+    "Алматы": (43.15, 43.35, 76.80, 77.05),
+    "Астана": (51.05, 51.25, 71.30, 71.55),
+    "Шымкент": (42.25, 42.40, 69.50, 69.70),
+}
+STREETS = ("Абая", "Сатпаева", "Достык", "Толе би", "Гагарина", "Жандосова", "Розыбакиева", "Манаса", "Кабанбай батыра", "Республики")
+WORDS = ("светлая", "уютная", "ремонт", "балкон", "парковка", "мебель", "новостройка", "школа", "метро", "вид на горы",
+         "тихий двор", "кондиционер", "евроремонт", "без мебели", "рядом парк", "высокие потолки")
+
+
+def batches(rows, size: int = BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate_users(rng: random.Random, first_id: int, count: int, password: str):
+    cities = list(CITIES)
+    for id in range(first_id, first_id + count):
+        yield {"id": id, "username": f"bench{id}", "phone": f"+7701{rng.randrange(10 ** 7):07d}",
+               "password": password, "name": f"Bench {id}", "city": rng.choice(cities)}
+
+
+# a quarter of the announcements have no coordinates, like listings added before lat/lon
+def generate_announcements(rng: random.Random, first_id: int, count: int, user_ids: range):
+    cities = list(CITIES)
+    for id in range(first_id, first_id + count):
+        rooms_count = rng.randint(1, 5)
+        city = rng.choice(cities)
+        lat = lon = None
+        if rng.random() < 0.75:
+            min_lat, max_lat, min_lon, max_lon = CITIES[city]
+            lat, lon = round(rng.uniform(min_lat, max_lat), 6), round(rng.uniform(min_lon, max_lon), 6)
+        yield {
+            "id": id,
+            "type": rng.choice(("rent", "sell")),
+            "price": rng.randrange(50, 5000) * 1000 * (1 if rng.random() < 0.5 else 50),
+            "address": f"{city}, {rng.choice(STREETS)} {rng.randint(1, 300)}",
+            "area": round(rooms_count * rng.uniform(18, 35), 1),
+            "rooms_count": rooms_count,
+            "description": " ".join(rng.sample(WORDS, 4)),
+            "owner_id": rng.choice(user_ids),
+            "lat": lat,
+            "lon": lon,
+            "geohash": get_geohash(lat, lon),
+        }
+
+
+# comments are skewed: a tenth of the announcements get most of them
+def generate_comments(rng: random.Random, first_id: int, count: int, user_ids: range, announce_ids: range):
+    hot = announce_ids[:max(1, len(announce_ids) // 10)]
+    started = datetime.datetime(2023, 1, 1)
+    for id in range(first_id, first_id + count):
+        yield {
+            "id": id,
+            "content": " ".join(rng.sample(WORDS, 3)),
+            "created_at": started + datetime.timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+            "author_id": rng.choice(user_ids),
+            "announce_id": rng.choice(hot) if rng.random() < 0.8 else rng.choice(announce_ids),
+        }
+
+
+def generate_favorites(rng: random.Random, first_id: int, count: int, user_ids: range, announce_ids: range):
+    for id in range(first_id, first_id + count):
+        yield {"id": id, "user_id": rng.choice(user_ids), "announcement_id": rng.choice(announce_ids),
+               "address": f"{rng.choice(STREETS)} {rng.randint(1, 300)}"}
+
+
+def next_id(connection, model) -> int:
+    return (connection.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def reset(engine):
+    Base.metadata.drop_all(engine)
+    # the triggers go with the table, the virtual tables stay behind
+    if is_sqlite(engine.url):
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DROP TABLE IF EXISTS announcements_fts")
+            connection.exec_driver_sql("DROP TABLE IF EXISTS announcements_rtree")
+
+
+def insert_rows(connection, model, rows) -> int:
+    inserted = 0
+    for batch in batches(rows):
+        connection.execute(insert(model), batch)
+        inserted += len(batch)
+    return inserted
+
+
+# users, comments and favorites default to scale / 100 (at least 10), 2 * scale and scale / 2
+def seed_database(engine, scale: int, users: int = None, comments: int = None, favorites: int = None,
+                  seed: int = 42) -> dict:
+    users = users if users is not None else max(10, scale // 100)
+    comments = comments if comments is not None else 2 * scale
+    favorites = favorites if favorites is not None else scale // 2
+
+    rng = random.Random(seed)
+    Base.metadata.create_all(engine)
+    counts = {}
+    with engine.begin() as connection:
+        if is_sqlite(engine.url):
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+
+        user_ids = range(next_id(connection, User), next_id(connection, User) + users)
+        announce_ids = range(next_id(connection, Announcement), next_id(connection, Announcement) + scale)
+        # every user gets the same hash, one pbkdf2 run instead of one per user
+        password = hash_password(PASSWORD)
+        counts["users"] = insert_rows(connection, User, generate_users(rng, user_ids.start, users, password))
+
+        counts["announcements"] = insert_rows(
+            connection, Announcement, generate_announcements(rng, announce_ids.start, scale, user_ids)
+        )
+        counts["comments"] = insert_rows(
+            connection, Comment, generate_comments(rng, next_id(connection, Comment), comments, user_ids, announce_ids)
+        )
+        connection.execute(
+            update(Announcement)
+            .where(Announcement.id.between(announce_ids.start, announce_ids.stop - 1))
+            .values(comments_count=select(func.count(Comment.id)).where(Comment.announce_id == Announcement.id).scalar_subquery())
+        )
+        counts["favorites"] = insert_rows(
+            connection, Favorites, generate_favorites(rng, next_id(connection, Favorites), favorites, user_ids, announce_ids)
+        )
+        # the ranking of GET /shanyraks/popular, like python -m app.popular
+        connection.execute(delete(PopularAnnouncement))
+        counts["popular_announcements"] = connection.execute(PopularRepository().rebuild_statement()).rowcount
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database", default=DATABASE_URL)
+    parser.add_argument("--scale", type=int, default=10000, help="announcements to add")
+    parser.add_argument("--users", type=int, help="default: scale / 100, at least 10")
+    parser.add_argument("--comments", type=int, help="default: 2 * scale")
+    parser.add_argument("--favorites", type=int, help="default: scale / 2")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the tables first")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database)
+    if args.reset:
+        reset(engine)
+    started = time.perf_counter()
+    counts = seed_database(engine, scale=args.scale, users=args.users, comments=args.comments,
+                           favorites=args.favorites, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    print(" ".join(f"{table}={count}" for table, count in counts.items()), f"in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
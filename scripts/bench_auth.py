@@ -0,0 +1,56 @@
+"""Micro-benchmark of the auth dependency.
+
+Compares a full HS256 jwt.decode with a TokenCache hit, and loading the
+profile from SQLite with a cached profile.
+
+    python -m scripts.bench_auth
+"""
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.auth import TokenCache, decode, encode
+from app.database import Base
+from app.models.users_models import ReadUserRequest
+from app.repositories.users_repository import User, UsersRepository
+from app.repositories.comments_repository import Comment
+from app.repositories.favorites_repository import Favorites
+
+
+def per_call_us(statement, number: int) -> float:
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    token = encode("1")
+    cache = TokenCache()
+    cache.get_user_id(token)
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    db.add(User(id=1, username="user", phone="", password="", name="", city=""))
+    db.commit()
+    users_repository = UsersRepository()
+
+    def load_profile():
+        db_user = users_repository.get_by_id(user_id="1", db=db)
+        return ReadUserRequest(id="1", username=db_user.username, phone=db_user.phone, name=db_user.name, city=db_user.city)
+
+    cache.set_profile("1", load_profile())
+
+    rows = [
+        ("jwt.decode", per_call_us(lambda: decode(token), 5000)),
+        ("TokenCache.get_user_id (hit)", per_call_us(lambda: cache.get_user_id(token), 50000)),
+        ("load profile from database", per_call_us(lambda: (db.expire_all(), load_profile()), 2000)),
+        ("TokenCache.get_profile (hit)", per_call_us(lambda: cache.get_profile("1"), 50000)),
+    ]
+    for name, us in rows:
+        print(f"{name:32} {us:9.2f} us/call")
+    saved = rows[0][1] - rows[1][1] + rows[2][1] - rows[3][1]
+    print(f"{'saved per GET /auth/users/me':32} {saved:9.2f} us")
+
+
+if __name__ == "__main__":
+    main()
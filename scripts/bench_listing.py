@@ -0,0 +1,109 @@
+"""Benchmark of the listing and comment responses on 100k rows.
+
+Compares loading Announcement / Comment instances and copying them into
+pydantic models (the old path) with the read-only column rows that
+search_announce and get_response_comments return now. Both sides are
+encoded with jsonable_encoder like FastAPI does for the response.
+
+    python -m scripts.bench_listing [--rows 100000]
+"""
+import argparse
+import datetime
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.main import change_response
+from app.models.announcement_models import AnnounceResponseFilter
+from app.models.comments_models import CommentResponse
+from app.responses import comment_serializer
+from app.repositories.users_repository import User
+from app.repositories.announcement_repository import Announcement, AnnounceFilter, AnnouncementsRepository
+from app.repositories.comments_repository import Comment, CommentsRepository
+from app.repositories.favorites_repository import Favorites
+
+
+def seed(db, rows: int):
+    db.add(User(id=1, username="user", phone="", password="", name="", city=""))
+    db.execute(Announcement.__table__.insert(), [
+        {"id": i, "type": "rent" if i % 2 else "sell", "price": i * 1000, "address": f"address {i}",
+         "area": 40.0 + i % 100, "rooms_count": i % 5, "description": "", "owner_id": 1}
+        for i in range(1, rows + 1)
+    ])
+    db.execute(Comment.__table__.insert(), [
+        {"content": f"comment {i}", "created_at": datetime.datetime(2023, 8, 1) + datetime.timedelta(seconds=i), "author_id": 1, "announce_id": 1}
+        for i in range(rows)
+    ])
+    db.commit()
+
+
+def orm_listing(db, repository: AnnouncementsRepository, rows: int):
+    announcements = db.scalars(repository.search_statement(AnnounceFilter(), limit=rows)).all()
+    return jsonable_encoder([
+        AnnounceResponseFilter(id=announcement.id, type=announcement.type, price=announcement.price,
+                               address=announcement.address, area=announcement.area,
+                               rooms_count=announcement.rooms_count, lat=announcement.lat, lon=announcement.lon)
+        for announcement in announcements
+    ])
+
+
+def rows_listing(db, repository: AnnouncementsRepository, rows: int):
+    announcements = repository.search_announce(db=db, limit=rows, total="none")["query"]
+    return jsonable_encoder(change_response(announcements))
+
+
+def orm_comments(db, repository: CommentsRepository):
+    return jsonable_encoder([
+        CommentResponse(id=comment.id, content=comment.content, author_id=comment.author_id, created_at=comment.created_at)
+        for comment in repository.get_by_announce_id(announce_id=1, db=db)
+    ])
+
+
+def rows_comments(db, repository: CommentsRepository):
+    return jsonable_encoder(comment_serializer(repository.get_response_comments(announce_id=1, db=db)))
+
+
+# best of a few runs, every run on a fresh session so nothing comes from the identity map
+def rows_per_second(session_factory, run, rows: int, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        db = session_factory()
+        started = time.perf_counter()
+        result = run(db)
+        elapsed = time.perf_counter() - started
+        db.close()
+        assert len(result) == rows
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        seed(db, args.rows)
+    announce_repository = AnnouncementsRepository()
+    comments_repository = CommentsRepository()
+
+    cases = [
+        ("listing", lambda db: orm_listing(db, announce_repository, args.rows),
+         lambda db: rows_listing(db, announce_repository, args.rows)),
+        ("comments", lambda db: orm_comments(db, comments_repository),
+         lambda db: rows_comments(db, comments_repository)),
+    ]
+    for name, before, after in cases:
+        orm = rows_per_second(session_factory, before, args.rows)
+        rows = rows_per_second(session_factory, after, args.rows)
+        print(f"{name:10} orm+pydantic {orm:12,.0f} rows/s   column rows {rows:12,.0f} rows/s   x{rows / orm:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Check that the hot queries are served by their indexes.
+
+Builds a throwaway SQLite database from the models, seeds it, runs ANALYZE
+and prints EXPLAIN QUERY PLAN for every query. Exits with 1 when a query
+does not use the expected index.
+
+    python -m scripts.explain_query_plan
+"""
+import datetime
+import random
+import sys
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.repositories.users_repository import User
+from app.repositories.announcement_repository import Announcement, AnnounceFilter, AnnouncementsRepository
+from app.repositories.comments_repository import Comment, CommentsRepository
+from app.repositories.favorites_repository import Favorites, FavoriteRepositories
+from app.repositories.popular_repository import PopularRepository
+
+
+def seed(db, users: int = 200, announcements: int = 20000):
+    rnd = random.Random(42)
+    db.execute(User.__table__.insert(), [
+        {"id": i, "username": f"user{i}", "phone": "", "password": "", "name": "", "city": ""}
+        for i in range(1, users + 1)
+    ])
+    db.execute(Announcement.__table__.insert(), [
+        {
+            "id": i,
+            "type": rnd.choice(["rent", "sell"]),
+            "price": rnd.randrange(50_000, 5_000_000, 1000),
+            "address": f"address {i}",
+            "area": float(rnd.randrange(20, 200)),
+            "rooms_count": rnd.randrange(1, 6),
+            "description": "",
+            "owner_id": rnd.randrange(1, users + 1),
+        }
+        for i in range(1, announcements + 1)
+    ])
+    db.execute(Comment.__table__.insert(), [
+        {"content": "", "created_at": datetime.datetime(2023, 8, 1) + datetime.timedelta(minutes=i), "author_id": rnd.randrange(1, users + 1),
+         "announce_id": rnd.randrange(1, announcements + 1)}
+        for i in range(announcements)
+    ])
+    db.execute(Favorites.__table__.insert(), [
+        {"user_id": rnd.randrange(1, users + 1), "announcement_id": rnd.randrange(1, announcements + 1), "address": ""}
+        for _ in range(announcements)
+    ])
+    PopularRepository().rebuild(db=db)
+    db.commit()
+    db.execute(text("ANALYZE"))
+
+
+# the statements the repositories run, lookups without a statement builder repeat their filter
+def hot_queries():
+    announcements = AnnouncementsRepository()
+    comments = CommentsRepository()
+    favorites = FavoriteRepositories()
+    popular = PopularRepository()
+    by_type_rooms_price = AnnounceFilter(type="rent", rooms_count=2, price_from=100_000, price_until=300_000)
+    by_rooms_price = AnnounceFilter(rooms_count=3, price_from=100_000, price_until=300_000)
+    by_price = AnnounceFilter(price_from=100_000, price_until=150_000)
+    by_area = AnnounceFilter(area_from=50, area_until=55)
+    return [
+        ("search type+rooms+price", "ix_announcements_type_rooms_count_price",
+         announcements.search_statement(by_type_rooms_price, columns=announcements.listing_columns)),
+        ("count type+rooms+price", "ix_announcements_type_rooms_count_price",
+         announcements.count_statement(by_type_rooms_price)),
+        ("search rooms+price", "ix_announcements_rooms_count_price",
+         announcements.search_statement(by_rooms_price, columns=announcements.listing_columns)),
+        ("count price", "ix_announcements_price",
+         announcements.count_statement(by_price)),
+        ("count area", "ix_announcements_area",
+         announcements.count_statement(by_area)),
+        ("announcements by owner", "ix_announcements_owner_id",
+         select(Announcement).where(Announcement.owner_id == 7)),
+        ("comments by announcement", "ix_comments_announce_id_created_at_id",
+         select(Comment).where(Comment.announce_id == 7)),
+        ("comments page", "ix_comments_announce_id_created_at_id",
+         comments.response_comments_statement(announce_id=7, limit=20)),
+        ("comments page after cursor", "ix_comments_announce_id_created_at_id",
+         comments.response_comments_statement(announce_id=7, limit=20, order="newest",
+                                              after=(datetime.datetime(2023, 8, 5), 100))),
+        ("favorites by user", "ix_faborites_user_id_announcement_id",
+         select(Favorites).where(Favorites.user_id == 7)),
+        ("favorites page of user", "ix_faborites_user_id_announcement_id",
+         favorites.response_favorites_statement(user_id=7, limit=10, before_id=10000)),
+        ("favorite of user", "ix_faborites_user_id_announcement_id",
+         select(Favorites).where(Favorites.announcement_id == 7, Favorites.user_id == 7)),
+        ("favorites by announcement", "ix_faborites_announcement_id",
+         select(Favorites).where(Favorites.announcement_id == 7)),
+        ("popular page", "ix_popular_announcements_score_id",
+         popular.popular_statement(limit=20)),
+        ("popular page of city", "ix_popular_announcements_city_score_id",
+         popular.popular_statement(city="", limit=20, after=(3, 10000))),
+    ]
+
+
+def main() -> int:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    seed(db)
+
+    failed = 0
+    for name, index, statement in hot_queries():
+        sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+        plan = [row[-1] for row in db.execute(text("EXPLAIN QUERY PLAN " + sql))]
+        ok = any(index in step for step in plan)
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name} -> {index}")
+        for step in plan:
+            print(f"       {step}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 
 # Set defaults if not provided in environment
+if [ "${DATABASE_ASYNC:-0}" = "1" ]; then
+    : "${MODULE_NAME:=app.async_main}"
+fi
 : "${MODULE_NAME:=app.main}"
 : "${VARIABLE_NAME:=app}"
 : "${APP_MODULE:=$MODULE_NAME:$VARIABLE_NAME}"
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+
+# the app reads its settings on import: a throwaway SQLite database for the session,
+# the async engine next to the sync one and cheap password hashes
+directory = tempfile.mkdtemp(prefix="shanyraq-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{directory}/test.db"
+os.environ["DATABASE_ASYNC"] = "1"
+os.environ["PASSWORD_HASH_ITERATIONS"] = "1000"
+os.environ["POPULAR_REBUILD_INTERVAL"] = "0"
+os.environ["RESPONSE_CACHE_BACKEND"] = "memory"
+os.environ.pop("WRITE_BEHIND", None)
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import async_main, main
+from app.auth import token_cache
+from app.database import Base, engine
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def clear_caches():
+    main.announce_repository.count_cache.clear()
+    async_main.announce_repository.count_cache.clear()
+    if main.announce_cache is not None:
+        main.announce_cache.clear()
+    token_cache.clear()
+
+
+# empty tables for every test. the FTS5 and R*Tree tables are created with announcements
+# but are not models, drop_all leaves them behind
+@pytest.fixture(autouse=True)
+def database():
+    Base.metadata.create_all(engine)
+    yield
+    Base.metadata.drop_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS announcements_fts")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS announcements_rtree")
+    clear_caches()
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def async_client():
+    with TestClient(async_main.app) as client:
+        yield client
+
+
+# registers a user and returns the Authorization header of its token
+@pytest.fixture
+def login(client):
+    def login(username: str = "aigerim", city: str = "Алматы") -> dict:
+        response = client.post("/auth/users/", json={
+            "username": username, "phone": "+77010000000", "password": "secret", "name": username, "city": city,
+        })
+        assert response.status_code == 200, response.text
+        response = client.post("/auth/users/login", data={"username": username, "password": "secret"})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return login
+
+
+@pytest.fixture
+def headers(login):
+    return login()
+
+
+# posts an announcement and returns its id, fields override the defaults
+@pytest.fixture
+def announce(client, headers):
+    def announce(headers: dict = headers, **fields) -> int:
+        body = {"type": "rent", "price": 150000, "address": "Абая 10", "area": 45, "rooms_count": 2,
+                "description": "уютная квартира", **fields}
+        response = client.post("/shanyraks/", headers=headers, json=body)
+        assert response.status_code == 200, response.text
+        return int(response.json()["id"])
+    return announce
@@ -0,0 +1,77 @@
+import pytest
+
+from app.pagination import encode_cursor
+from app.repositories import announcement_repository
+
+
+# the routes of app.async_main on the async engine, over the same database
+@pytest.fixture
+def async_headers(async_client) -> dict:
+    body = {"username": "aigerim", "phone": "+77010000000", "password": "secret", "name": "A", "city": "Алматы"}
+    assert async_client.post("/auth/users/", json=body).status_code == 200
+    response = async_client.post("/auth/users/login", data={"username": "aigerim", "password": "secret"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def created(async_client, async_headers) -> list:
+    ids = []
+    for i in range(5):
+        body = {"type": "rent", "price": 100000 + i, "address": f"Абая {i}", "area": 45, "rooms_count": 2,
+                "description": "d", "lat": 43.238 + i / 1000, "lon": 76.945}
+        response = async_client.post("/shanyraks/", headers=async_headers, json=body)
+        assert response.status_code == 200, response.text
+        ids.append(int(response.json()["id"]))
+    return ids
+
+
+def test_cursor_pages(async_client, created):
+    seen, cursor = [], None
+    while True:
+        page = async_client.get("/shanyraks", params={"limit": 2, **({"cursor": cursor} if cursor else {})}).json()
+        seen += [item["id"] for item in page["announcement"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == sorted(created, reverse=True)
+
+
+def test_bad_cursor_is_rejected(async_client, created):
+    assert async_client.get("/shanyraks", params={"cursor": encode_cursor("x")}).status_code == 400
+
+
+def test_search_and_geo_filters(async_client, created):
+    assert async_client.get("/shanyraks", params={"q": "абая"}).json()["total"] == 5
+    page = async_client.get("/shanyraks", params={"lat": 43.238, "lon": 76.945, "radius_km": 0.15}).json()
+    assert [item["id"] for item in page["announcement"]] == [created[0], created[1]]
+    assert async_client.get("/shanyraks", params={"bbox": "76.9,43.2405,77,43.3"}).json()["total"] == 2
+
+
+def test_q_without_full_text_search_is_rejected(async_client, created, monkeypatch):
+    monkeypatch.setattr(announcement_repository, "search_backend", None)
+
+    assert async_client.get("/shanyraks", params={"q": "абая"}).status_code == 400
+
+
+def test_comments_update_the_cached_detail(async_client, async_headers, created):
+    id = created[0]
+    assert async_client.get(f"/shanyraks/{id}").json()["total_comments"] == 0
+
+    assert async_client.post(f"/shanyraks/{id}/comments", headers=async_headers, json={"content": "hi"}).status_code == 200
+
+    assert async_client.get(f"/shanyraks/{id}").json()["total_comments"] == 1
+    assert [item["content"] for item in async_client.get(f"/shanyraks/{id}/comments").json()["comments"]] == ["hi"]
+
+
+def test_favorites(async_client, async_headers, created):
+    id = created[0]
+    assert async_client.post(f"/auth/users/favorites/shanyraks/{id}", headers=async_headers).status_code == 200
+
+    response = async_client.get("/auth/users/favorites/shanyraks", headers=async_headers)
+    assert response.json()["shanyraks"] == [{"id": id, "address": "Абая 0"}]
+    assert async_client.get("/shanyraks/popular").json()["shanyraks"][0]["id"] == id
+
+    assert async_client.delete(f"/auth/users/favorites/shanyraks/{id}", headers=async_headers).status_code == 200
+    assert async_client.delete(f"/auth/users/favorites/shanyraks/{id}", headers=async_headers).status_code == 404
@@ -0,0 +1,182 @@
+import pytest
+from sqlalchemy import update
+
+from app import main
+from app.cache import RedisBackend, ResponseCache, lookups
+from app.database import SessionLocal
+from app.repositories.announcement_repository import Announcement
+
+BODY = {"type": "rent", "price": 200000, "address": "Достык 5", "area": 45, "rooms_count": 2, "description": "d"}
+
+
+# a write behind the back of the app, the cache keeps answering with the old row
+def change_price(id: int, price: int):
+    with SessionLocal() as db:
+        db.execute(update(Announcement).where(Announcement.id == id).values(price=price))
+        db.commit()
+
+
+def detail(client, id: int) -> dict:
+    response = client.get(f"/shanyraks/{id}")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_detail_is_served_from_the_cache(client, announce):
+    id = announce(price=150000)
+    assert detail(client, id)["price"] == 150000
+
+    change_price(id, 1)
+
+    assert detail(client, id)["price"] == 150000
+
+
+def test_update_invalidates_the_cached_detail(client, headers, announce):
+    id = announce(price=150000)
+    detail(client, id)
+
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=BODY).status_code == 200
+
+    assert detail(client, id)["price"] == 200000
+
+
+def test_delete_invalidates_the_cached_detail(client, headers, announce):
+    id = announce()
+    detail(client, id)
+
+    assert client.delete(f"/shanyraks/{id}", headers=headers).status_code == 200
+
+    assert client.get(f"/shanyraks/{id}").status_code == 404
+
+
+def test_comments_invalidate_the_cached_detail(client, headers, announce):
+    id = announce()
+    assert detail(client, id)["total_comments"] == 0
+
+    assert client.post(f"/shanyraks/{id}/comments", headers=headers, json={"content": "hi"}).status_code == 200
+
+    assert detail(client, id)["total_comments"] == 1
+
+
+def test_failed_update_keeps_the_cached_detail(client, login, announce):
+    id = announce(price=150000)
+    detail(client, id)
+    change_price(id, 1)
+
+    assert client.patch(f"/shanyraks/{id}", headers=login("other"), json=BODY).status_code == 403
+
+    assert detail(client, id)["price"] == 150000
+
+
+def test_profile_update_invalidates_the_cached_profile(client, headers):
+    assert client.get("/auth/users/me", headers=headers).json()["city"] == "Алматы"
+
+    response = client.patch("/auth/users/me", headers=headers, json={"phone": "+77020000000", "name": "A", "city": "Астана"})
+    assert response.status_code == 200
+
+    assert client.get("/auth/users/me", headers=headers).json()["city"] == "Астана"
+
+
+# the subset of redis-py the backend uses, keys expire with ex= like on the server
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expires[key] = ex
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.data if key.startswith(match.rstrip("*"))]
+
+
+class DownRedis:
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            raise ConnectionError("redis is down")
+        return call
+
+
+@pytest.fixture
+def redis_cache(monkeypatch):
+    def redis_cache(client_) -> ResponseCache:
+        cache = ResponseCache(RedisBackend(client_, ttl=30))
+        monkeypatch.setattr(main, "announce_cache", cache)
+        return cache
+    return redis_cache
+
+
+def redis_lookups(result: str) -> float:
+    return lookups.values.get(lookups.key({"backend": "redis", "result": result}), 0)
+
+
+def test_redis_miss_then_hit(client, announce, redis_cache):
+    redis = FakeRedis()
+    redis_cache(redis)
+    id = announce(price=150000)
+    misses, hits = redis_lookups("miss"), redis_lookups("hit")
+
+    assert detail(client, id)["price"] == 150000
+    assert redis_lookups("miss") == misses + 1
+    assert redis.expires == {f"shanyraq:announce:{id}": 30}
+
+    change_price(id, 1)
+
+    assert detail(client, id)["price"] == 150000
+    assert redis_lookups("hit") == hits + 1
+
+
+def test_redis_update_invalidates_the_cached_detail(client, headers, announce, redis_cache):
+    redis = FakeRedis()
+    redis_cache(redis)
+    id = announce(price=150000)
+    detail(client, id)
+
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=BODY).status_code == 200
+
+    assert f"shanyraq:announce:{id}" not in redis.data
+    assert detail(client, id)["price"] == 200000
+
+
+def test_redis_delete_invalidates_the_cached_detail(client, headers, announce, redis_cache):
+    redis = FakeRedis()
+    redis_cache(redis)
+    id = announce()
+    detail(client, id)
+
+    assert client.delete(f"/shanyraks/{id}", headers=headers).status_code == 200
+
+    assert redis.data == {}
+    assert client.get(f"/shanyraks/{id}").status_code == 404
+
+
+def test_redis_clear_keeps_the_keys_of_others(redis_cache):
+    redis = FakeRedis()
+    redis.set("other:announce:1", b"{}")
+    cache = redis_cache(redis)
+    cache.set("announce:1", b"{}")
+
+    cache.clear()
+
+    assert list(redis.data) == ["other:announce:1"]
+
+
+# an unreachable server is a miss, the detail is read from the database every time
+def test_redis_failures_fall_back_to_the_database(client, headers, announce, redis_cache):
+    redis_cache(DownRedis())
+    id = announce(price=150000)
+
+    assert detail(client, id)["price"] == 150000
+    change_price(id, 1)
+    assert detail(client, id)["price"] == 1
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=BODY).status_code == 200
+    assert detail(client, id)["price"] == 200000
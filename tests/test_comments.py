@@ -0,0 +1,80 @@
+import pytest
+
+from app.pagination import encode_cursor
+
+
+def comment(client, headers, id: int, content: str):
+    response = client.post(f"/shanyraks/{id}/comments", headers=headers, json={"content": content})
+    assert response.status_code == 200, response.text
+
+
+def comments(client, id: int, **params) -> dict:
+    response = client.get(f"/shanyraks/{id}/comments", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_total_comments_follows_creates_and_deletes(client, headers, announce):
+    id = announce()
+    comment(client, headers, id, "первый")
+    comment(client, headers, id, "второй")
+    assert client.get(f"/shanyraks/{id}").json()["total_comments"] == 2
+
+    first = comments(client, id)["comments"][0]["id"]
+    assert client.delete(f"/shanyraks/{id}/comments/{first}", headers=headers).status_code == 200
+
+    assert client.get(f"/shanyraks/{id}").json()["total_comments"] == 1
+
+
+@pytest.mark.parametrize("order", ["oldest", "newest"])
+def test_cursor_pages_cover_the_comments_once(client, headers, announce, order):
+    id = announce()
+    for i in range(5):
+        comment(client, headers, id, f"c{i}")
+
+    seen, cursor = [], None
+    while True:
+        page = comments(client, id, limit=2, order=order, **({"cursor": cursor} if cursor else {}))
+        seen += [item["content"] for item in page["comments"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    expected = [f"c{i}" for i in range(5)]
+    assert seen == (expected if order == "oldest" else expected[::-1])
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor(1), encode_cursor("yesterday", 1)])
+def test_bad_comments_cursor_is_rejected(client, announce, cursor):
+    id = announce()
+
+    assert client.get(f"/shanyraks/{id}/comments", params={"cursor": cursor}).status_code == 400
+
+
+def test_comments_of_a_missing_announcement(client):
+    assert client.get("/shanyraks/404/comments").status_code == 404
+
+
+def test_edit_keeps_created_at(client, headers, announce):
+    id = announce()
+    comment(client, headers, id, "до")
+    before = comments(client, id)["comments"][0]
+    assert before["updated_at"] is None
+
+    response = client.patch(f"/shanyraks/{id}/comments/{before['id']}", headers=headers, json={"content": "после"})
+    assert response.status_code == 200
+
+    after = comments(client, id)["comments"][0]
+    assert after["content"] == "после"
+    assert after["created_at"] == before["created_at"]
+    assert after["updated_at"] >= before["created_at"]
+
+
+def test_only_the_author_edits_a_comment(client, headers, login, announce):
+    id = announce()
+    comment(client, headers, id, "мой")
+    comment_id = comments(client, id)["comments"][0]["id"]
+
+    response = client.patch(f"/shanyraks/{id}/comments/{comment_id}", headers=login("other"), json={"content": "x"})
+
+    assert response.status_code == 405
@@ -0,0 +1,47 @@
+from app.pagination import encode_cursor
+
+
+def favorites(client, headers, **params) -> dict:
+    response = client.get("/auth/users/favorites/shanyraks", headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_favorites_carry_the_current_address(client, headers, announce):
+    id = announce(address="Абая 10")
+    assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+    body = {"type": "rent", "price": 1, "address": "Достык 5", "area": 45, "rooms_count": 2, "description": "d"}
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=body).status_code == 200
+
+    assert favorites(client, headers)["shanyraks"] == [{"id": id, "address": "Достык 5"}]
+
+
+def test_cursor_pages_cover_the_favorites_once(client, headers, announce):
+    created = [announce() for _ in range(5)]
+    for id in created:
+        assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+
+    seen, cursor = [], None
+    while True:
+        page = favorites(client, headers, limit=2, **({"cursor": cursor} if cursor else {}))
+        seen += [item["id"] for item in page["shanyraks"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == sorted(created, reverse=True)
+
+
+def test_bad_favorites_cursor_is_rejected(client, headers):
+    response = client.get("/auth/users/favorites/shanyraks", headers=headers, params={"cursor": encode_cursor("x")})
+
+    assert response.status_code == 400
+
+
+def test_favorites_of_other_users_are_not_deleted(client, headers, login, announce):
+    id = announce()
+    assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+
+    assert client.delete(f"/auth/users/favorites/shanyraks/{id}", headers=login("other")).status_code == 404
+    assert client.delete(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+    assert favorites(client, headers)["shanyraks"] == []
@@ -0,0 +1,57 @@
+import json
+
+
+def test_import_ndjson_skips_bad_rows(client, headers):
+    lines = [
+        {"type": "rent", "price": 100000, "address": "Абая 1", "area": "45 м²", "rooms_count": 2, "description": "d"},
+        {"type": "rent", "price": "дорого", "address": "Абая 2", "area": 45, "rooms_count": 2, "description": "d"},
+        {"type": "sell", "price": 300000, "address": "Абая 3", "area": 60, "rooms_count": 3, "description": "d",
+         "lat": 43.238, "lon": 76.945},
+    ]
+    content = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\nnot json\n"
+
+    response = client.post("/shanyraks/import", headers=headers,
+                           files={"file": ("feed.ndjson", content.encode(), "application/x-ndjson")})
+
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert report["inserted"] == 2
+    assert report["failed"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 4]
+    assert client.get("/shanyraks").json()["total"] == 2
+    # imported rows are searchable and on the map like the posted ones
+    assert client.get("/shanyraks", params={"q": "абая 3"}).json()["total"] == 1
+    assert client.get("/shanyraks", params={"lat": 43.238, "lon": 76.945, "radius_km": 1}).json()["total"] == 1
+
+
+def test_import_csv(client, headers):
+    content = "type,price,address,area,rooms_count,description,lat,lon\n" \
+              "rent,100000,Абая 1,45,2,d,,\n" \
+              "sell,200000,Абая 2,60,3,d,43.238,76.945\n"
+
+    response = client.post("/shanyraks/import", headers=headers,
+                           files={"file": ("feed.csv", content.encode(), "text/csv")})
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {"inserted": 2, "failed": 0, "errors": []}
+
+
+def test_export_streams_the_filtered_catalog_in_id_order(client, announce):
+    created = [announce(type="rent"), announce(type="sell"), announce(type="rent")]
+
+    response = client.get("/shanyraks/export", params={"_type": "rent"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == [created[0], created[2]]
+
+
+def test_export_gzip(client, announce):
+    id = announce()
+
+    response = client.get("/shanyraks/export", params={"gzip": "true"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx decodes the gzip stream
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [id]
@@ -0,0 +1,28 @@
+import re
+
+from app.instrumentation import after_cursor_execute
+
+
+def test_server_timing_counts_the_queries_of_the_request(client, announce):
+    id = announce()
+
+    response = client.get(f"/shanyraks/{id}/comments")
+
+    assert re.fullmatch(r'db;dur=[\d.]+;desc="2 queries"', response.headers["server-timing"])
+
+
+def test_metrics_are_labelled_by_route_template(client, announce):
+    id = announce()
+    client.get(f"/shanyraks/{id}")
+
+    metrics = client.get("/metrics").text
+
+    assert 'http_request_duration_seconds_count{method="GET",route="/shanyraks/{id}",status="200"}' in metrics
+    assert "db_query_seconds_count" in metrics
+
+
+def test_statement_without_a_start_time_is_not_timed():
+    class Connection:
+        info = {}
+
+    after_cursor_execute(Connection(), None, "SELECT 1", (), None, False)
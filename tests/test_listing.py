@@ -0,0 +1,190 @@
+import pytest
+
+from app.pagination import encode_cursor
+from app.repositories import announcement_repository
+
+# Алматы, a listing 1 km away and Астана
+ALMATY = (43.2380, 76.9450)
+NEAR_ALMATY = (43.2470, 76.9450)
+ASTANA = (51.1605, 71.4704)
+
+
+def listing(client, **params) -> dict:
+    response = client.get("/shanyraks", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def ids(page: dict) -> list:
+    return [announcement["id"] for announcement in page["announcement"]]
+
+
+def test_cursor_pages_cover_the_listing_once(client, announce):
+    created = [announce(address=f"Абая {i}") for i in range(25)]
+
+    seen, cursor = [], None
+    while True:
+        page = listing(client, limit=10, **({"cursor": cursor} if cursor else {}))
+        seen += ids(page)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == sorted(created, reverse=True)
+    assert page["total"] == 25
+
+
+def test_cursor_skips_the_rows_before_it(client, announce):
+    created = [announce() for _ in range(5)]
+
+    page = listing(client, limit=10, cursor=encode_cursor(created[3]))
+
+    assert ids(page) == [created[2], created[1], created[0]]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "e30", encode_cursor("abc"), encode_cursor(1, 2)])
+def test_bad_cursor_is_rejected(client, announce, cursor):
+    announce()
+
+    response = client.get("/shanyraks", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.json()["detail"]["msg"] == "Invalid cursor"
+
+
+def test_cursor_is_rejected_for_relevance_and_distance_order(client):
+    cursor = encode_cursor(10)
+
+    assert client.get("/shanyraks", params={"cursor": cursor, "q": "абая"}).status_code == 400
+    assert client.get("/shanyraks", params={"cursor": cursor, "sort": "price"}).status_code == 400
+    assert client.get("/shanyraks", params={"cursor": cursor, "lat": ALMATY[0], "lon": ALMATY[1]}).status_code == 400
+
+
+def test_total_modes(client, announce):
+    for _ in range(3):
+        announce()
+
+    assert listing(client, total="exact")["total"] == 3
+    assert listing(client, total="estimate")["total"] == 3
+    assert listing(client, total="none")["total"] is None
+
+
+def test_total_follows_new_listings(client, announce):
+    announce()
+    assert listing(client)["total"] == 1
+
+    announce()
+    assert listing(client)["total"] == 2
+
+
+def test_q_matches_address_and_description(client, announce):
+    abaya = announce(address="Абая 10", description="светлая квартира")
+    dostyk = announce(address="Достык 5", description="рядом с Абая")
+    announce(address="Сатпаева 1", description="новостройка")
+
+    assert sorted(ids(listing(client, q="абая"))) == sorted([abaya, dostyk])
+    # terms match as prefixes, every term has to match
+    assert ids(listing(client, q="светл кварт")) == [abaya]
+    assert listing(client, q="Аль-Фараби")["announcement"] == []
+
+
+def test_q_follows_updates(client, headers, announce):
+    id = announce(address="Абая 10")
+    body = {"type": "rent", "price": 1, "address": "Достык 5", "area": 45, "rooms_count": 2, "description": "d"}
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=body).status_code == 200
+
+    assert listing(client, q="абая")["announcement"] == []
+    assert ids(listing(client, q="достык")) == [id]
+
+
+def test_q_without_full_text_search_is_rejected(client, announce, monkeypatch):
+    announce()
+    monkeypatch.setattr(announcement_repository, "search_backend", None)
+
+    response = client.get("/shanyraks", params={"q": "абая"})
+
+    assert response.status_code == 400
+    # no terms, no search
+    assert listing(client, q="  ")["total"] == 1
+
+
+def test_radius_keeps_the_listings_around_the_point_nearest_first(client, announce):
+    near = announce(lat=NEAR_ALMATY[0], lon=NEAR_ALMATY[1])
+    center = announce(lat=ALMATY[0], lon=ALMATY[1])
+    announce(lat=ASTANA[0], lon=ASTANA[1])
+    announce()
+
+    page = listing(client, lat=ALMATY[0], lon=ALMATY[1], radius_km=5)
+
+    assert ids(page) == [center, near]
+    assert page["total"] == 2
+    assert page["announcement"][0]["distance_km"] == 0
+    assert page["announcement"][1]["distance_km"] == pytest.approx(1.0, abs=0.05)
+
+
+def test_radius_follows_moved_listings(client, headers, announce):
+    id = announce(lat=ASTANA[0], lon=ASTANA[1])
+    body = {"type": "rent", "price": 1, "address": "a", "area": 45, "rooms_count": 2, "description": "d",
+            "lat": ALMATY[0], "lon": ALMATY[1]}
+    assert client.patch(f"/shanyraks/{id}", headers=headers, json=body).status_code == 200
+
+    assert ids(listing(client, lat=ALMATY[0], lon=ALMATY[1], radius_km=5)) == [id]
+
+
+def test_bbox_keeps_the_listings_inside(client, announce):
+    announce(lat=ALMATY[0], lon=ALMATY[1])
+    astana = announce(lat=ASTANA[0], lon=ASTANA[1])
+
+    page = listing(client, bbox="71,51,72,52")
+
+    assert ids(page) == [astana]
+    assert page["total"] == 1
+
+
+def test_bbox_combines_with_the_other_filters(client, announce):
+    announce(lat=ASTANA[0], lon=ASTANA[1], type="sell")
+    rent = announce(lat=ASTANA[0], lon=ASTANA[1], type="rent")
+
+    assert ids(listing(client, bbox="71,51,72,52", _type="rent")) == [rent]
+
+
+@pytest.mark.parametrize("params", [
+    {"bbox": "1,2,3"},
+    {"bbox": "a,b,c,d"},
+    {"lat": 43.2},
+    {"radius_km": 5},
+])
+def test_bad_geo_filters_are_rejected(client, params):
+    assert client.get("/shanyraks", params=params).status_code == 400
+
+
+def test_area_range(client, announce):
+    announce(area=30)
+    middle = announce(area="55,5 м²")
+    announce(area=90)
+
+    page = listing(client, area_from=50, area_until=60)
+
+    assert ids(page) == [middle]
+    assert page["announcement"][0]["area"] == 55.5
+
+
+def test_sort_by_price(client, announce):
+    expensive = announce(price=300000)
+    cheap = announce(price=100000)
+
+    assert ids(listing(client, sort="price")) == [cheap, expensive]
+
+
+def test_facets(client, announce):
+    announce(type="rent", rooms_count=1)
+    announce(type="rent", rooms_count=2)
+    announce(type="sell", rooms_count=2)
+
+    response = client.get("/shanyraks/facets", params={"rooms_count": 2})
+
+    assert response.status_code == 200
+    facets = response.json()
+    assert facets["total"] == 2
+    assert {item["value"]: item["count"] for item in facets["type"]} == {"rent": 1, "sell": 1}
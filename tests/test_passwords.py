@@ -0,0 +1,77 @@
+import pytest
+
+from app.database import SessionLocal
+from app.passwords import PasswordHasher, PasswordHasherBusy, hash_password, needs_rehash, verify_password
+from app.repositories.users_repository import User
+
+
+def stored_password(username: str) -> str:
+    with SessionLocal() as db:
+        return db.query(User.password).filter(User.username == username).scalar()
+
+
+def test_hash_and_verify():
+    stored = hash_password("secret", iterations=1000)
+
+    assert stored.startswith("pbkdf2_sha256$1000$")
+    assert verify_password("secret", stored)
+    assert not verify_password("wrong", stored)
+    # a new salt every time
+    assert hash_password("secret", iterations=1000) != stored
+
+
+@pytest.mark.parametrize("stored", [
+    "pbkdf2_sha256$1000$abc",
+    "pbkdf2_sha256$0$YWJj$YWJj",
+    "pbkdf2_sha256$many$YWJj$YWJj",
+    "pbkdf2_sha256$1000$not base64!$YWJj",
+])
+def test_malformed_hashes_never_match(stored):
+    assert not verify_password("secret", stored)
+    assert not needs_rehash(stored, iterations=1000)
+
+
+def test_plain_text_only_with_allow_plain_text():
+    assert not verify_password("secret", "secret")
+    assert verify_password("secret", "secret", allow_plain_text=True)
+    assert needs_rehash("secret", iterations=1000, allow_plain_text=True)
+
+
+def test_needs_rehash_below_the_configured_iterations():
+    assert needs_rehash(hash_password("secret", iterations=500), iterations=1000)
+    assert not needs_rehash(hash_password("secret", iterations=1000), iterations=1000)
+
+
+def test_passwords_are_stored_hashed(client, login):
+    login("aigerim")
+
+    assert stored_password("aigerim").startswith("pbkdf2_sha256$")
+
+
+def test_login_upgrades_weaker_hashes(client, login):
+    login("aigerim")
+    with SessionLocal() as db:
+        db.query(User).filter(User.username == "aigerim").update({"password": hash_password("secret", iterations=500)})
+        db.commit()
+
+    response = client.post("/auth/users/login", data={"username": "aigerim", "password": "secret"})
+
+    assert response.status_code == 200
+    assert stored_password("aigerim").startswith("pbkdf2_sha256$1000$")
+
+
+def test_plain_text_passwords_are_rejected_on_login(client, login):
+    login("aigerim")
+    with SessionLocal() as db:
+        db.query(User).filter(User.username == "aigerim").update({"password": "secret"})
+        db.commit()
+
+    assert client.post("/auth/users/login", data={"username": "aigerim", "password": "secret"}).status_code == 401
+
+
+def test_full_queue_fails_fast():
+    hasher = PasswordHasher(workers=1, queue_size=0, iterations=1000)
+    hasher.slots.acquire()
+
+    with pytest.raises(PasswordHasherBusy):
+        hasher.hash("secret")
@@ -0,0 +1,77 @@
+from app.database import SessionLocal
+from app.pagination import encode_cursor
+from app.popular import rebuild_popular
+
+
+def popular(client, **params) -> dict:
+    response = client.get("/shanyraks/popular", params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def ids(page: dict) -> list:
+    return [item["id"] for item in page["shanyraks"]]
+
+
+def test_favorites_weigh_more_than_comments(client, headers, announce):
+    favorited, commented, _ = announce(), announce(), announce()
+    assert client.post(f"/auth/users/favorites/shanyraks/{favorited}", headers=headers).status_code == 200
+    for content in ("раз", "два"):
+        assert client.post(f"/shanyraks/{commented}/comments", headers=headers, json={"content": content}).status_code == 200
+
+    page = popular(client)
+
+    assert ids(page) == [favorited, commented]
+    assert [(item["favorites_count"], item["comments_count"], item["score"]) for item in page["shanyraks"]] == \
+        [(1, 0, 3), (0, 2, 2)]
+    assert page["shanyraks"][0]["city"] == "Алматы"
+
+
+def test_unfavorite_lowers_the_score(client, headers, announce):
+    id = announce()
+    assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+    assert client.delete(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+
+    assert popular(client)["shanyraks"] == []
+
+
+def test_city_feed(client, headers, login, announce):
+    almaty = announce()
+    astana = announce(headers=login("bauyrzhan", city="Астана"))
+    for id in (almaty, astana):
+        assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+
+    assert ids(popular(client, city="Астана")) == [astana]
+
+
+def test_cursor_pages_cover_the_ranking_once(client, headers, announce):
+    created = [announce() for _ in range(3)]
+    for id in created:
+        assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+
+    seen, cursor = [], None
+    while True:
+        page = popular(client, limit=2, **({"cursor": cursor} if cursor else {}))
+        seen += ids(page)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    # equal scores, the newest first
+    assert seen == sorted(created, reverse=True)
+
+
+def test_bad_popular_cursor_is_rejected(client):
+    assert client.get("/shanyraks/popular", params={"cursor": encode_cursor(1)}).status_code == 400
+
+
+def test_rebuild_picks_up_changed_owner_cities(client, headers, announce):
+    id = announce()
+    assert client.post(f"/auth/users/favorites/shanyraks/{id}", headers=headers).status_code == 200
+    response = client.patch("/auth/users/me", headers=headers, json={"phone": "+77020000000", "name": "A", "city": "Астана"})
+    assert response.status_code == 200
+    assert popular(client, city="Астана")["shanyraks"] == []
+
+    assert rebuild_popular(SessionLocal) == 1
+
+    assert ids(popular(client, city="Астана")) == [id]
@@ -0,0 +1,130 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+from app import main
+from app.auth import encode
+from app.database import SessionLocal
+from app.repositories.announcement_repository import Announcement
+from app.repositories.comments_repository import Comment, CommentCreate
+from app.repositories.favorites_repository import Favorites
+from app.repositories.users_repository import User
+from app.write_behind import Journal, WriteBehindQueue
+
+HEADERS = {"Authorization": f"Bearer {encode('1')}"}
+
+
+def seed():
+    with SessionLocal() as db:
+        db.add(User(id=1, username="aigerim", phone="", password="", name="", city="Алматы"))
+        db.add(Announcement(id=1, type="rent", price=1, address="Абая 10", area=45, rooms_count=2,
+                            description="", owner_id=1))
+        db.commit()
+
+
+def count(model) -> int:
+    with SessionLocal() as db:
+        return db.query(model).count()
+
+
+def segments(root) -> list:
+    return sorted(name for _, _, names in os.walk(root) for name in names if name.endswith(".ndjson"))
+
+
+# WRITE_BEHIND=1 in app.main, flushed by the tests instead of the timer
+@pytest.fixture
+def journal_dir(tmp_path):
+    return str(tmp_path / "journal")
+
+
+@pytest.fixture
+def queue(monkeypatch, journal_dir):
+    queue = WriteBehindQueue(SessionLocal, Journal(journal_dir, fsync=False), interval=60,
+                             on_flushed=main.invalidate_queued)
+    monkeypatch.setattr(main, "write_behind", queue)
+    return queue
+
+
+def test_writes_are_acknowledged_and_flushed(queue, journal_dir):
+    seed()
+    with TestClient(main.app) as client:
+        assert client.get("/shanyraks/1").json()["total_comments"] == 0
+        assert client.post("/shanyraks/1/comments", headers=HEADERS, json={"content": "hi"}).status_code == 202
+        assert client.post("/auth/users/favorites/shanyraks/1", headers=HEADERS).status_code == 202
+        assert count(Comment) == 0 and count(Favorites) == 0
+        assert len(segments(journal_dir)) == 1
+
+        assert queue.flush()
+
+        assert count(Comment) == 1 and count(Favorites) == 1
+        assert segments(journal_dir) == []
+        # the cached detail is dropped with the flush
+        assert client.get("/shanyraks/1").json()["total_comments"] == 1
+
+
+def test_unfavorite_before_the_flush(queue):
+    seed()
+    with TestClient(main.app) as client:
+        assert client.post("/auth/users/favorites/shanyraks/1", headers=HEADERS).status_code == 202
+        assert client.delete("/auth/users/favorites/shanyraks/1", headers=HEADERS).status_code == 202
+        assert queue.flush()
+
+        assert count(Favorites) == 0
+
+
+def test_shutdown_flushes_the_queue(queue, journal_dir):
+    seed()
+    with TestClient(main.app) as client:
+        assert client.post("/shanyraks/1/comments", headers=HEADERS, json={"content": "hi"}).status_code == 202
+
+    assert count(Comment) == 1
+    assert os.listdir(journal_dir) == ["replay.lock"]
+
+
+def test_journal_of_a_dead_worker_is_replayed_on_startup(queue, journal_dir):
+    seed()
+    dead = os.path.join(journal_dir, "worker-elsewhere-1")
+    os.makedirs(dead)
+    with open(os.path.join(dead, "000000000001.ndjson"), "w", encoding="utf-8") as file:
+        file.write(json.dumps({"op": "comment", "content": "из журнала", "author_id": 1, "announce_id": 1,
+                               "created_at": "2024-01-01T00:00:00"}) + "\n")
+        file.write(json.dumps({"op": "favorite", "user_id": 1, "announcement_id": 1, "address": "Абая 10"}) + "\n")
+        # cut off by the crash, never acknowledged
+        file.write('{"op": "comm')
+
+    with TestClient(main.app) as client:
+        assert count(Comment) == 1 and count(Favorites) == 1
+        assert not os.path.exists(dead)
+        assert client.get("/shanyraks/1").json()["total_comments"] == 1
+
+
+def test_retryable_errors_keep_the_writes(queue, journal_dir, monkeypatch):
+    seed()
+    queue.add_comment(CommentCreate(content="hi", author_id=1, announce_id=1))
+    apply = queue.apply
+
+    def locked(batch, db):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(queue, "apply", locked)
+    assert not queue.flush()
+    assert len(queue.pending) == 1 and len(segments(journal_dir)) == 1
+
+    monkeypatch.setattr(queue, "apply", apply)
+    assert queue.flush()
+    assert count(Comment) == 1 and segments(journal_dir) == []
+    queue.journal.close()
+
+
+def test_bad_writes_are_dropped(queue, journal_dir):
+    seed()
+    queue.add_comment(CommentCreate(content="ok", author_id=1, announce_id=1))
+    queue.submit({"op": "comment", "content": "without an announcement", "author_id": 1})
+
+    assert queue.flush()
+
+    assert count(Comment) == 1 and segments(journal_dir) == []
+    queue.journal.close()